@@ -0,0 +1,56 @@
+import sys, os, random, time, tempfile
+sys.path.append(os.path.dirname(__file__)+"/../src/")
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm import sessionmaker
+from lib.tkb import TheoremKB
+from lib.config import config
+from lib.misc import codec
+
+# Compare compression codecs on the XML and annotation layers of a sample of papers.
+# usage: python scripts/bench_codecs.py [n_papers]
+
+n_papers = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+session_factory = sessionmaker(bind=config.SQL_ENGINE)
+Session = scoped_session(session_factory)
+
+tkb = TheoremKB()
+session = Session()
+
+papers = tkb.list_papers(session)
+random.seed(0)
+papers = random.sample(papers, min(n_papers, len(papers)))
+
+samples = []
+for paper in papers:
+    if not paper.is_converted:
+        continue
+    samples.append(codec.read(paper._xml_file()))
+    for layer in paper.layers:
+        layer_file = codec.find(f"{paper.meta_path}/annot_{layer.id}.json")
+        if layer_file is not None:
+            samples.append(codec.read(layer_file))
+
+raw_size = sum(len(x) for x in samples)
+print(f"{len(samples)} files, {raw_size / 2**20:.1f} MB uncompressed")
+print(f"{'codec':<8}{'ratio':>8}{'write MB/s':>12}{'read MB/s':>12}")
+
+with tempfile.TemporaryDirectory() as tmp:
+    base_path = f"{tmp}/sample"
+    for name in codec.CODECS:
+        size, t_write, t_read = 0, 0.0, 0.0
+        for data in samples:
+            t0 = time.time()
+            with codec.write(base_path, name) as f:
+                f.write(data)
+            t_write += time.time() - t0
+
+            path = codec.find(base_path, name)
+            size += os.path.getsize(path)
+
+            t0 = time.time()
+            codec.read(path)
+            t_read += time.time() - t0
+
+        mb = raw_size / 2**20
+        print(f"{name:<8}{raw_size / max(size, 1):>8.2f}{mb / max(t_write, 1e-9):>12.1f}{mb / max(t_read, 1e-9):>12.1f}")
@@ -0,0 +1,47 @@
+import sys, os, random, time
+sys.path.append(os.path.dirname(__file__)+"/../src/")
+import pandas as pd
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm import sessionmaker
+from lib.tkb import TheoremKB
+from lib.config import config
+from lib.paper import features, tokens
+
+# Compare the feature backends ("dict" and "vectorized") on a sample of papers, checking that they agree.
+# Token tables are built beforehand, as they are persisted and shared with other consumers.
+# usage: python scripts/bench_features.py [n_papers]
+
+n_papers = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+session_factory = sessionmaker(bind=config.SQL_ENGINE)
+Session = scoped_session(session_factory)
+
+tkb = TheoremKB()
+session = Session()
+
+papers = tkb.list_papers(session)
+random.seed(0)
+papers = [p for p in random.sample(papers, min(n_papers, len(papers))) if p.is_converted]
+
+t_dict, t_vectorized, n_unsupported = 0.0, 0.0, 0
+for paper in papers:
+    styles = paper.get_xml_styles()
+    tables = {l: paper.get_tokens(l) for l in tokens.LEVELS}
+
+    t0 = time.time()
+    expected = features.build_features_dict_streaming(paper.open_xml)
+    t_dict += time.time() - t0
+
+    t0 = time.time()
+    actual = features.build_features_dict_from_tables(styles, tables)
+    t_vectorized += time.time() - t0
+
+    if actual is None:
+        n_unsupported += 1
+        continue
+    for level in expected:
+        pd.testing.assert_frame_equal(expected[level], actual[level])
+
+print(f"{len(papers)} papers, {n_unsupported} not supported by the vectorized backend")
+print(f"dict:       {t_dict:.2f}s")
+print(f"vectorized: {t_vectorized:.2f}s")
@@ -1,23 +1,26 @@
-import sys, os, time, argparse, shortuuid
+import sys, os, math, time, argparse, shortuuid
 import lxml.etree as ET
-from typing import Tuple
+import pandas as pd
+from typing import List, Tuple
 from tqdm import tqdm
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, cpu_count
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 from sklearn import metrics
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, KFold
 from termcolor import colored
 from joblib import Parallel, delayed
 from multiprocessing import Pool
 
 from lib.tkb import TheoremKB
 from lib.extractors import Extractor, TrainableExtractor
+from lib.extractors.crf import CRFExtractor
+from lib.models.sweep import parameter_space, evaluate, summarize
 from lib.paper import AnnotationLayerInfo
+from lib.annotations import layer_file
 from lib.misc.namespaces import *
 from lib.config import config
-from lib.misc.bounding_box import BBX
 
 session_factory = sessionmaker(bind=config.SQL_ENGINE)
 Session = scoped_session(session_factory)
@@ -43,6 +46,109 @@ def register(args):
     print("Added", added_papers, "papers!")
 
 
+def convert_paper(x: Tuple[str, argparse.Namespace]):
+    (paper_id, args) = x
+
+    session = Session()
+    paper = TheoremKB().get_paper(session, paper_id)
+    t0 = time.time()
+    try:
+        paper.convert(timeout=args.timeout, memory_limit=args.memory_limit)
+        error = None
+    except Exception as e:
+        error = str(e).replace("\n", " ")
+    session.close()
+
+    return paper_id, error, time.time() - t0
+
+
+def convert(args):
+    print("CONVERT")
+    tkb = TheoremKB()
+    session = Session()
+
+    log_path = args.log or f"{config.DATA_PATH}/convert_failures.log"
+    failed = set()
+    if args.skip_failed and os.path.exists(log_path):
+        with open(log_path, "r") as f:
+            failed = {line.split("\t")[0] for line in f}
+
+    papers = tkb.list_papers(session)
+    paper_ids = [
+        str(p.id)
+        for p in papers
+        if (args.force or not p.is_converted) and str(p.id) not in failed
+    ]
+    session.close()
+    print(f"{len(papers) - len(paper_ids)} papers skipped, {len(paper_ids)} to convert.")
+
+    args.func = None
+    n_failed = 0
+    with Pool(args.jobs) as p, open(log_path, "a") as log:
+        tasks = [(id, args) for id in paper_ids]
+        for paper_id, error, duration in tqdm(
+            p.imap_unordered(convert_paper, tasks), total=len(tasks)
+        ):
+            if error is not None:
+                n_failed += 1
+                log.write(f"{paper_id}\t{duration:.1f}s\t{error}\n")
+                log.flush()
+
+    print(f"Converted {len(paper_ids) - n_failed} papers, {n_failed} failures (see {log_path}).")
+
+
+def migrate_paper(paper_id: str) -> int:
+    session = Session()
+    paper = TheoremKB().get_paper(session, paper_id)
+    migrated = 0
+    for layer in paper.layers:
+        location = f"{paper.meta_path}/annot_{layer.id}.json"
+        path = layer_file(location)
+        if path is not None and not path.endswith(".bin"):  # previous format.
+            paper.get_annotation_layer(layer.id).save()
+            migrated += 1
+    session.close()
+    return migrated
+
+
+def migrate_layers(args):
+    print("MIGRATE LAYERS")
+    tkb = TheoremKB()
+    session = Session()
+    paper_ids = [str(p.id) for p in tkb.list_papers(session)]
+    session.close()
+
+    args.func = None
+    with Pool(args.jobs) as p:
+        migrated = sum(
+            tqdm(p.imap_unordered(migrate_paper, paper_ids), total=len(paper_ids))
+        )
+    print(f"Migrated {migrated} layers.")
+
+
+def migrate_paper_features(paper_id: str) -> int:
+    session = Session()
+    paper = TheoremKB().get_paper(session, paper_id)
+    migrated = int(paper.migrate_features())
+    session.close()
+    return migrated
+
+
+def migrate_features(args):
+    print("MIGRATE FEATURES")
+    tkb = TheoremKB()
+    session = Session()
+    paper_ids = [str(p.id) for p in tkb.list_papers(session)]
+    session.close()
+
+    args.func = None
+    with Pool(args.jobs) as p:
+        migrated = sum(
+            tqdm(p.imap_unordered(migrate_paper_features, paper_ids), total=len(paper_ids))
+        )
+    print(f"Migrated the features of {migrated} papers.")
+
+
 def remove_tag(args):
     print("REMOVE")
     tkb = TheoremKB()
@@ -64,20 +170,42 @@ def split(args):
     tkb = TheoremKB()
     session = Session()
 
-    if args.test + args.validation == 0:
-        print("No split to do (test == 0 && validation == 0)")
+    if args.test + args.validation == 0 and args.folds < 2:
+        print("No split to do (test == 0 && validation == 0 && folds < 2)")
         return
 
     tags = tkb.list_layer_tags(session)
 
+    if args.folds >= 2:
+        tag_names = {tag.name for tag in tags}
+        for tag in filter(lambda x: x.name == args.tag, tags):
+            if len(tag.layers) < args.folds:
+                print(f"Cannot split {len(tag.layers)} layers in {args.folds} folds.")
+                return
+            if any(f"{tag.name} (fold {i})" in tag_names for i in range(args.folds)):
+                print(f"Folds of {tag.name} already exist, remove them first (`remove-tag`).")
+                return
+
     for tag in filter(lambda x: x.name == args.tag, tags):
-        if args.test + args.validation > 0 and len(tag.layers) > 0:
+        if args.folds >= 2:
+            folds = KFold(n_splits=args.folds, shuffle=True, random_state=args.seed).split(tag.layers)
+            for i, (_, fold_indices) in enumerate(folds):
+                tag_db = tkb.add_layer_tag(session, shortuuid.uuid(), f"{tag.name} (fold {i})", False, {})
+                for index in fold_indices:
+                    tag.layers[index].tags.append(tag_db)
+
+        if args.test + args.validation == 0:
+            continue
+
+        if len(tag.layers) > 0:
             layers_train, layers_test = train_test_split(
-                tag.layers, test_size=args.test + args.validation
+                tag.layers, test_size=args.test + args.validation, random_state=args.seed
             )
             if args.validation > 0:
                 layers_val, layers_test = train_test_split(
-                    layers_test, test_size=args.test / (args.test + args.validation)
+                    layers_test,
+                    test_size=args.test / (args.test + args.validation),
+                    random_state=args.seed,
                 )
             else:
                 layers_val = []
@@ -99,6 +227,23 @@ def split(args):
     session.commit()
 
 
+def chunks(items: List, chunk_size: int, n_workers: int) -> List[List]:
+    """Split items in chunks of at most `chunk_size` items, small enough that each of the `n_workers` gets one."""
+    chunk_size = max(1, min(chunk_size, math.ceil(len(items) / n_workers)))
+    return [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def tagged_layers(tkb: TheoremKB, session, tag_name: str, class_id: str):
+    """(paper, layer) pairs of the papers having a layer of given class with given tag."""
+    documents = []
+    for paper in tkb.list_papers(session):
+        for layer in paper.layers:
+            if any((tag.name == tag_name for tag in layer.tags)) and layer.class_ == class_id:
+                documents.append((paper, layer))
+                break
+    return documents
+
+
 def train(args):
     print("TRAIN")
     tkb = TheoremKB()
@@ -107,23 +252,12 @@ def train(args):
     extractor = tkb.extractors[args.extractor]
     class_id = extractor.class_.name
 
-    annotated_papers_train = []
-    for paper in tkb.list_papers(session):
-        for layer in paper.layers:  # TODO: select the most recent layer.
-            if any((tag.name == args.train_tag for tag in layer.tags)) and layer.class_ == class_id:
-                annotated_papers_train.append((paper, layer))
-                break
+    # TODO: select the most recent layer.
+    annotated_papers_train = tagged_layers(tkb, session, args.train_tag, class_id)
 
     annotated_papers_test = []
-    if args.val_layer is not None:
-        for paper in tkb.list_papers(session):
-            for layer in paper.layers:
-                if (
-                    any((tag.name == args.val_tag for tag in layer.tags))
-                    and layer.class_ == class_id
-                ):
-                    annotated_papers_test.append((paper, layer))
-                    break
+    if args.val_tag is not None:
+        annotated_papers_test = tagged_layers(tkb, session, args.val_tag, class_id)
 
     if len(annotated_papers_train) == 0:
         print("No training layer found using this tag.")
@@ -140,57 +274,49 @@ def train(args):
 
     print("Trained! Testing..")
     print("Train results:")
-    test(args, args.layer)
-    print("Test results:")
-    test(args, args.val_layer)
+    test(args, args.train_tag)
+    if args.val_tag is not None:
+        print("Test results:")
+        test(args, args.val_tag)
 
 
-def test(args, test_layer=None):
+def test(args, test_tag=None):
     print("TEST")
     tkb = TheoremKB()
     session = Session()
 
-    if test_layer is None:
-        test_layer = args.layer
+    if test_tag is None:
+        test_tag = args.test_tag
 
     extractor = tkb.extractors[args.extractor]
     class_id = extractor.class_.name
 
-    annotated_papers = []
-    for paper in tkb.list_papers(session):
-        for layer in paper.layers:
-            if any((tag.name == args.test_tag for tag in layer.tags)) and layer.class_ == class_id:
-                annotated_papers.append((paper, layer))
-                break
+    annotated_papers = tagged_layers(tkb, session, test_tag, class_id)
 
     if args.n is not None:
         annotated_papers = annotated_papers[: args.n]
 
-    def compare_layers(paper, true, pred):
-        y = []
-        y_pred = []
-
-        for token in paper.get_xml().getroot().findall(f".//{ALTO}String"):
-            bbx = BBX.from_element(token)
-            y.append(true.get_label(bbx))
-            y_pred.append(pred.get_label(bbx))
-        return y, y_pred
-
-    def test_paper(paper, layer, args):
-        layer_pred = extractor.apply(paper, [], args)  # todo: parameters.
-        layer_true = paper.get_annotation_layer(layer.id)
-        return compare_layers(paper, layer_true, layer_pred)
+    def test_papers(documents, args):
+        papers = [paper for paper, _ in documents]
+        layers_pred = extractor.apply_many(papers, [[] for _ in papers], args)  # todo: parameters.
+        res = []
+        for (paper, layer), layer_pred in zip(documents, layers_pred):
+            y = paper.get_token_labels(layer.id, f"{ALTO}String")
+            y_pred = layer_pred.get_labels(paper.get_tokens(f"{ALTO}String"))
+            res.append((list(y), list(y_pred)))
+        return res
 
     args.func = None
     if args.single_core:
-        res = [test_paper(paper, layer, args) for paper, layer in tqdm(annotated_papers)]
+        res = [test_papers(chunk, args) for chunk in tqdm(chunks(annotated_papers, args.chunk_size, 1))]
     else:
         res = Parallel(n_jobs=-1)(
-            delayed(test_paper)(paper, layer, args) for paper, layer in tqdm(annotated_papers)
+            delayed(test_papers)(chunk, args)
+            for chunk in tqdm(chunks(annotated_papers, args.chunk_size, cpu_count()))
         )
 
     y, y_pred = [], []
-    for y_paper, y_pred_paper in res:
+    for y_paper, y_pred_paper in (x for chunk_res in res for x in chunk_res):
         y.extend(y_paper)
         y_pred.extend(y_pred_paper)
 
@@ -198,35 +324,120 @@ def test(args, test_layer=None):
     print(metrics.classification_report(y, y_pred, labels=sorted_labels, digits=3))
 
 
-def process_paper(x: Tuple[str, str, str, Extractor]):
-    (tag_id, paper_id, args, extractor) = x
-
+def sweep(args):
+    print("SWEEP")
     tkb = TheoremKB()
     session = Session()
-    paper = tkb.get_paper(session, paper_id)
+    t0 = time.time()
 
-    for layer in paper.layers:
-        if any((tag.name == args.name for tag in layer.tags)) and layer.class_ == extractor.class_.name:
-            print("skipped.", end="")
+    extractor = tkb.extractors[args.extractor]
+    if not isinstance(extractor, CRFExtractor):
+        print("Only CRF extractors can be tuned.")
+        return
+    class_id = extractor.class_.name
+
+    documents = tagged_layers(tkb, session, args.tag, class_id)
+    if args.folds >= 2:  # folds tagged by `split --folds`.
+        folds = [
+            {paper.id for paper, _ in tagged_layers(tkb, session, f"{args.tag} (fold {i})", class_id)}
+            for i in range(args.folds)
+        ]
+        if any(len(fold) == 0 for fold in folds):
+            print(f"Missing folds, use `split {args.tag} --folds {args.folds}` first.")
             return
+    elif args.val_tag is not None:
+        validation = tagged_layers(tkb, session, args.val_tag, class_id)
+        folds = [{paper.id for paper, _ in validation}]
+        known = {paper.id for paper, _ in documents}
+        documents += [(paper, layer) for paper, layer in validation if paper.id not in known]
+    else:
+        print("No validation data: use a validation tag or folds.")
+        return
 
-    if paper.id in set(["1709.05182"]):
+    if len(documents) == 0:
+        print("No training layer found using this tag.")
         return
 
-    print(">>", paper_id)
+    # sequences are featurized once, and shared by all configurations.
+    only = extractor.label_filter(args.only)
+    corpus = extractor.build_corpus(documents, only, args.balance, args.single_core)
+    paper_ids = {paper.id for paper, _ in documents}
+    labels = sorted(only if only is not None else extractor.class_.labels)
+
+    configurations = parameter_space(
+        {"c1": args.c1, "c2": args.c2, "min_freq": args.min_freq, "max_iter": args.max_iter},
+        args.n_iter,
+        args.seed,
+    )
+    tasks = [
+        (corpus.directory, parameters, i, paper_ids - fold, fold, labels)
+        for parameters in configurations
+        for i, fold in enumerate(folds)
+    ]
+    print(f"{len(configurations)} configurations, {len(folds)} folds, {len(documents)} papers.")
+
+    with Pool(args.jobs) as p:
+        results = pd.DataFrame(list(tqdm(p.imap_unordered(evaluate, tasks), total=len(tasks))))
+
+    output = args.output or f"{config.DATA_PATH}/sweep_{args.extractor}.csv"
+    results.sort_values(["f1", "fold"], ascending=[False, True]).to_csv(output, index=False)
+    print(summarize(results).to_string(index=False))
+    print(f"Took {time.time() - t0:.1f}s, results of each fold written to {output}.")
+
+
+def process_papers(x: Tuple[str, List[str], argparse.Namespace, Extractor]):
+    (tag_id, paper_ids, args, extractor) = x
+
+    tkb = TheoremKB()
+    session = Session()
+
+    papers = []
+    for paper_id in paper_ids:
+        paper = tkb.get_paper(session, paper_id)
+
+        if any(
+            any((tag.name == args.name for tag in layer.tags)) and layer.class_ == extractor.class_.name
+            for layer in paper.layers
+        ):
+            print("skipped.", end="")
+            continue
+
+        if paper.id in set(["1709.05182"]):
+            continue
+
+        print(">>", paper_id)
+        papers.append(paper)
 
     tag = tkb.get_layer_tag(session, tag_id)
 
     try:
-        new_layer = extractor.apply_and_save(paper, [], args)
-        if extractor.class_.name == "header":
-            paper.title = "__undef__"
-        new_layer.tags.append(tag)
-        
-        session.commit()
-        session.close()
+        results = extractor.apply_many(papers, [[] for _ in papers], args)
     except Exception:
-        print(paper.id, "failed")
+        # apply the extractor to each paper, so that a failure only concerns one paper.
+        results = []
+        for paper in papers:
+            try:
+                results.append(extractor.apply(paper, [], args))
+            except Exception:
+                print(paper.id, "failed")
+                results.append(None)
+
+    # each paper is saved and committed on its own.
+    for paper, annotations in zip(papers, results):
+        if annotations is None:
+            continue
+        try:
+            new_layer = extractor.save(paper, annotations)
+            if extractor.class_.name == "header":
+                paper.title = "__undef__"
+            new_layer.tags.append(tag)
+
+            session.commit()
+        except Exception:
+            session.rollback()
+            print(paper.id, "failed")
+
+    session.close()
 
 
 def apply(args):
@@ -261,12 +472,14 @@ def apply(args):
 
     args.func = None
 
+    n_workers = 1 if args.single_core else 7
+    tasks = [(tag_id, chunk, args, extractor) for chunk in chunks(paper_ids, args.chunk_size, n_workers)]
     if args.single_core:
-        for id in tqdm(paper_ids):
-            process_paper((tag_id, id, args, extractor))
+        for task in tqdm(tasks):
+            process_papers(task)
     else:
-        with Pool(7) as p:
-            p.map(process_paper, [(tag_id, id, args, extractor) for id in paper_ids])
+        with Pool(n_workers) as p:
+            p.map(process_papers, tasks)
 
 
 def bench(args):
@@ -290,7 +503,8 @@ def features(args):
 
     def process_paper(paper):
         try:
-            paper._build_features(force=True)
+            # with --stale-only, only the levels whose feature extractor changed are recomputed.
+            paper._update_features(force=not args.stale_only)
         except Exception as e:
             print(paper.id, "failed:", e)
 
@@ -385,13 +599,18 @@ if __name__ == "__main__":
             extractor.add_args(parser_extractor)
             extractor.add_train_args(parser_extractor)
 
-    parser_train.add_argument("train-tag", type=str, help="Take all layers that have given tag.")
+    parser_train.add_argument(
+        "train_tag", metavar="train-tag", type=str, help="Take all layers that have given tag."
+    )
     parser_train.add_argument(
         "-v", "--val-tag", type=str, default=None, help="Use this tag for validation."
     )
 
     parser_train.add_argument("-n", type=int, default=None)
     parser_train.add_argument("-s", "--single-core", action="store_true")
+    parser_train.add_argument(
+        "--chunk-size", type=int, default=16, help="Number of papers given to the extractor at once when testing."
+    )
     parser_train.set_defaults(func=train)
 
     # split
@@ -399,13 +618,20 @@ if __name__ == "__main__":
     parser_split.add_argument("tag")
     parser_split.add_argument("-t", "--test", type=float, default=0)
     parser_split.add_argument("-v", "--validation", type=float, default=0)
+    parser_split.add_argument(
+        "-k", "--folds", type=int, default=0, help="Also tag the layers in k folds, `<tag> (fold <i>)`."
+    )
+    parser_split.add_argument("--seed", type=int, default=None, help="Seed of the random splits.")
     parser_split.set_defaults(func=split)
 
     # test
     parser_test = subparsers.add_parser("test")
-    parser_test.add_argument("test-tag", type=str)
+    parser_test.add_argument("test_tag", metavar="test-tag", type=str)
     parser_test.add_argument("-n", type=int, default=None)
     parser_test.add_argument("-s", "--single-core", action="store_true")
+    parser_test.add_argument(
+        "--chunk-size", type=int, default=16, help="Number of papers given to the extractor at once."
+    )
 
     subparsers_test = parser_test.add_subparsers(dest="extractor")
     subparsers_test.required = True
@@ -415,11 +641,62 @@ if __name__ == "__main__":
 
     parser_test.set_defaults(func=test)
 
+    # sweep
+    parser_sweep = subparsers.add_parser("sweep")
+    parser_sweep.add_argument("extractor", type=str)
+    parser_sweep.add_argument("tag", type=str, help="Take all layers that have given tag.")
+    parser_sweep.add_argument(
+        "-v", "--val-tag", type=str, default=None, help="Use this tag for validation."
+    )
+    parser_sweep.add_argument(
+        "-k", "--folds", type=int, default=0, help="Cross-validate on the folds tagged by `split --folds`."
+    )
+    parser_sweep.add_argument("--c1", nargs="+", type=float, default=[0.1])
+    parser_sweep.add_argument("--c2", nargs="+", type=float, default=[0.1])
+    parser_sweep.add_argument("--min-freq", nargs="+", type=int, default=[1])
+    parser_sweep.add_argument("--max-iter", nargs="+", type=int, default=[500])
+    parser_sweep.add_argument("--only", nargs="*", type=str)
+    parser_sweep.add_argument("--balance", action="store_true")
+    parser_sweep.add_argument(
+        "-n", "--n-iter", type=int, default=None, help="Sample n configurations (whole grid by default)."
+    )
+    parser_sweep.add_argument("--seed", type=int, default=0)
+    parser_sweep.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser_sweep.add_argument("-s", "--single-core", action="store_true")
+    parser_sweep.add_argument("-o", "--output", type=str, default=None, help="Results file (CSV).")
+    parser_sweep.set_defaults(func=sweep)
+
     # register
     parser_register = subparsers.add_parser("register")
     parser_register.add_argument("path", type=str)
     parser_register.set_defaults(func=register)
 
+    # convert
+    parser_convert = subparsers.add_parser("convert")
+    parser_convert.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser_convert.add_argument(
+        "-t", "--timeout", type=float, default=300, help="Per-PDF timeout (seconds)."
+    )
+    parser_convert.add_argument(
+        "-m", "--memory-limit", type=int, default=None, help="Per-PDF memory limit (MB)."
+    )
+    parser_convert.add_argument("--force", action="store_true", help="Convert already converted papers.")
+    parser_convert.add_argument(
+        "--skip-failed", action="store_true", help="Skip papers listed in the failure log."
+    )
+    parser_convert.add_argument("--log", type=str, default=None, help="Failure log location.")
+    parser_convert.set_defaults(func=convert)
+
+    # migrate-layers
+    parser_migrate = subparsers.add_parser("migrate-layers")
+    parser_migrate.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser_migrate.set_defaults(func=migrate_layers)
+
+    # migrate-features
+    parser_migrate_features = subparsers.add_parser("migrate-features")
+    parser_migrate_features.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser_migrate_features.set_defaults(func=migrate_features)
+
     # remove
     parser_remove = subparsers.add_parser("remove-tag")
     parser_remove.add_argument("tag", type=str)
@@ -432,6 +709,11 @@ if __name__ == "__main__":
 
     # features
     parser_features = subparsers.add_parser("features")
+    parser_features.add_argument(
+        "--stale-only",
+        action="store_true",
+        help="Only compute missing features and the ones computed by a previous version of their extractor.",
+    )
     parser_features.set_defaults(func=features)
 
     # title
@@ -443,6 +725,9 @@ if __name__ == "__main__":
     parser_apply.add_argument("extractor", type=str)
     parser_apply.add_argument("-n", "--name", type=str, default=None)
     parser_apply.add_argument("-s", "--single-core", action="store_true")
+    parser_apply.add_argument(
+        "--chunk-size", type=int, default=16, help="Number of papers given to the extractor at once."
+    )
     parser_apply.set_defaults(func=apply)
 
     # bench
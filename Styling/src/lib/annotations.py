@@ -14,16 +14,30 @@ ann.add_box(LabelledBBX("footer", 2, 1, 10, 830, 400, 850))
 ann.reduce()    # boxes that are close together are merged.
 ann.save()      # save to file.
 ```
+
+Layers are saved in the binary format of `lib.misc.layer_file`, which is memory-mapped when loading:
+boxes are only decoded when accessed, and bulk operations (`AnnotationLayer.get_labels`, index construction)
+read the box arrays directly. Layers saved by previous versions (`annot_*.json.bz2`) are still readable
+and are converted when saved again, or by `python cli.py migrate-layers`.
+
+Single box edits can be saved with `AnnotationLayer.save_edits`, which appends them to a journal next to
+the layer instead of writing the whole layer. The journal is replayed when loading the layer, and folded
+into it once it holds `layer_journal_size` edits.
 """
 from __future__ import annotations
 
-import jsonpickle, bz2, shortuuid, lxml.etree as ET
-from typing import Callable, Dict, Optional, List, Tuple
+import os, glob, time, json, shutil, jsonpickle, shortuuid, lxml.etree as ET
+import numpy as np
+from typing import Callable, Dict, Iterator, Optional, List, Tuple
+from collections.abc import MutableMapping
 from rtree import index
 from copy import copy
+from bisect import bisect_left, bisect_right
 
 
 from .misc.bounding_box import LabelledBBX, BBX
+from .misc import codec, layer_file as binary_layer
+from .config import config
 
 
 class AnnotationLayer:
@@ -41,6 +55,11 @@ class AnnotationLayer:
     _id_map: Dict[int, str]  # spatial index ID to box ID
     _map_id: Dict[str, int]  # box ID to spatial index ID
     _last_c: int
+    _token_labels: Dict[Tuple[str, str], np.ndarray]  # label vectors, by token level and mode
+    _dirty: bool  # modified since loaded or saved
+    _persisted_index: bool  # spatial index is backed by the files written with the layer
+    _edits: Optional[List[dict]]  # journal records of the edits not saved yet, None after bulk changes
+    _journal_length: int  # number of records in the journal file
 
     def __init__(self, location: Optional[str] = None) -> None:
 
@@ -49,25 +68,110 @@ class AnnotationLayer:
             self.bbxs = {}
         else:
             try:
-                with bz2.BZ2File(location + ".bz2", "r") as f:
-                    self.bbxs = jsonpickle.decode(f.read().decode())
+                self.bbxs = _load_boxes(location)
             except Exception as e:
                 print("Loading failed:", str(e))
                 self.bbxs = {}
 
-        self._dbs = {}
-        self._id_map = {}
-        self._map_id = {}
-        self._last_c = 0
+        self._token_labels = {}
+        self._dirty = False
+        self._edits = []
+        self._journal_length = 0 if location is None else self._replay_journal()
 
         # construct spatial index
-        for id, box in self.bbxs.items():
-            if box.page_num not in self._dbs:
-                self._dbs[box.page_num] = index.Index()
-            self._dbs[box.page_num].insert(self._last_c, box.to_coor())
-            self._id_map[self._last_c] = id
-            self._map_id[id] = self._last_c
-            self._last_c += 1
+        if (
+            location is None
+            or not config.PERSIST_LAYER_INDEX
+            or self._journal_length > 0  # persisted index is outdated.
+            or not self._load_index()
+        ):
+            self._build_index()
+
+    @staticmethod
+    def from_boxes(boxes: List[LabelledBBX]) -> AnnotationLayer:
+        """
+        Build a layer from a list of boxes, bulk-loading the spatial index.
+        """
+        layer = AnnotationLayer()
+        layer.bbxs = {shortuuid.uuid(): box for box in boxes}
+        layer._edits = None
+        layer._build_index()
+        return layer
+
+    def _arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Page numbers, (n, 4) coordinates and labels of the boxes, in box order."""
+        if isinstance(self.bbxs, _LazyBoxes) and self.bbxs.is_lazy:
+            data = self.bbxs.data
+            return np.asarray(data.rows["page_num"]), data.coordinates(), data.label_array()
+
+        boxes = list(self.bbxs.values())
+        pages, coords = _box_arrays(boxes)
+        return pages, coords, np.array([b.label for b in boxes], dtype=object)
+
+    def _index_entries(self) -> Dict[int, list]:
+        """Spatial index entries by page, numbered in box order."""
+        pages, coords, _ = self._arrays()
+        by_page: Dict[int, list] = {}
+        for c, (page_num, coor) in enumerate(zip(pages.tolist(), coords.tolist())):
+            by_page.setdefault(page_num, []).append((c, coor, None))
+        return by_page
+
+    def _build_index(self):
+        """(Re)build the spatial index, bulk-loading the boxes of each page."""
+        self._id_map = dict(enumerate(self.bbxs))
+        self._map_id = {id: c for c, id in self._id_map.items()}
+        self._last_c = len(self.bbxs)
+        self._dbs = {
+            page_num: index.Index(iter(entries))
+            for page_num, entries in self._index_entries().items()
+        }
+        self._persisted_index = False
+
+    def _save_index(self, location: str):
+        """Persist the spatial index next to the layer."""
+        path = f"{location}.index"
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+        entries = self._index_entries()
+        for page_num, page_entries in entries.items():
+            properties = index.Property()
+            properties.overwrite = True
+            index.Index(f"{path}/{page_num}", iter(page_entries), properties=properties).close()
+
+        # written last: marks the index as complete.
+        with open(f"{path}/index.json", "w") as f:
+            json.dump({"n_boxes": len(self.bbxs), "pages": list(entries)}, f)
+
+    def _load_index(self) -> bool:
+        """Open the persisted spatial index, if it is up to date."""
+        path = f"{self.location}.index"
+        try:
+            if os.path.getmtime(f"{path}/index.json") < os.path.getmtime(layer_file(self.location)):
+                return False
+            with open(f"{path}/index.json", "r") as f:
+                meta = json.load(f)
+        except (OSError, TypeError, ValueError):
+            return False
+        if meta["n_boxes"] != len(self.bbxs):
+            return False
+
+        properties = index.Property()
+        properties.overwrite = False
+        self._dbs = {
+            page_num: index.Index(f"{path}/{page_num}", properties=properties)
+            for page_num in meta["pages"]
+        }
+        self._id_map = dict(enumerate(self.bbxs))
+        self._map_id = {id: c for c, id in self._id_map.items()}
+        self._last_c = len(self.bbxs)
+        self._persisted_index = True
+        return True
+
+    def _detach_index(self):
+        """Switch to an in-memory index before modifying it, so that the persisted one stays untouched."""
+        if self._persisted_index:
+            self._build_index()
 
     def save(self, location: Optional[str] = None):
         """
@@ -76,8 +180,82 @@ class AnnotationLayer:
         if self.location is None and location is None:
             raise Exception("No location given.")
 
-        with bz2.BZ2File((self.location or location) + ".bz2", "w") as f:
-            f.write(jsonpickle.encode(self.bbxs).encode())
+        binary_layer.write_layer(
+            f"{self.location or location}.bin", list(self.bbxs), list(self.bbxs.values())
+        )
+        codec.remove(self.location or location)  # previous format.
+
+        remove_token_labels(self.location or location)
+        if config.PERSIST_LAYER_INDEX:
+            self._save_index(self.location or location)
+        else:
+            shutil.rmtree(f"{self.location or location}.index", ignore_errors=True)
+
+        # removed last: replaying the journal on the saved layer doesn't change it.
+        if os.path.exists(journal_file(self.location or location)):
+            os.remove(journal_file(self.location or location))
+        self._edits = []
+        self._journal_length = 0
+        self._dirty = False
+
+    def save_edits(self):
+        """
+        Save the boxes added, moved or deleted since the layer was loaded or saved, by appending them to
+        the layer journal. The layer is saved with `AnnotationLayer.save` instead when the journal reaches
+        `layer_journal_size` records, or when the layer was changed by other operations (filter, ...).
+        """
+        if self.location is None:
+            raise Exception("No location given.")
+        if self._edits == []:
+            return
+
+        if (
+            self._edits is None
+            or self._journal_length + len(self._edits) >= config.LAYER_JOURNAL_SIZE
+        ):
+            self.save()
+            return
+
+        with open(journal_file(self.location), "a") as f:
+            f.write("".join(jsonpickle.encode(record) + "\n" for record in self._edits))
+        remove_token_labels(self.location)
+
+        self._journal_length += len(self._edits)
+        self._edits = []
+        self._dirty = False
+
+    def _replay_journal(self) -> int:
+        """Apply the records of the layer journal, returning their number."""
+        try:
+            with open(journal_file(self.location), "r") as f:
+                lines = f.readlines()
+        except OSError:
+            return 0
+
+        n_records = 0
+        for line in lines:
+            try:
+                record = jsonpickle.decode(line)
+            except ValueError:  # interrupted write.
+                continue
+
+            # records hold the new state of the box, so that replaying them twice is harmless.
+            if record["op"] == "delete":
+                self.bbxs.pop(record["id"], None)
+            else:
+                self.bbxs[record["id"]] = record["box"]
+            n_records += 1
+        return n_records
+
+    def _modified(self, record: Optional[dict] = None):
+        if isinstance(self.bbxs, _LazyBoxes):
+            self.bbxs.materialize()  # boxes may have been changed in place.
+        if record is not None and self._edits is not None:
+            self._edits.append(record)
+        else:
+            self._edits = None  # can't be journaled.
+        self._token_labels = {}
+        self._dirty = True
 
     def __str__(self) -> str:
         return "\n".join([k + ":" + str(x) for k, x in self.bbxs.items()])
@@ -92,8 +270,10 @@ class AnnotationLayer:
         """
         Add box to layer.
         """
+        self._detach_index()
         uuid = shortuuid.uuid()
         self.bbxs[uuid] = box
+        self._modified({"op": "add", "id": uuid, "box": box})
 
         # update index
         if box.page_num not in self._dbs:
@@ -109,10 +289,12 @@ class AnnotationLayer:
         """
         Move box in layer.
         """
+        self._detach_index()
         # remove from index
         self._dbs[box.page_num].delete(self._map_id[uuid], self.bbxs[uuid].to_coor())
 
         self.bbxs[uuid] = box
+        self._modified({"op": "move", "id": uuid, "box": box})
 
         # update index
         self._dbs[box.page_num].add(self._map_id[uuid], box.to_coor())
@@ -121,6 +303,7 @@ class AnnotationLayer:
         """
         Delete box from layer.
         """
+        self._detach_index()
         box = self.bbxs[uuid]
         box_spatial_id = self._map_id[uuid]
         # remove from index
@@ -129,6 +312,7 @@ class AnnotationLayer:
         del self._id_map[box_spatial_id]
         del self._map_id[uuid]
         del self.bbxs[uuid]
+        self._modified({"op": "delete", "id": uuid})
 
     def get(self, target_box: BBX, mode: str = "full") -> Optional[BBX]:
         """
@@ -150,23 +334,28 @@ class AnnotationLayer:
             )
 
         min_box = None
+        min_index_id = -1
         # min_val = float('inf')
 
+        # the last matching box of `self.bbxs` wins: index IDs follow the order of the boxes,
+        # whereas the order of `intersection` depends on the shape of the index.
         for index_id in self._dbs[target_box.page_num].intersection(
             target_box.to_coor()
         ):
+            if index_id < min_index_id:
+                continue
             box = self.bbxs[self._id_map[index_id]]
 
             if mode == "intersect":
                 if box.intersects(target_box):  # and group_size(box) < min_val:
                     # min_val = group_size(box)
-                    min_box = box
+                    min_box, min_index_id = box, index_id
             elif mode == "full":
                 if box.extend(10).contains(
                     target_box
                 ):  # and group_size(box) < min_val:
                     # min_val = group_size(box)
-                    min_box = box
+                    min_box, min_index_id = box, index_id
 
         return min_box
 
@@ -180,65 +369,158 @@ class AnnotationLayer:
         else:
             return box.label
 
+    def _match(self, boxes, mode: str) -> np.ndarray:
+        """For each box, index in `self.bbxs` of the box that would be returned by `get`, or -1."""
+        if mode not in ["intersect", "full"]:
+            raise Exception(f"Unknown mode {mode}")
+
+        pages, coords = _box_arrays(boxes)
+        result = np.full(len(pages), -1, dtype=np.int64)
+        if len(pages) == 0 or len(self.bbxs) == 0:
+            return result
+
+        layer_pages, layer_coords, _ = self._arrays()
+
+        order = np.argsort(pages, kind="stable")
+        page_values, page_starts = np.unique(pages[order], return_index=True)
+        page_ends = np.append(page_starts[1:], len(order))
+
+        for page, start, end in zip(page_values, page_starts, page_ends):
+            candidates = np.flatnonzero(layer_pages == page)
+            if len(candidates) == 0:
+                continue
+            b_min_h, b_min_v, b_max_h, b_max_v = layer_coords[candidates].T
+
+            # bound the size of the (tokens, boxes) masks.
+            chunk_size = max(1, 2 ** 22 // len(candidates))
+            for chunk_start in range(start, end, chunk_size):
+                idx = order[chunk_start : min(end, chunk_start + chunk_size)]
+                t_min_h, t_min_v, t_max_h, t_max_v = (c[:, None] for c in coords[idx].T)
+
+                mask = (
+                    (t_max_h >= b_min_h)
+                    & (b_max_h >= t_min_h)
+                    & (t_max_v >= b_min_v)
+                    & (b_max_v >= t_min_v)
+                )
+                if mode == "full":  # `box.extend(10).contains(target_box)`
+                    mask &= (
+                        (t_min_h >= b_min_h - 10)
+                        & (t_min_v >= b_min_v - 10)
+                        & (t_max_h <= b_max_h + 10)
+                        & (t_max_v <= b_max_v + 10)
+                    )
+
+                # as in `get`, the last matching box of `self.bbxs` wins.
+                last = mask.shape[1] - 1 - np.argmax(mask[:, ::-1], axis=1)
+                result[idx] = np.where(mask.any(axis=1), candidates[last], -1)
+
+        return result
+
+    def get_many(self, boxes, mode: str = "full") -> List[Optional[LabelledBBX]]:
+        """
+        Bulk version of `get`. `boxes` is a token table (`lib.paper.tokens.TokenTable`) or its rows,
+        a (n, 5) array of page_num, min_h, min_v, max_h, max_v, or a list of boxes.
+        """
+        ids = list(self.bbxs)
+        return [self.bbxs[ids[i]] if i >= 0 else None for i in self._match(boxes, mode)]
+
+    def get_labels(self, boxes, mode: str = "full", default: str = "O") -> np.ndarray:
+        """
+        Bulk version of `get_label`, returning an array of labels. See `get_many` for the accepted inputs.
+        """
+        labels = np.append(self._arrays()[2], np.array([default], dtype=object))
+        return labels[self._match(boxes, mode)]  # -1 selects the default.
+
+    def get_token_labels(self, tokens, mode: str = "full") -> np.ndarray:
+        """
+        Labels of the tokens of a paper (`lib.paper.tokens.TokenTable`), in token order.
+        Computed once, then persisted next to the layer until it is saved again.
+        """
+        key = (tokens.level, mode)
+        if key not in self._token_labels:
+            labels = None
+            if self.location is not None and not self._dirty:
+                labels = load_token_labels(self.location, tokens, mode)
+
+            if labels is None:
+                labels = self.get_labels(tokens, mode)
+                if self.location is not None and not self._dirty:
+                    _save_token_labels(self.location, tokens, mode, labels)
+            self._token_labels[key] = labels
+
+        return self._token_labels[key]
+
     def filter(self, predicate: Callable[[BBX], bool]):
         """
         Keep boxes that are accepted by the predicate.
         """
-        to_filter = []
-        for id, box in self.bbxs.items():
-            if not predicate(box):
-                to_filter.append(id)
-
-        for id in to_filter:
-            self.delete_box(id)
+        kept = {id: box for id, box in self.bbxs.items() if predicate(box)}
+        if len(kept) < len(self.bbxs):
+            self.bbxs = kept
+            self._modified()
+            self._build_index()  # cheaper than deleting boxes one by one.
 
     def filter_map(self, f_mapper: Callable[[str, int], [str, int]]):
         """
         Keep boxes that are accepted by the predicate and rename them. 
         """
-        to_filter = []
+        kept = {}
         for id, box in self.bbxs.items():
             new_info = f_mapper(box.label, box.group)
-            if new_info is None:
-                to_filter.append(id)
-            else:
+            if new_info is not None:
                 box.label, box.group = new_info
+                kept[id] = box
 
-        for id in to_filter:
-            self.delete_box(id)
+        self._modified()
+        if len(kept) < len(self.bbxs):
+            self.bbxs = kept
+            self._build_index()  # cheaper than deleting boxes one by one.
 
-    def reduce(self) -> AnnotationLayer:
+    def reduce(self, ignore: List[str] = []) -> AnnotationLayer:
         """
         Reduce the number of bounding boxes by merging boxes of
         same category.
-        """
-        print("number of boxes:", len(self.bbxs))
-        # build a new layer
-        new_layer = AnnotationLayer()
 
-        # store a mapping box group -> List of boxes composing that group
-        by_group: Dict[Tuple[str, int], List[int]] = {}
-
-        for box_id, box in self.bbxs.items():
-            group_key = (box.label, box.group)
-            if group_key not in by_group:
-                by_group[group_key] = []
-
-            by_group[group_key].append(self._map_id[box_id])
+        Boxes of a group (label, group) are merged in order, as long as the merged box
+        doesn't reach a box of another group. Groups whose label is in `ignore` are not
+        part of the result, but still prevent other groups from merging.
+        """
+        t0 = time.time()
+        boxes = list(self.bbxs.values())
+
+        # group of each box, numbered by order of appearance.
+        group_ids: Dict[Tuple[str, int], int] = {}
+        groups = np.array(
+            [group_ids.setdefault((box.label, box.group), len(group_ids)) for box in boxes],
+            dtype=np.int64,
+        )
+        pages = np.array([box.page_num for box in boxes], dtype=np.int64)
+        coords = np.array([box.to_coor() for box in boxes], dtype=np.float64).reshape(-1, 4)
+
+        obstacles = {
+            page: _SortedBoxes(coords[pages == page], groups[pages == page])
+            for page in np.unique(pages).tolist()
+        }
+
+        by_group: List[List[int]] = [[] for _ in group_ids]
+        for i, group in enumerate(groups.tolist()):
+            by_group[group].append(i)
 
         # for each group, merge boxes.
-        for ids in by_group.values():
+        result: List[LabelledBBX] = []
+        for (label, _), group in group_ids.items():
+            if label in ignore:
+                continue
 
-            current_box = copy(self.bbxs[self._id_map[ids[0]]])
+            ids = by_group[group]
+            current_box = copy(boxes[ids[0]])
 
             for id in ids[1:]:
-                # let's try to merge these two boxes.
-                test_box = self.bbxs[self._id_map[id]]
+                test_box = boxes[id]
 
-                if (
-                    current_box.page_num != test_box.page_num
-                ):  # flush box as page changed.
-                    new_layer.add_box(current_box)
+                if current_box.page_num != test_box.page_num:  # flush box as page changed.
+                    result.append(current_box)
                     current_box = copy(test_box)
                     continue
 
@@ -247,25 +529,20 @@ class AnnotationLayer:
                     test_box, inplace=False, extension=True
                 )
 
-                intersection = set()
-
-                for extension_box in extensions_box:
-                    intersection = intersection.union(
-                        self._dbs[result_box.page_num].intersection(
-                            extension_box.to_coor()
-                        )
-                    )
-
-                if intersection.issubset(
-                    ids
-                ):  # it doesn't intersect with another group. we can merge the boxes.
+                if not obstacles[current_box.page_num].intersects_other(
+                    extensions_box, group
+                ):
                     current_box = result_box
                 else:  # it does intersect: we flush current box.
-                    new_layer.add_box(current_box)
+                    result.append(current_box)
                     current_box = copy(test_box)
             # flush last box
-            new_layer.add_box(current_box)
-        print("number of boxes in new layer:", len(new_layer.bbxs))
+            result.append(current_box)
+
+        new_layer = AnnotationLayer.from_boxes(result)
+        print(
+            f"reduce: {len(self.bbxs)} -> {len(new_layer.bbxs)} boxes in {time.time() - t0:.3f}s"
+        )
         return new_layer
 
     @staticmethod
@@ -298,3 +575,196 @@ class AnnotationLayer:
             layer.add_box(LabelledBBX.from_bbx(box, dest, 0))
 
         return layer
+
+
+def _box_arrays(boxes) -> Tuple[np.ndarray, np.ndarray]:
+    """Get page numbers and (n, 4) coordinates of a batch of boxes."""
+    if hasattr(boxes, "coordinates"):  # token table
+        return np.asarray(boxes["page_num"]), boxes.coordinates()
+    elif isinstance(boxes, np.ndarray) and boxes.dtype.names is not None:  # token table rows
+        coords = [boxes[c] for c in ["min_h", "min_v", "max_h", "max_v"]]
+        return np.asarray(boxes["page_num"]), np.stack(coords, axis=1).reshape(-1, 4)
+    elif isinstance(boxes, np.ndarray):
+        boxes = boxes.reshape(-1, 5)
+        return boxes[:, 0].astype(np.int64), boxes[:, 1:].astype(np.float64)
+    else:
+        pages = np.array([b.page_num for b in boxes], dtype=np.int64)
+        coords = np.array([b.to_coor() for b in boxes], dtype=np.float64).reshape(-1, 4)
+        return pages, coords
+
+
+def layer_file(location: str) -> Optional[str]:
+    """Get the file storing the layer at `location`: the binary layer, or a layer saved in the previous format."""
+    if os.path.exists(f"{location}.bin"):
+        return f"{location}.bin"
+    return codec.find(location, config.COMPRESSION)
+
+
+def _load_boxes(location: str):
+    path = layer_file(location)
+    if path is None:
+        raise FileNotFoundError(location)
+    if path.endswith(".bin"):
+        return _LazyBoxes(binary_layer.read_layer(path))
+    return jsonpickle.decode(codec.read(path).decode())
+
+
+def journal_file(location: str) -> str:
+    """Location of the edit journal of the layer stored at `location`."""
+    return f"{location}.journal"
+
+
+def layer_stamp(location: str) -> Tuple:
+    """Modification times and sizes of the files storing the layer at `location` (layer and journal),
+    which change whenever the layer is saved."""
+    stamp = []
+    for path in [layer_file(location), journal_file(location)]:
+        try:
+            stat = os.stat(path)
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        except (OSError, TypeError):
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def remove_layer_files(location: str):
+    """Remove the layer stored at `location`, and the files derived from it."""
+    for path in [f"{location}.bin", journal_file(location)]:
+        if os.path.exists(path):
+            os.remove(path)
+    codec.remove(location)
+    remove_token_labels(location)
+    shutil.rmtree(f"{location}.index", ignore_errors=True)
+
+
+def _token_labels_file(location: str, level: str, mode: str) -> str:
+    return f"{location}.labels.{mode}.{level.split('}')[-1]}.npz"
+
+
+def load_token_labels(location: str, tokens, mode: str = "full") -> Optional[np.ndarray]:
+    """Get the persisted label vector of the layer stored at `location`, or None if missing or outdated."""
+    path = _token_labels_file(location, tokens.level, mode)
+    source = layer_file(location)
+    try:
+        if source is None or os.path.getmtime(path) < os.path.getmtime(source):
+            return None
+        with np.load(path) as data:
+            codes, names = data["codes"], data["labels"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if len(codes) != len(tokens):
+        return None
+    return np.array(names.tolist(), dtype=object)[codes]
+
+
+def _save_token_labels(location: str, tokens, mode: str, labels: np.ndarray):
+    names, codes = np.unique(labels.astype(str), return_inverse=True)
+    path = _token_labels_file(location, tokens.level, mode)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, codes=codes.astype(np.int32), labels=names)
+    os.replace(path + ".tmp", path)
+
+
+def remove_token_labels(location: str):
+    """Remove the persisted label vectors of the layer stored at `location`."""
+    for path in glob.glob(glob.escape(location) + ".labels.*.npz"):
+        os.remove(path)
+
+
+class _SortedBoxes:
+    """
+    Boxes of a page sorted by top coordinate, to find the boxes intersecting a region
+    by scanning a narrow band of candidates. Boxes that are much taller than the others
+    would widen the band, they are always scanned.
+    """
+
+    def __init__(self, coords: np.ndarray, groups: np.ndarray):
+        heights = coords[:, 3] - coords[:, 1]
+        tall = heights > max(2 * float(np.median(heights)), 1.0)
+
+        order = np.argsort(coords[~tall, 1], kind="stable")
+        boxes = np.column_stack([coords, groups])
+        self.boxes = [tuple(b) for b in boxes[~tall][order].tolist()]
+        self.tops = [b[1] for b in self.boxes]
+        self.max_height = float(heights[~tall].max(initial=0)) + 1  # margin for rounding.
+        self.tall_boxes = [tuple(b) for b in boxes[tall].tolist()]
+
+    def intersects_other(self, regions: List[BBX], group: int) -> bool:
+        """If one of the regions intersects a box that is not part of `group`."""
+        if len(regions) == 0:
+            return False
+
+        start = bisect_left(self.tops, min(r.min_v for r in regions) - self.max_height)
+        end = bisect_right(self.tops, max(r.max_v for r in regions))
+        for boxes in (self.boxes[start:end], self.tall_boxes):
+            for min_h, min_v, max_h, max_v, box_group in boxes:
+                if box_group == group:
+                    continue
+                for r in regions:
+                    if (
+                        min_h <= r.max_h
+                        and max_h >= r.min_h
+                        and min_v <= r.max_v
+                        and max_v >= r.min_v
+                    ):
+                        return True
+        return False
+
+
+class _LazyBoxes(MutableMapping):
+    """
+    Boxes of a binary layer (`lib.misc.layer_file.LayerData`), by ID. Boxes are built when accessed;
+    the first modification builds all of them and turns the mapping into a plain dictionary.
+    """
+
+    def __init__(self, data: binary_layer.LayerData):
+        self.data = data
+        self._built: Dict[int, LabelledBBX] = {}
+        self._position: Optional[Dict[str, int]] = None
+        self._dict: Optional[Dict[str, LabelledBBX]] = None
+
+    @property
+    def is_lazy(self) -> bool:
+        """If the boxes still match the file content."""
+        return self._dict is None
+
+    def _box(self, i: int) -> LabelledBBX:
+        box = self._built.get(i)
+        if box is None:
+            box = self._built[i] = self.data.box(i)
+        return box
+
+    def materialize(self):
+        """Build all the boxes."""
+        if self._dict is None:
+            self._dict = {id: self._box(i) for i, id in enumerate(self.data.ids)}
+
+    def __getitem__(self, key: str) -> LabelledBBX:
+        if self._dict is not None:
+            return self._dict[key]
+        if self._position is None:
+            self._position = {id: i for i, id in enumerate(self.data.ids)}
+        return self._box(self._position[key])
+
+    def __setitem__(self, key: str, box: LabelledBBX):
+        self.materialize()
+        self._dict[key] = box
+
+    def __delitem__(self, key: str):
+        self.materialize()
+        del self._dict[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._dict if self._dict is not None else self.data.ids)
+
+    def __len__(self) -> int:
+        return len(self._dict) if self._dict is not None else len(self.data)
+
+    def __getstate__(self):  # pickled as a dictionary, not as a memory map.
+        self.materialize()
+        return self._dict
+
+    def __setstate__(self, state):
+        self.data = None
+        self._built, self._position, self._dict = {}, None, state
@@ -10,9 +10,25 @@ from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 from dynaconf import Dynaconf, Validator, validator, LazySettings
 
-from .glob import TEST_INSTANCE, DATA_PATH, REBUILD_FEATURES, ENABLE_TENSORFLOW
+from .glob import (
+    TEST_INSTANCE,
+    DATA_PATH,
+    REBUILD_FEATURES,
+    ENABLE_TENSORFLOW,
+    XML_CACHE_SIZE,
+    COMPRESSION,
+    XML_SHARDING,
+    PERSIST_LAYER_INDEX,
+    LAYER_JOURNAL_SIZE,
+    LAYER_CACHE_SIZE,
+    FEATURE_BACKEND,
+)
+from .misc import codec
 
 is_bool = lambda x: type(x) == bool
+is_positive_int = lambda x: type(x) == int and x >= 0
+is_codec = lambda x: x in codec.CODECS or x in codec.ALIASES
+is_feature_backend = lambda x: x in ["dict", "vectorized"]
 
 tkb_file = os.path.join(os.path.dirname(__file__), "tkb.toml")
 tkb_default_file = os.path.join(os.path.dirname(__file__), "tkb.default.toml")
@@ -32,6 +48,23 @@ class TKBConfig:
                     Validator("data_path", must_exist=True),
                     Validator("rebuild_features", condition=is_bool, default=False),
                     Validator("enable_tensorflow", condition=is_bool, default=True),
+                    Validator(
+                        "xml_cache_size", condition=is_positive_int, default=XML_CACHE_SIZE
+                    ),
+                    Validator("compression", condition=is_codec, default=COMPRESSION),
+                    Validator("xml_sharding", condition=is_bool, default=XML_SHARDING),
+                    Validator(
+                        "persist_layer_index", condition=is_bool, default=PERSIST_LAYER_INDEX
+                    ),
+                    Validator(
+                        "layer_journal_size", condition=is_positive_int, default=LAYER_JOURNAL_SIZE
+                    ),
+                    Validator(
+                        "layer_cache_size", condition=is_positive_int, default=LAYER_CACHE_SIZE
+                    ),
+                    Validator(
+                        "feature_backend", condition=is_feature_backend, default=FEATURE_BACKEND
+                    ),
                 ],
             )
             try:
@@ -43,10 +76,24 @@ class TKBConfig:
             self.DATA_PATH = settings.data_path
             self.REBUILD_FEATURES = settings.REBUILD_FEATURES
             self.ENABLE_TENSORFLOW = settings.enable_tensorflow
+            self.XML_CACHE_SIZE = settings.xml_cache_size
+            self.COMPRESSION = settings.compression
+            self.XML_SHARDING = settings.xml_sharding
+            self.PERSIST_LAYER_INDEX = settings.persist_layer_index
+            self.LAYER_JOURNAL_SIZE = settings.layer_journal_size
+            self.LAYER_CACHE_SIZE = settings.layer_cache_size
+            self.FEATURE_BACKEND = settings.feature_backend
         else:
             self.DATA_PATH = DATA_PATH
             self.REBUILD_FEATURES = REBUILD_FEATURES
             self.ENABLE_TENSORFLOW = ENABLE_TENSORFLOW
+            self.XML_CACHE_SIZE = XML_CACHE_SIZE
+            self.COMPRESSION = COMPRESSION
+            self.XML_SHARDING = XML_SHARDING
+            self.PERSIST_LAYER_INDEX = PERSIST_LAYER_INDEX
+            self.LAYER_JOURNAL_SIZE = LAYER_JOURNAL_SIZE
+            self.LAYER_CACHE_SIZE = LAYER_CACHE_SIZE
+            self.FEATURE_BACKEND = FEATURE_BACKEND
 
     @property
     def DATA_PATH(self):
@@ -57,6 +57,23 @@ class Extractor:
         ## Returns: `lib.annotations.AnnotationLayer`
         """
 
+    def apply_many(
+        self, documents: List[Paper], parameters: List[List[str]], args: argparse.Namespace
+    ) -> List[AnnotationLayer]:
+        """Create an annotation layer for each of the given articles.
+
+        Applies the extractor to each article by default. Extractors backed by a model override it to run
+        the model on batches of tokens or pages gathered from several articles.
+
+        ## Args:
+
+        * **documents** (`List[lib.paper.Paper]`): the articles to annotate.
+        * **parameters** (`List[List[str]]`): parameters of each article, see `Extractor.apply`.
+
+        ## Returns: `List[lib.annotations.AnnotationLayer]`, in the order of the articles.
+        """
+        return [self.apply(document, p, args) for document, p in zip(documents, parameters)]
+
     def apply_and_save(
         self,
         document: Paper,
@@ -66,16 +83,31 @@ class Extractor:
         """
         General-purpose procedure to apply an extractor to a paper.
         """
+        return self.apply_many_and_save([document], [parameters], args)[0]
+
+    def apply_many_and_save(
+        self,
+        documents: List[Paper],
+        parameters: List[List[str]],
+        args: Optional[argparse.Namespace] = None,
+    ) -> List[AnnotationLayer]:
+        """
+        General-purpose procedure to apply an extractor to several papers (see `Extractor.apply_many`).
+        """
 
         if args is None:
             parser = argparse.ArgumentParser()
             self.add_args(parser)
             args = parser.parse_args([])
 
-        annotations = self.apply(document, parameters, args)
-        annotations = annotations.reduce()
-        annotations.filter(lambda x: x.label != "O")
+        results = self.apply_many(documents, parameters, args)
+        return [self.save(document, annotations) for document, annotations in zip(documents, results)]
 
+    def save(self, document: Paper, annotations: AnnotationLayer) -> AnnotationLayerInfo:
+        """
+        Add the annotations produced by the extractor to the paper, as a new layer.
+        """
+        annotations = annotations.reduce(ignore=["O"])
         return document.add_annotation_layer(self.class_.name, content=annotations)
 
 
@@ -1,6 +1,7 @@
 """A convolutional neural network applied to a segmentation task."""
 
 import os, imageio, argparse, pickle
+from itertools import islice
 import numpy as np
 import tensorflow as tf
 from typing import *
@@ -67,11 +68,9 @@ class CNNExtractor(TrainableExtractor):
 
         if vocabulary is not None:
             input_text = np.zeros((len(images), render_size, render_size), dtype=int)
-            for i, token in enumerate(
-                paper.get_xml().getroot().findall(f".//{ALTO}String")
-            ):
-                bbx = BBX.from_element(token)
-                text = get_pattern(token.get("CONTENT"))
+            table = paper.get_tokens(f"{ALTO}String")
+            for bbx, content in zip(table.bbxs(), table.contents()):
+                text = get_pattern(content)
                 scale = images[bbx.page_num - 1][1]
 
                 input_text[
@@ -92,10 +91,13 @@ class CNNExtractor(TrainableExtractor):
     ) -> AnnotationLayer:
         res = AnnotationLayer()
 
-        root = paper.get_xml().getroot()
-        pages = list(root.findall(f".//{ALTO}Page"))
+        table = paper.get_tokens(f"{ALTO}String")
+        boxes = table.bbxs()
+        n_pages = len(paper.get_tokens(f"{ALTO}Page"))
+        # tokens are in document order: page p spans page_bounds[p]:page_bounds[p+1].
+        page_bounds = np.searchsorted(table["page"], np.arange(n_pages + 1))
 
-        for p, (page, (labels, scale)) in enumerate(zip(pages, labels_by_page)):
+        for p, (labels, scale) in zip(range(n_pages), labels_by_page):
 
             if debug:
                 if not os.path.exists("/tmp/tkb"):
@@ -107,8 +109,7 @@ class CNNExtractor(TrainableExtractor):
                     )
                 imageio.imwrite(f"/tmp/tkb/{paper.id}-{p}-O.png", labels[:, :, 0])
 
-            for token in page.findall(f".//{ALTO}String"):
-                box = BBX.from_element(token)
+            for box in boxes[page_bounds[p] : page_bounds[p + 1]]:
                 slice = labels[
                     int(box.min_v * scale) : int(box.max_v * scale),
                     int(box.min_h * scale) : int(box.max_h * scale),
@@ -133,35 +134,64 @@ class CNNExtractor(TrainableExtractor):
     def apply(
         self, paper: Paper, parameters: List[str], args: argparse.Namespace
     ) -> AnnotationLayer:
+        return self.apply_many([paper], [parameters], args)[0]
+
+    def apply_many(
+        self, papers: List[Paper], parameters: List[List[str]], args: argparse.Namespace
+    ) -> List[AnnotationLayer]:
+        """Tag the pages of all papers, prediction batches spanning several papers."""
+        if len(papers) == 0:
+            return []
+
         if self.model.params.word_embeddings > 0:
             with open(self._vocab_path, "rb") as f:
                 vocab = pickle.load(f)
         else:
             vocab = None
 
-        input, page_scale = self._to_features(
-            paper, vocab, self.model.params.render_size
-        )
+        inputs, scales, page_scale, page_ids = [], [], [], []
+        for paper in papers:
+            paper_input, paper_scale = self._to_features(
+                paper, vocab, self.model.params.render_size
+            )
+            inputs.append(paper_input)
+            scales.append(paper_scale)
+            page_scale.extend(paper_scale)
+            page_ids.extend((paper.id, p) for p in range(len(paper_scale)))
+
+        # pages of all papers, stacked.
+        if vocab is not None:
+            input = tuple(np.concatenate(parts) for parts in zip(*inputs))
+            n_pages = len(input[0])
+            batch = lambda i: tuple(x[i : i + args.batch_size] for x in input)
+        else:
+            input = np.concatenate(inputs)
+            n_pages = len(input)
+            batch = lambda i: input[i : i + args.batch_size]
 
         def labels_generator():  # apply the model and yield labeled pages.
-            for i in range(0, len(input), args.batch_size):
-                tagged_images = self.model(input[i : i + args.batch_size])
+            for i in range(0, n_pages, args.batch_size):
+                tagged_images = self.model(batch(i))
 
                 if args.debug:
-                    first_layer = self.model.first_layer(
-                        (input[i : i + args.batch_size])
-                    )
+                    first_layer = self.model.first_layer(batch(i))
 
                 for j in range(tagged_images.shape[0]):
                     if args.debug:
+                        paper_id, page = page_ids[i + j]
                         for ft in range(first_layer.shape[-1]):
                             imageio.imwrite(
-                                f"/tmp/tkb/{paper.id}-fsl-{i+j}-{ft}.png",
+                                f"/tmp/tkb/{paper_id}-fsl-{page}-{ft}.png",
                                 first_layer[j, :, :, ft],
                             )
                     yield tagged_images[j], page_scale[i + j]
 
-        return self._labels_to_annots(paper, labels_generator(), args.debug)
+        labeled_pages = labels_generator()
+        result = []
+        for paper, paper_scale in zip(papers, scales):  # pages of each paper, in order.
+            paper_pages = list(islice(labeled_pages, len(paper_scale)))
+            result.append(self._labels_to_annots(paper, iter(paper_pages), args.debug))
+        return result
 
     def _annots_to_labels(
         self,
@@ -64,14 +64,20 @@ class CNN1DExtractor(TrainableExtractor):
 
         if vocabulary is not None:
             text_idx = [
-                [vocabulary.get(get_pattern(token.get("CONTENT")), 1)]
-                for token in paper.get_xml().getroot().findall(f".//{ALTO}String")
+                [vocabulary.get(get_pattern(content), 1)]
+                for content in paper.get_tokens(f"{ALTO}String").contents()
             ]
             return fts.to_numpy(), np.array(text_idx)
         else:
             return fts.to_numpy()
 
     def apply(self, paper: Paper, parameters: List[str], args) -> AnnotationLayer:
+        return self.apply_many([paper], [parameters], args)[0]
+
+    def apply_many(
+        self, papers: List[Paper], parameters: List[List[str]], args
+    ) -> List[AnnotationLayer]:
+        """Tag the tokens of all papers in a single pass, prediction batches spanning several papers."""
 
         if self.model.params.word_embeddings > 0:
             with open(self._vocab_path, "rb") as f:
@@ -79,18 +85,24 @@ class CNN1DExtractor(TrainableExtractor):
         else:
             vocab = None
 
-        input = self._to_features(paper, vocab)
-        input_gen = tf.data.Dataset.from_tensors(input)
+        input_gen = None
+        for paper in papers:
+            paper_input = tf.data.Dataset.from_tensors(self._to_features(paper, vocab))
+            input_gen = paper_input if input_gen is None else input_gen.concatenate(paper_input)
+        if input_gen is None:
+            return []
+
+        # one prediction per token, in the order of the papers.
+        labels = np.concatenate(list(self.model(input_gen)))
+        offset = 0
 
-        res = AnnotationLayer()
-        root = paper.get_xml().getroot()
-        tokens = root.findall(f".//{ALTO}String")
+        result = []
+        for paper in papers:
+            res = AnnotationLayer()
+            tokens = paper.get_tokens(f"{ALTO}String").bbxs()
 
-        i = 0
-        for labels in self.model(input_gen):
-            for j in range(labels.shape[0]):
-                box = BBX.from_element(tokens[i + j])
-                label_id = np.argmax(labels[j])
+            for box, token_labels in zip(tokens, labels[offset : offset + len(tokens)]):
+                label_id = np.argmax(token_labels)
 
                 if label_id != 0:
                     label = self.class_.labels[label_id - 1]
@@ -98,8 +110,9 @@ class CNN1DExtractor(TrainableExtractor):
                     label = "O"
 
                 res.add_box(LabelledBBX.from_bbx(box, label, 0))
-            i += j
-        return res
+            offset += len(tokens)
+            result.append(res)
+        return result
 
     @staticmethod
     def add_train_args(parser: argparse.ArgumentParser):
@@ -112,11 +125,7 @@ class CNN1DExtractor(TrainableExtractor):
         parser.add_argument("--n-epoch", type=int, default=100)
 
     def _annots_to_labels(self, paper, annot):
-        annotations = paper.get_annotation_layer(annot.id)
-        lbl = [
-            annotations.get_label(BBX.from_element(node))
-            for node in paper.get_xml().getroot().findall(f".//{ALTO}String")
-        ]
+        lbl = paper.get_token_labels(annot.id, f"{ALTO}String")
 
         label_to_index = {v: k + 1 for k, v in enumerate(self.class_.labels)}
         np_lbl = np.zeros((len(lbl), len(self.class_.labels) + 1))
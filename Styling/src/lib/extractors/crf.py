@@ -1,6 +1,6 @@
 """ Conditional random fields applied on a sequence of tokens."""
 
-import os, joblib, argparse, itertools, threading
+import os, json, hashlib, argparse
 from typing import List, Tuple, Optional
 from sklearn_crfsuite import metrics
 from tqdm import tqdm
@@ -8,36 +8,18 @@ from joblib import Parallel, delayed
 
 from . import TrainableExtractor
 from ..classes import AnnotationClass
-from ..annotations import AnnotationLayer
+from ..annotations import AnnotationLayer, layer_stamp
 from ..paper import AnnotationLayerInfo, Paper
 from ..misc.bounding_box import BBX, LabelledBBX
+from ..config import config
 from ..misc.namespaces import *
-from ..misc import filter_nan
-from ..models import CRFTagger
-
-
-class Parallel(joblib.Parallel):
-    """
-    A parallel generator.
-    """
-
-    def it(self, iterable):
-        try:
-            t = threading.Thread(target=self.__call__, args=(iterable,))
-            t.start()
-
-            i = 0
-            output = self._output
-            while t.is_alive() or (output and i < len(output)):
-                # catch the list reference and store before it's overwritten
-                if output is None:
-                    output = self._output
-                # yield when a new item appears
-                if output and i < len(output):
-                    yield output[i]
-                    i += 1
-        finally:
-            t.join()
+from ..models import CRFTagger, SequenceCorpus, cached_sequence
+from ..features import get_fingerprints
+from ..paper.features import features_fingerprint
+
+
+FEATURIZE_CHUNK_SIZE = 64
+"""Number of papers featurized between two writes to the training corpus, which bounds memory usage."""
 
 
 class CRFExtractor(TrainableExtractor):
@@ -87,26 +69,30 @@ class CRFExtractor(TrainableExtractor):
             )
 
     def apply(self, paper: Paper, parameters: List[str], args) -> AnnotationLayer:
+        return self.apply_many([paper], [parameters], args)[0]
+
+    def apply_many(
+        self, papers: List[Paper], parameters: List[List[str]], args
+    ) -> List[AnnotationLayer]:
+        """Tag the sequences of all papers with a single call to the model."""
         self._load_model()
 
-        leaf_node = self.target
-        tokens = list(paper.get_xml().getroot().findall(f".//{leaf_node}"))
-        features = paper.get_features(leaf_node).to_dict("records")
+        filtered_tokens, filtered_features = [], []
+        for paper in papers:
+            leaf_node = self.target
+            tokens = paper.get_tokens(leaf_node).bbxs()
+            features = paper.get_features(leaf_node)
 
-        box_validator = paper.get_box_validator(self.class_)
+            box_validator = paper.get_box_validator(self.class_)
 
-        filtered_tokens = []
-        filtered_features = []
-        for node, ft in zip(tokens, features):
-            bbx = BBX.from_element(node)
-            if box_validator(bbx):
-                filtered_tokens.append(bbx)
-                filtered_features.append(filter_nan(ft))
+            filtered_idx = [i for i, bbx in enumerate(tokens) if box_validator(bbx)]
+            filtered_tokens.append([tokens[i] for i in filtered_idx])
+            filtered_features.append(CRFTagger.to_item_sequence(features.iloc[filtered_idx]))
 
-        labels = self.model([filtered_features])[0]
-        # print("Apply:")
-        # print(Counter(labels))
+        labels = self.model(filtered_features)
+        return [self._to_layer(t, l) for t, l in zip(filtered_tokens, labels)]
 
+    def _to_layer(self, filtered_tokens: List[BBX], labels: List[str]) -> AnnotationLayer:
         result = AnnotationLayer()
         previous_label, counter = "", 0
 
@@ -150,99 +136,170 @@ class CRFExtractor(TrainableExtractor):
         self.model.reset(args)
         print(self.description)
 
-        if args.only is not None:
-            only = set(self.class_.labels).intersection(args.only)
-            if len(only) != len(set(args.only)):
-                print(
-                    "Some filtered labels are not part of the allowed labels:",
-                    set(args.only).difference(self.class_.labels),
-                )
-                print("Allowed labels are:", set(self.class_.labels))
-                exit(1)
-        else:
-            only = None
+        only = self.label_filter(args.only)
+        corpus = self.build_corpus(documents, only, args.balance, getattr(args, "single_core", False))
 
-        def featurize(paper, layer, balance=False):
-            annotations = paper.get_annotation_layer(layer.id)
+        if args.verbose:
+            print("Starting training.")
 
-            leaf_node = self.target
-            tokens = paper.get_xml().getroot().findall(f".//{leaf_node}")
-            labels = [
-                annotations.get_label(BBX.from_element(token)) for token in tokens
-            ]
-
-            target = []
-            target_idx = set()
-            block_count = 0
-
-            for i, label in enumerate(labels):
-                if only is not None:
-                    if label not in only:
-                        label = "O"
-
-                if label == "O":
-                    target.append("O")
-                elif i > 0 and label != labels[i - 1]:
-                    target_idx.add(i)
-                    block_count += 1
-                    target.append("B-" + label)
-                elif i < len(labels) - 1 and label != labels[i + 1]:
-                    target_idx.add(i)
-                    target.append("E-" + label)
-                else:
-                    target_idx.add(i)
-                    target.append("I-" + label)
-
-            if balance:
-                if block_count == 0:
-                    return None
-
-                context_size = 2 * len(target_idx) // block_count
-
-                for i in list(target_idx):
-                    target_idx.update(
-                        range(
-                            max(0, i - context_size),
-                            min(i + context_size, len(labels) - 1),
-                        )
-                    )
-                target_idx_lst = list(target_idx)
-                target_idx_lst.sort()
-
-                features = [
-                    filter_nan(x)
-                    for x in paper.get_features(leaf_node)
-                    .iloc[target_idx_lst]
-                    .to_dict("records")
-                ]
-                target = [target[i] for i in target_idx_lst]
+        self.model.train(corpus.items(), corpus.labels(), args)
+
+    def label_filter(self, only: Optional[List[str]]) -> Optional[set]:
+        """Labels kept by the `--only` option (others are considered as `O`), exits if some are unknown."""
+        if only is None:
+            return None
+
+        labels = set(self.class_.labels).intersection(only)
+        if len(labels) != len(set(only)):
+            print(
+                "Some filtered labels are not part of the allowed labels:",
+                set(only).difference(self.class_.labels),
+            )
+            print("Allowed labels are:", set(self.class_.labels))
+            exit(1)
+        return labels
+
+    def build_corpus(
+        self,
+        documents: List[Tuple[Paper, AnnotationLayerInfo]],
+        only: Optional[set] = None,
+        balance: bool = False,
+        single_core: bool = False,
+    ) -> SequenceCorpus:
+        """Training sequences of given documents (see `lib.models.corpus`), featurized in parallel.
+
+        The corpus is reused if it was built from the same documents and settings. Otherwise, the sequence of
+        each paper is read from its cache (see `featurize`) when possible.
+        """
+        key = self._corpus_key(documents, only, balance)
+        corpus = SequenceCorpus(f"{self.prefix}/corpus/{self.class_.name}.{self.name}")
+        if not config.REBUILD_FEATURES and corpus.is_complete(key):
+            print(f"Using the {len(corpus)} sequences featurized by a previous run.")
+            return corpus
+
+        n_jobs = 1 if single_core else -1
+        # keyed by the stamps of the features computed by the workers.
+        with corpus.writer(
+            lambda: self._corpus_key(documents, only, balance)
+        ) as write, tqdm(total=len(documents)) as progress:
+            for start in range(0, len(documents), FEATURIZE_CHUNK_SIZE):
+                chunk = documents[start : start + FEATURIZE_CHUNK_SIZE]
+                for result in Parallel(n_jobs=n_jobs)(
+                    delayed(self.featurize)(paper, layer, only, balance) for paper, layer in chunk
+                ):
+                    if result is not None:
+                        write(*result)
+                progress.update(len(chunk))
+        return corpus
+
+    def featurize(
+        self, paper: Paper, layer: AnnotationLayerInfo, only: Optional[set] = None, balance: bool = False
+    ) -> Optional[Tuple[List[dict], List[str], str]]:
+        """Training sequence `(items, tags, paper id)` of a paper according to an annotation layer, None if it
+        has no annotated block and `balance` is set.
+
+        Sequences are cached in the paper directory, for each layer and settings, until the layer, the
+        features of the paper or their extractors change.
+        """
+        if config.REBUILD_FEATURES:
+            return self._featurize(paper, layer, only, balance)
+
+        settings = json.dumps(
+            {"target": self.target, "only": sorted(only) if only is not None else None, "balance": balance},
+            sort_keys=True,
+        )
+        path = (
+            f"{paper.meta_path}/sequences/{self.class_.name}.{self.name}.{layer.id}."
+            f"{hashlib.sha1(settings.encode()).hexdigest()[:12]}.pkl"
+        )
+        key = json.dumps(
+            [
+                settings,
+                layer_stamp(f"{paper.meta_path}/annot_{layer.id}.json"),
+                paper._update_features()["built"],
+                features_fingerprint(),
+                get_fingerprints(),
+            ],
+            sort_keys=True,
+        )
+        return cached_sequence(path, key, lambda: self._featurize(paper, layer, only, balance))
+
+    def _featurize(
+        self, paper: Paper, layer: AnnotationLayerInfo, only: Optional[set], balance: bool
+    ) -> Optional[Tuple[List[dict], List[str], str]]:
+        """Items and target tags of a paper, restricted to the context of annotated blocks with `balance`."""
+        leaf_node = self.target
+        labels = paper.get_token_labels(layer.id, leaf_node)
+
+        target = []
+        target_idx = set()
+        block_count = 0
 
+        for i, label in enumerate(labels):
+            if only is not None:
+                if label not in only:
+                    label = "O"
+
+            if label == "O":
+                target.append("O")
+            elif i > 0 and label != labels[i - 1]:
+                target_idx.add(i)
+                block_count += 1
+                target.append("B-" + label)
+            elif i < len(labels) - 1 and label != labels[i + 1]:
+                target_idx.add(i)
+                target.append("E-" + label)
             else:
-                features = [
-                    filter_nan(x)
-                    for x in paper.get_features(leaf_node).to_dict("records")
-                ]
+                target_idx.add(i)
+                target.append("I-" + label)
 
-            return features, target, paper.id
+        if balance:
+            if block_count == 0:
+                return None
 
-        def create_feature_generators(dataset):
-            features_gen = filter(
-                lambda x: x is not None,
-                Parallel(n_jobs=-1).it(
-                    delayed(featurize)(paper, layer, args.balance)
-                    for paper, layer in tqdm(dataset)
-                ),
-            )
-            features_gen_3 = itertools.tee(features_gen, 3)
+            context_size = 2 * len(target_idx) // block_count
 
-            return (
-                (x[0] for x in features_gen_3[0]),
-                (x[1] for x in features_gen_3[1]),
-                (x[2] for x in features_gen_3[2]),
+            for i in list(target_idx):
+                target_idx.update(
+                    range(
+                        max(0, i - context_size),
+                        min(i + context_size, len(labels) - 1),
+                    )
+                )
+            target_idx_lst = list(target_idx)
+            target_idx_lst.sort()
+
+            features = CRFTagger.to_items(
+                paper.get_features(leaf_node).iloc[target_idx_lst]
             )
+            target = [target[i] for i in target_idx_lst]
 
-        X, y, ids = create_feature_generators(documents)
-        if args.verbose:
-            print("Starting training.")
+        else:
+            features = CRFTagger.to_items(paper.get_features(leaf_node))
 
-        self.model.train(X, y, args)
+        return features, target, paper.id
+
+    def _corpus_key(
+        self,
+        documents: List[Tuple[Paper, AnnotationLayerInfo]],
+        only: Optional[set],
+        balance: bool,
+    ) -> str:
+        """Identifies the training sequences built from given documents and settings. Only the stamps of their
+        files are read: features are computed by the workers of `build_corpus`."""
+        description = {
+            "target": self.target,
+            "only": sorted(only) if only is not None else None,
+            "balance": balance,
+            "features": [features_fingerprint(), get_fingerprints()],
+            "documents": [
+                [
+                    paper.id,
+                    layer.id,
+                    layer_stamp(f"{paper.meta_path}/annot_{layer.id}.json"),
+                    paper.features_stamp(),
+                ]
+                for paper, layer in documents
+            ],
+        }
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()[:16]
@@ -1,4 +1,5 @@
 from typing import List
+import numpy as np
 
 from .. import Extractor
 from ...misc.namespaces import ALTO
@@ -24,22 +25,14 @@ class AgreementExtractor(Extractor):
 
     def apply(self, document: Paper, parameters: List[str], _) -> AnnotationLayer:
 
-        b1 = document.get_annotation_layer(parameters[0])
-        b2 = document.get_annotation_layer(parameters[1])
-
-        tokens = list(document.get_xml().getroot().findall(f".//{ALTO}String"))
+        tokens = document.get_tokens(f"{ALTO}String")
+        labels1 = document.get_token_labels(parameters[0], f"{ALTO}String")
+        labels2 = document.get_token_labels(parameters[1], f"{ALTO}String")
 
         result = AnnotationLayer()
 
-        for token in tokens:  # check if layers agree on token class.
-            bbx = BBX.from_element(token)
-            lbl1 = b1.get_label(bbx)
-            lbl2 = b2.get_label(bbx)
-
-            if lbl1 != lbl2:
-                result.add_box(
-                    LabelledBBX.from_bbx(
-                        BBX.from_element(token), lbl1 + " - " + lbl2, 0
-                    )
-                )
+        for i in np.flatnonzero(labels1 != labels2):  # layers disagree on token class.
+            result.add_box(
+                LabelledBBX.from_bbx(tokens.bbx(i), labels1[i] + " - " + labels2[i], 0)
+            )
         return result
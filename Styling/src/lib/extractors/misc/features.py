@@ -43,7 +43,7 @@ class FeatureExtractor(Extractor):
 
     def apply(self, document: Paper, parameters: List[str], _) -> AnnotationLayer:
         leaf_node = f"{ALTO}{self.leaf_node}"
-        tokens = list(document.get_xml().getroot().findall(f".//{leaf_node}"))
+        tokens = document.get_tokens(leaf_node).bbxs()
         features = document.get_features(leaf_node, standardize=False).to_dict(
             "records"
         )
@@ -60,7 +60,7 @@ class FeatureExtractor(Extractor):
 
             result.add_box(
                 LabelledBBX.from_bbx(
-                    BBX.from_element(token),
+                    token,
                     "",
                     counter,
                     user_data=check_dtype(filter_nan(ft_hiearch)),
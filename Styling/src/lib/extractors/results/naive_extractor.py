@@ -6,7 +6,6 @@ from ...paper import Paper
 from ...misc.bounding_box import LabelledBBX
 from .. import Extractor
 from ...misc.namespaces import *
-from ...misc.bounding_box import BBX
 
 
 class NaiveExtractor(Extractor):
@@ -21,9 +20,18 @@ class NaiveExtractor(Extractor):
         res = AnnotationLayer()
 
         features = document.get_features(
-            f"{ALTO}String", standardize=True, add_context=False
+            f"{ALTO}String",
+            standardize=True,
+            add_context=False,
+            columns=[
+                "String.word_position",
+                "String.word_pattern",
+                "String.italic",
+                "String.bold",
+                "TextLine.line_position",
+            ],
         )
-        tokens = document.get_xml().getroot().findall(f".//{ALTO}String")
+        tokens = document.get_tokens(f"{ALTO}String").bbxs()
 
         in_result = None
         group = 0
@@ -46,10 +54,8 @@ class NaiveExtractor(Extractor):
                 in_result = None
 
             if in_result is not None:
-                res.add_box(
-                    LabelledBBX.from_bbx(BBX.from_element(token), in_result, group)
-                )
+                res.add_box(LabelledBBX.from_bbx(token, in_result, group))
             else:
-                res.add_box(LabelledBBX.from_bbx(BBX.from_element(token), "O", 0))
+                res.add_box(LabelledBBX.from_bbx(token, "O", 0))
 
         return res
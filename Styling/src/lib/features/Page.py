@@ -1,14 +1,21 @@
 from lxml import etree as ET
+from typing import Dict, Optional
 
 from . import FeatureExtractor
-from .status import get_status
+from .status import Position
 from ..misc.namespaces import *
 from .. import misc
 
 
 class PageFeaturesExtractor(FeatureExtractor):
-    def __init__(self, root: ET.Element):
-        pass
+    page_index: Dict[str, int]
+
+    def __init__(self, root: Optional[ET.Element] = None):
+        self.page_index = {}
+        super().__init__(root)
+
+    def add_page(self, page: ET.Element):
+        self.page_index[page.get("PHYSICAL_IMG_NR")] = len(self.page_index)
 
     def has(self, tag: str) -> bool:
         return tag == f"{ALTO}Page"
@@ -17,8 +24,11 @@ class PageFeaturesExtractor(FeatureExtractor):
         if page.tag != f"{ALTO}Page":
             raise KeyError
 
+        # pages are not necessarily in the same tree (streaming), use the index built beforehand.
+        position = Position(self.page_index[page.get("PHYSICAL_IMG_NR")], len(self.page_index))
+
         f = {}
         # geometry
-        f["#page_position"] = get_status(page, relative_to="alto:Layout")
+        f["#page_position"] = position.status
 
         return f
@@ -1,10 +1,10 @@
 import unicodedata, re
 from lxml import etree as ET
 from collections import namedtuple
-from typing import Dict
+from typing import Dict, Iterable, Optional
 
 from . import FeatureExtractor
-from .status import get_status
+from .status import PositionIndex
 from ..misc.namespaces import *
 from .. import misc
 
@@ -17,11 +17,14 @@ class Font(Font_):
 
 class StringFeaturesExtractor(FeatureExtractor):
     fonts: Dict[str, Font]
+    positions: PositionIndex
 
-    def __init__(self, root: ET.Element):
-        self._extract_fonts(root)
+    def __init__(self, root: Optional[ET.Element] = None):
+        self.fonts = {}
+        self.positions = PositionIndex()
+        super().__init__(root)
 
-    def _extract_fonts(self, root: ET.Element):
+    def add_styles(self, styles: Iterable[ET.Element]):
         italic_re = re.compile(r"((TI)[0-9]+|Ital|rsfs|EUSM)", flags=re.IGNORECASE)
         bold_re = re.compile(r"(CMBX|Bold|NimbusRomNo9L-Medi)", flags=re.IGNORECASE)  #
         math_re = re.compile(
@@ -30,9 +33,7 @@ class StringFeaturesExtractor(FeatureExtractor):
         )
         # normal_re   = re.compile(r"(Times-Roman|CMR|CMTT|EUFM|NimbusRomNo9L-Regu|LMRoman[0-9]+-Regular)")
 
-        self.fonts = {}
-
-        for font in root.findall(f".//{ALTO}TextStyle"):
+        for font in styles:
             family = font.get("FONTFAMILY")
             id = font.get("ID")
             size = float(font.get("FONTSIZE"))
@@ -52,30 +53,28 @@ class StringFeaturesExtractor(FeatureExtractor):
 
         text = unicodedata.normalize("NFKD", word.get("CONTENT"))
         font = word.get("STYLEREFS")
-        line = word.xpath(f"./ancestor::alto:TextLine", namespaces=ALTO_NS)  # TextLine
-        line_words = line[0].findall(f".//{ALTO}String")
-        word_index = line_words.index(word)
+        position = self.positions.get(word, f"{ALTO}TextLine")
 
         word_h = float(word.get("HPOS"))
         word_w = float(word.get("WIDTH"))
 
-        if word_index > 0:
-            previous_word = line_words[word_index - 1]
+        previous_word = position.previous()
+        if previous_word is not None:
             previous_word_h = float(previous_word.get("HPOS")) + float(
                 previous_word.get("WIDTH")
             )
         else:
             previous_word_h = word_h
 
-        if word_index < len(line_words) - 1:
-            next_word = line_words[word_index + 1]
+        next_word = position.next()
+        if next_word is not None:
             next_word_h = float(next_word.get("HPOS"))
         else:
             next_word_h = word_h + word_w
 
         f = {}
         # geometry
-        f["#word_position"] = get_status(word, relative_to=f"alto:TextLine")
+        f["#word_position"] = position.status
         f["length"] = len(word.get("CONTENT"))
         f["prev_delta_h"] = word_h - previous_word_h
         f["next_delta_h"] = next_word_h - (word_h + word_w)
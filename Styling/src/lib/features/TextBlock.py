@@ -1,14 +1,18 @@
 from lxml import etree as ET
+from typing import Optional
 
 from . import FeatureExtractor
-from .status import get_status
+from .status import PositionIndex
 from ..misc.namespaces import *
 from .. import misc
 
 
 class TextBlockFeaturesExtractor(FeatureExtractor):
-    def __init__(self, root: ET.Element):
-        pass
+    positions: PositionIndex
+
+    def __init__(self, root: Optional[ET.Element] = None):
+        self.positions = PositionIndex()
+        super().__init__(root)
 
     def has(self, tag: str) -> bool:
         return tag == f"{ALTO}TextBlock"
@@ -17,10 +21,8 @@ class TextBlockFeaturesExtractor(FeatureExtractor):
         if block.tag != f"{ALTO}TextBlock":
             raise KeyError
 
-        page = block.xpath(f"./ancestor::alto:Page", namespaces=ALTO_NS)[0]
-        page_blocks = page.findall(f".//{ALTO}TextBlock")
-
-        block_index = page_blocks.index(block)
+        page = next(block.iterancestors(f"{ALTO}Page"))
+        position = self.positions.get(block, f"{ALTO}Page")
 
         block_h = float(block.get("HPOS"))
         block_v = float(block.get("VPOS"))
@@ -30,23 +32,23 @@ class TextBlockFeaturesExtractor(FeatureExtractor):
         page_height = float(page.get("HEIGHT"))
         page_w = float(page.get("WIDTH"))
 
-        if block_index > 0:
-            previous_block = page_blocks[block_index - 1]
+        previous_block = position.previous()
+        if previous_block is not None:
             previous_block_v = float(previous_block.get("VPOS")) + float(
                 previous_block.get("HEIGHT")
             )
         else:
             previous_block_v = 0
 
-        if block_index < len(page_blocks) - 1:
-            next_block = page_blocks[block_index + 1]
+        next_block = position.next()
+        if next_block is not None:
             next_block_v = float(next_block.get("VPOS"))
         else:
             next_block_v = page_height
 
         f = {}
         # geometry
-        f["#block_position"] = get_status(block, relative_to="alto:Page")
+        f["#block_position"] = position.status
 
         f["prev_delta_h"] = block_h
         f["next_delta_h"] = page_w - (block_h + block_w)
@@ -1,8 +1,8 @@
 from lxml import etree as ET
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from . import FeatureExtractor
-from .status import get_status
+from .status import PositionIndex
 from ..misc.namespaces import *
 from .. import misc
 
@@ -10,28 +10,31 @@ from .. import misc
 class TextLineFeaturesExtractor(FeatureExtractor):
     patterns: Dict[str, int]
     patterns_first: Dict[str, ET._Element]
+    positions: PositionIndex
 
-    def __init__(self, root: ET._Element):
+    def __init__(self, root: Optional[ET._Element] = None):
         self.patterns = {}
         self.patterns_first = {}
+        self.positions = PositionIndex()
+        super().__init__(root)
 
+    def add_page(self, page: ET._Element):
         # Identify block patterns.
         # this is a block feature extractor..
-        for page in root.findall(f".//{ALTO}Page"):
-            blocks = page.findall(f".//{ALTO}TextBlock")
-            for block in blocks[:2] + blocks[-1:]:
-                text = misc.get_text(block)
-                first_line = text.split("\n")[0]
-                pattern = misc.get_pattern(first_line)
-
-                if len(pattern) <= 8:
-                    continue
-
-                if pattern in self.patterns:
-                    self.patterns[pattern] += 1
-                else:
-                    self.patterns[pattern] = 1
-                    self.patterns_first[pattern] = page.get("PHYSICAL_IMG_NR")
+        blocks = page.findall(f".//{ALTO}TextBlock")
+        for block in blocks[:2] + blocks[-1:]:
+            text = misc.get_text(block)
+            first_line = text.split("\n")[0]
+            pattern = misc.get_pattern(first_line)
+
+            if len(pattern) <= 8:
+                continue
+
+            if pattern in self.patterns:
+                self.patterns[pattern] += 1
+            else:
+                self.patterns[pattern] = 1
+                self.patterns_first[pattern] = page.get("PHYSICAL_IMG_NR")
 
     def has(self, tag: str) -> bool:
         return tag == f"{ALTO}TextLine"
@@ -40,13 +43,10 @@ class TextLineFeaturesExtractor(FeatureExtractor):
         if line.tag != f"{ALTO}TextLine":
             raise KeyError
         
-        block = line.xpath(f"./ancestor::alto:TextBlock", namespaces=ALTO_NS)
-
-        if len(block)==0:
+        position = self.positions.get(line, f"{ALTO}TextBlock")
+        if position is None:
             return {}
-        block=block[0]
-        block_lines = block.findall(f".//{ALTO}TextLine")
-        line_index = block_lines.index(line)
+        block = next(line.iterancestors(f"{ALTO}TextBlock"))
 
         line_text = misc.get_text(line).strip()
         line_words = line_text.split(" ")
@@ -59,23 +59,23 @@ class TextLineFeaturesExtractor(FeatureExtractor):
         block_h = float(block.get("HPOS"))
         block_w = float(block.get("WIDTH"))
 
-        if line_index > 0:
-            previous_line = block_lines[line_index - 1]
+        previous_line = position.previous()
+        if previous_line is not None:
             previous_line_v = float(previous_line.get("VPOS")) + float(
                 previous_line.get("HEIGHT")
             )
         else:
             previous_line_v = line_v
 
-        if line_index < len(block_lines) - 1:
-            next_line = block_lines[line_index + 1]
+        next_line = position.next()
+        if next_line is not None:
             next_line_v = float(next_line.get("VPOS"))
         else:
             next_line_v = line_v + line_height
 
         f: Dict[str, Any] = {}
         # geometry
-        f["#line_position"] = get_status(line, relative_to=f"alto:TextBlock")
+        f["#line_position"] = position.status
         # f["position_h"]     = line_h
         # f["position_v"]     = line_v
         f["prev_delta_h"] = line_h - block_h
@@ -85,13 +85,13 @@ class TextLineFeaturesExtractor(FeatureExtractor):
 
         f["repetitive"] = False
         f["repetitive_first"] = False
-        if line_index < 2 or line_index >= len(block_lines) - 1:
+        if position.index < 2 or position.index >= position.count - 1:
             pattern = misc.get_pattern(line_text)
             f["repetitive"] = (pattern in self.patterns) and (
                 self.patterns[pattern] >= 2
             )
             if pattern in self.patterns:
-                page = line.xpath(f"./ancestor::alto:Page", namespaces=ALTO_NS)[0]
+                page = next(line.iterancestors(f"{ALTO}Page"))
                 f["repetitive_first"] = self.patterns_first[pattern] == page.get(
                     "PHYSICAL_IMG_NR"
                 )
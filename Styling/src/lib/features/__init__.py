@@ -4,15 +4,58 @@ Features are hierarchical numerical/text descriptors for PDF articles.
 They are extracted automatically when using `lib.paper.Paper.get_features` and can be used for machine learning purposes.
 """
 
+import sys, hashlib, inspect
 import lxml.etree as ET
 from abc import abstractmethod
-from typing import Dict
+from typing import Dict, Iterable, Optional, Sequence, Type
 
 from ..misc.namespaces import *
 
 
+_source_digests: Dict[str, str] = {}
+
+
+def _source_digest(module: str) -> str:
+    """Hash of the source code of a loaded module, empty if it is not available."""
+    if module not in _source_digests:
+        try:
+            source = inspect.getsource(sys.modules[module])
+            _source_digests[module] = hashlib.sha1(source.encode()).hexdigest()[:12]
+        except (KeyError, OSError, TypeError):
+            _source_digests[module] = ""
+    return _source_digests[module]
+
+
 class FeatureExtractor:
-    """Extracts features for a kind of node."""
+    """Extracts features for a kind of node.
+
+    Document-wide information is collected through `FeatureExtractor.add_styles` and `FeatureExtractor.add_page`
+    before features are requested, so that documents can also be processed one page at a time.
+
+    Persisted features record the `fingerprint` of the extractor that computed them, and are recomputed
+    when it changes (see `lib.paper.Paper._update_features`).
+    """
+
+    version: int = 1
+    """Bump when the features change without a change of the extractor module (shared helpers, ..)."""
+
+    @classmethod
+    def fingerprint(cls) -> str:
+        """Identifies the computed features: `version` and a hash of the source code of the extractor module
+        and of `lib.features.vectorized`, which computes the same features."""
+        return f"{cls.version}-{_source_digest(cls.__module__)}-{_source_digest(f'{__name__}.vectorized')}"
+
+    def __init__(self, root: Optional[ET.Element] = None):
+        if root is not None:
+            self.add_styles(root.iter(f"{ALTO}TextStyle"))
+            for page in root.iter(f"{ALTO}Page"):
+                self.add_page(page)
+
+    def add_styles(self, styles: Iterable[ET.Element]):
+        """Collect document-wide information from the `TextStyle` nodes."""
+
+    def add_page(self, page: ET.Element):
+        """Collect document-wide information from a `Page` node."""
 
     @abstractmethod
     def has(self, tag: str) -> bool:
@@ -27,13 +70,32 @@ from .String import StringFeaturesExtractor
 from .Page import PageFeaturesExtractor
 from .TextBlock import TextBlockFeaturesExtractor
 from .TextLine import TextLineFeaturesExtractor
+from . import vectorized
+
 
+FEATURE_EXTRACTORS: Dict[str, Type[FeatureExtractor]] = {
+    f"{ALTO}Page": PageFeaturesExtractor,
+    f"{ALTO}TextBlock": TextBlockFeaturesExtractor,
+    f"{ALTO}TextLine": TextLineFeaturesExtractor,
+    f"{ALTO}String": StringFeaturesExtractor,
+}
+"""Feature extractor class of each kind of node."""
 
-def get_feature_extractors(root: ET.Element) -> Dict[str, FeatureExtractor]:
-    """Get feature extractor for each kind of node."""
+
+def get_feature_extractors(
+    root: Optional[ET.Element] = None, levels: Optional[Sequence[str]] = None
+) -> Dict[str, FeatureExtractor]:
+    """Get feature extractor for each kind of node, or for the given `levels` only.
+
+    When `root` is not given, document-wide information has to be provided using `add_styles` and `add_page`.
+    """
     return {
-        f"{ALTO}Page": PageFeaturesExtractor(root),
-        f"{ALTO}TextBlock": TextBlockFeaturesExtractor(root),
-        f"{ALTO}TextLine": TextLineFeaturesExtractor(root),
-        f"{ALTO}String": StringFeaturesExtractor(root),
+        level: extractor(root)
+        for level, extractor in FEATURE_EXTRACTORS.items()
+        if levels is None or level in levels
     }
+
+
+def get_fingerprints() -> Dict[str, str]:
+    """Fingerprint of the feature extractor of each kind of node, see `FeatureExtractor.fingerprint`."""
+    return {level: extractor.fingerprint() for level, extractor in FEATURE_EXTRACTORS.items()}
@@ -1,19 +1,93 @@
+"""## Node positions
+
+Position of a node among the nodes of the same kind in one of its ancestors (words in a line, blocks in a page, ..).
+
+`PositionIndex` lists the nodes of an ancestor once, the first time one of them is requested, so that
+requesting the position of every node in document order (as the feature extraction does) is linear.
+"""
 from __future__ import annotations
 
 from lxml import etree as ET
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 from ..misc.namespaces import *
 
 
-def get_status(element: ET.Element, relative_to: str) -> str:
-    parent = element.xpath(f"./ancestor::{relative_to}", namespaces=ALTO_NS)
-    assert len(parent) == 1
-    children = parent[0].findall(f".//{element.tag}")
-    position = children.index(element)
+class Position(NamedTuple):
+    """Position of a node among its siblings (nodes of the same tag in the same ancestor)."""
+
+    index: int
+    count: int
+    siblings: Sequence[ET.Element] = ()
+    """Sibling nodes, when they are available."""
+
+    @property
+    def status(self) -> str:
+        """`start`, `in` or `end`."""
+        if self.index == 0:
+            return "start"
+        elif self.index == self.count - 1:
+            return "end"
+        else:
+            return "in"
+
+    @property
+    def relative(self) -> float:
+        """Position between 0 (first) and 1 (last)."""
+        return self.index / max(self.count - 1, 1)
+
+    def previous(self) -> Optional[ET.Element]:
+        return self.siblings[self.index - 1] if self.index > 0 else None
+
+    def next(self) -> Optional[ET.Element]:
+        return self.siblings[self.index + 1] if self.index < self.count - 1 else None
+
+
+class PositionIndex:
+    """
+    Positions of nodes relative to an ancestor. The nodes of the last requested ancestor are kept, for each
+    (tag, ancestor tag) pair.
+
+    Example:
+    ```
+    positions = PositionIndex()
+    positions.get(word, f"{ALTO}TextLine").status   # -> "start", "in" or "end"
+    ```
+    """
+
+    _current: Dict[Tuple[str, str], Tuple[ET.Element, List[ET.Element], Dict[ET.Element, int]]]
+
+    def __init__(self):
+        self._current = {}
+
+    def get(self, element: ET.Element, relative_to: str) -> Optional[Position]:
+        """Position of `element` in its ancestor of tag `relative_to`, or None if there is no such ancestor."""
+        ancestor = next(element.iterancestors(relative_to), None)
+        if ancestor is None:
+            return None
+
+        key = (element.tag, relative_to)
+        current = self._current.get(key)
+        if current is None or current[0] is not ancestor:
+            siblings = list(ancestor.iter(element.tag))
+            current = (ancestor, siblings, {node: i for i, node in enumerate(siblings)})
+            self._current[key] = current
+
+        return Position(current[2][element], len(current[1]), current[1])
+
+
+def get_status(
+    element: ET.Element, relative_to: str, positions: Optional[PositionIndex] = None
+) -> str:
+    """
+    Position (`start`, `in` or `end`) of `element` among the nodes of the same tag
+    in its ancestor `relative_to` (for example `alto:TextLine`).
+    """
+    if positions is None:
+        positions = PositionIndex()
+    if relative_to.startswith("alto:"):
+        relative_to = ALTO + relative_to[len("alto:") :]
 
-    if position == 0:
-        return "start"
-    elif position == len(children) - 1:
-        return "end"
-    else:
-        return "in"
+    position = positions.get(element, relative_to)
+    assert position is not None
+    return position.status
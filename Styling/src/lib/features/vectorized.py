@@ -0,0 +1,216 @@
+"""## Vectorized feature extraction
+
+Computes the same features as the extractors of `lib.features`, using array operations over the token
+tables of a paper (`lib.paper.tokens.TokenTable`) instead of visiting XML nodes one at a time.
+Neighbouring nodes (previous/next word in the line, ..) are obtained by shifting the columns within
+groups of nodes sharing the same parent, and font attributes through arrays indexed by style.
+Only textual features (`word`, `word_pattern`, ..) are computed per token.
+
+Nodes are expected to follow pdfalto's structure: `None` is returned when they don't (a line outside of
+a block, a word with an unknown style, ..), and the features should then be built from the XML.
+"""
+from __future__ import annotations
+
+import re, unicodedata
+import numpy as np
+import pandas as pd
+from lxml import etree as ET
+from typing import TYPE_CHECKING, Dict, Optional, Sequence, Tuple
+
+from .String import StringFeaturesExtractor
+from ..misc.namespaces import *
+from ..misc import get_pattern
+
+if TYPE_CHECKING:
+    from ..paper.tokens import TokenTable
+
+REG_NUMBER = re.compile("[0-9]")
+REG_SPECIAL = re.compile("[^A-Za-z0-9]")
+
+
+def _group_positions(parents: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Index of each node among the consecutive nodes with the same parent, and the size of its group."""
+    n = len(parents)
+    starts = np.ones(n, dtype=bool)
+    starts[1:] = parents[1:] != parents[:-1]
+    group_start = np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+    group = np.cumsum(starts) - 1
+    return np.arange(n) - group_start, np.bincount(group)[group]
+
+
+def _status(index: np.ndarray, count: np.ndarray) -> np.ndarray:
+    """Position (`start`, `in` or `end`), see `lib.features.status.Position.status`."""
+    status = np.full(len(index), "in", dtype=object)
+    status[index == count - 1] = "end"
+    status[index == 0] = "start"
+    return status
+
+
+def _shift(values: np.ndarray, offset: int) -> np.ndarray:
+    """Values of the previous (offset 1) or next (offset -1) node. Boundaries are masked by the callers."""
+    return np.roll(values, offset)
+
+
+def _page_features(pages) -> pd.DataFrame:
+    index = np.arange(len(pages))
+    return pd.DataFrame({"#page_position": _status(index, np.full(len(pages), len(pages)))})
+
+
+def _block_features(blocks, pages) -> pd.DataFrame:
+    page = blocks["page"]
+    index, count = _group_positions(page)
+    first, last = index == 0, index == count - 1
+
+    min_h, min_v, max_h, max_v = (np.asarray(blocks[c]) for c in ["min_h", "min_v", "max_h", "max_v"])
+    page_w, page_height = np.asarray(pages["max_h"])[page], np.asarray(pages["max_v"])[page]
+
+    previous_block_v = np.where(first, 0, _shift(max_v, 1))
+    next_block_v = np.where(last, page_height, _shift(min_v, -1))
+
+    return pd.DataFrame(
+        {
+            "#block_position": _status(index, count),
+            "prev_delta_h": min_h,
+            "next_delta_h": page_w - max_h,
+            "prev_delta_v": min_v - previous_block_v,
+            "next_delta_v": next_block_v - max_v,
+            f"{ALTO}Page": page.astype(np.int64),
+        }
+    )
+
+
+def _block_patterns(blocks) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Patterns of the first line of the first two and last blocks of each page, see `TextLineFeaturesExtractor.add_page`."""
+    patterns: Dict[str, int] = {}
+    patterns_first: Dict[str, int] = {}
+
+    texts = blocks.contents()
+    page, page_num = blocks["page"].tolist(), blocks["page_num"].tolist()
+    bounds = [i for i in range(len(page)) if i == 0 or page[i] != page[i - 1]] + [len(page)]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        ids = list(range(start, end))
+        for i in ids[:2] + ids[-1:]:
+            pattern = get_pattern(texts[i].split("\n")[0])
+            if len(pattern) <= 8:
+                continue
+            if pattern in patterns:
+                patterns[pattern] += 1
+            else:
+                patterns[pattern] = 1
+                patterns_first[pattern] = page_num[i]
+    return patterns, patterns_first
+
+
+def _line_features(lines, blocks) -> pd.DataFrame:
+    block = lines["block"]
+    index, count = _group_positions(block)
+    first, last = index == 0, index == count - 1
+
+    min_h, min_v, max_h, max_v = (np.asarray(lines[c]) for c in ["min_h", "min_v", "max_h", "max_v"])
+    block_h, block_max_h = np.asarray(blocks["min_h"])[block], np.asarray(blocks["max_h"])[block]
+
+    previous_line_v = np.where(first, min_v, _shift(max_v, 1))
+    next_line_v = np.where(last, max_v, _shift(min_v, -1))
+
+    # repetitive lines: only the first two and the last line of each block are checked.
+    repetitive = np.zeros(len(lines), dtype=bool)
+    repetitive_first = np.zeros(len(lines), dtype=bool)
+    patterns, patterns_first = _block_patterns(blocks)
+    if len(patterns) > 0:
+        texts, page_num = lines.contents(), lines["page_num"]
+        for i in np.flatnonzero((index < 2) | (index >= count - 1)).tolist():
+            pattern = get_pattern(texts[i].strip())
+            if pattern in patterns:
+                repetitive[i] = patterns[pattern] >= 2
+                repetitive_first[i] = patterns_first[pattern] == page_num[i]
+
+    return pd.DataFrame(
+        {
+            "#line_position": _status(index, count),
+            "prev_delta_h": min_h - block_h,
+            "next_delta_h": block_max_h - max_h,
+            "prev_delta_v": min_v - previous_line_v,
+            "next_delta_v": next_line_v - max_v,
+            "repetitive": repetitive,
+            "repetitive_first": repetitive_first,
+            f"{ALTO}TextBlock": block.astype(np.int64),
+        }
+    )
+
+
+def _string_features(words, styles: Sequence[ET._Element]) -> Optional[pd.DataFrame]:
+    line = words["line"]
+    index, count = _group_positions(line)
+    first, last = index == 0, index == count - 1
+
+    # font attributes, by style index.
+    extractor = StringFeaturesExtractor()
+    extractor.add_styles(styles)
+    fonts = [extractor.fonts.get(style) for style in words.styles]
+    style = np.asarray(words["style"])
+    if np.any(style < 0) or any(fonts[s] is None for s in np.unique(style).tolist()):
+        return None
+    is_italic = np.array([font is not None and font.is_italic for font in fonts], dtype=bool)
+    is_math = np.array([font is not None and font.is_math for font in fonts], dtype=bool)
+    is_bold = np.array([font is not None and font.is_bold for font in fonts], dtype=bool)
+    size = np.array([font.size if font is not None else np.nan for font in fonts], dtype=np.float64)
+
+    min_h, max_h = np.asarray(words["min_h"]), np.asarray(words["max_h"])
+    previous_word_h = np.where(first, min_h, _shift(max_h, 1))
+    next_word_h = np.where(last, max_h, _shift(min_h, -1))
+
+    texts = [unicodedata.normalize("NFKD", text) for text in words.contents()]
+
+    return pd.DataFrame(
+        {
+            "#word_position": _status(index, count),
+            "length": (words["text_end"] - words["text_start"]).astype(np.int64),
+            "prev_delta_h": min_h - previous_word_h,
+            "next_delta_h": next_word_h - max_h,
+            "italic": is_italic[style],
+            "math": is_math[style],
+            "bold": is_bold[style],
+            "font_size": size[style],
+            "word": np.array(texts, dtype=object),
+            "word_pattern": np.array([get_pattern(text) for text in texts], dtype=object),
+            "has_number": np.array([REG_NUMBER.search(t) is not None for t in texts], dtype=bool),
+            "is_special": np.array([REG_SPECIAL.search(t) is not None for t in texts], dtype=bool),
+            f"{ALTO}TextLine": line.astype(np.int64),
+        }
+    )
+
+
+def build_features_dict(
+    styles: Sequence[ET._Element],
+    tables: Dict[str, TokenTable],
+    levels: Optional[Sequence[str]] = None,
+) -> Optional[Dict[str, pd.DataFrame]]:
+    """Compute raw features of each level (or of the given `levels`) from the token tables,
+    or None if the document structure is not supported.
+
+    Columns are the ones produced by the extractors, positional features still prefixed with `#`.
+    """
+    if levels is None:
+        levels = [f"{ALTO}Page", f"{ALTO}TextBlock", f"{ALTO}TextLine", f"{ALTO}String"]
+
+    pages, blocks = tables[f"{ALTO}Page"], tables[f"{ALTO}TextBlock"]
+    lines, words = tables[f"{ALTO}TextLine"], tables[f"{ALTO}String"]
+
+    if np.any(blocks["page"] < 0) or np.any(lines["block"] < 0) or np.any(words["line"] < 0):
+        return None
+
+    builders = {
+        f"{ALTO}Page": lambda: _page_features(pages) if len(pages) > 0 else None,
+        f"{ALTO}TextBlock": lambda: _block_features(blocks, pages) if len(blocks) > 0 else None,
+        f"{ALTO}TextLine": lambda: _line_features(lines, blocks) if len(lines) > 0 else None,
+        f"{ALTO}String": lambda: _string_features(words, styles) if len(words) > 0 else None,
+    }
+    features_dict = {level: builder() for level, builder in builders.items() if level in levels}
+    if len(words) > 0 and f"{ALTO}String" in levels and features_dict[f"{ALTO}String"] is None:
+        return None
+
+    # levels without nodes: same as `pd.DataFrame.from_dict([])`.
+    return {
+        level: features if features is not None else pd.DataFrame.from_dict([])
+        for level, features in features_dict.items()
+    }
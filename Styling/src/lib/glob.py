@@ -3,4 +3,11 @@
 TEST_INSTANCE = False
 ENABLE_TENSORFLOW = False
 REBUILD_FEATURES = False
+XML_CACHE_SIZE = 512
+COMPRESSION = "bz2"
+XML_SHARDING = False
+PERSIST_LAYER_INDEX = False
+LAYER_JOURNAL_SIZE = 1000
+LAYER_CACHE_SIZE = 256
+FEATURE_BACKEND = "dict"
 DATA_PATH = None
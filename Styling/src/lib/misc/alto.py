@@ -0,0 +1,73 @@
+"""## Streaming ALTO reader
+
+Reads pdfalto's output one page (or one block) at a time using `lxml.etree.iterparse`.
+Processed elements are cleared and detached from the document, so that peak memory
+depends on the size of a page and not on the size of the whole document.
+
+Example:
+```
+reader = AltoReader(paper.open_xml())
+for page in reader.pages():
+    ...                 # `page` is a complete Page element, cleared once the loop moves on.
+reader.styles           # TextStyle elements, available as soon as the first page is read.
+```
+"""
+from __future__ import annotations
+
+from lxml import etree as ET
+from typing import IO, Iterator, List, Union
+
+from .namespaces import *
+
+
+def _release(element: ET._Element):
+    """Free a processed element and its already processed siblings."""
+    element.clear(keep_tail=False)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+class AltoReader:
+    """
+    Streaming reader for an ALTO document.
+    Elements that are yielded are only valid until the next one is requested.
+    """
+
+    styles: List[ET._Element]
+    """`TextStyle` elements. As they precede the layout, the list is complete when the first page is yielded."""
+
+    def __init__(self, source: Union[str, IO[bytes]]):
+        self.source = source
+        self.styles = []
+
+    def _iter(self, tag: str) -> Iterator[ET._Element]:
+        context = ET.iterparse(
+            self.source,
+            events=("end",),
+            tag=(f"{ALTO}TextStyle", tag),
+            huge_tree=True,
+        )
+        for _, element in context:
+            if element.tag == f"{ALTO}TextStyle":
+                self.styles.append(element)
+                continue
+
+            yield element
+            _release(element)
+
+            if tag != f"{ALTO}Page":  # also release the enclosing page once it's done.
+                page = element.getparent()
+                while page is not None and page.tag != f"{ALTO}Page":
+                    page = page.getparent()
+                if page is not None and page.getprevious() is not None:
+                    _release(page.getprevious())
+
+    def pages(self) -> Iterator[ET._Element]:
+        """Iterate over `Page` elements."""
+        return self._iter(f"{ALTO}Page")
+
+    def blocks(self) -> Iterator[ET._Element]:
+        """Iterate over `TextBlock` elements. Their enclosing `Page` is accessible with `getparent`."""
+        return self._iter(f"{ALTO}TextBlock")
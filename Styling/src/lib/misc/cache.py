@@ -0,0 +1,134 @@
+"""## In-process caches
+
+A small thread-safe LRU cache bounded by an estimated memory budget.
+It is used to keep expensive objects (parsed XML documents, ..) around between calls.
+
+Each process owns its own cache: joblib/multiprocessing workers start either empty (spawn)
+or with a copy of the parent's entries (fork), in which case the lock is re-created in the child.
+"""
+from __future__ import annotations
+
+import os, threading, weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+_caches: weakref.WeakSet = weakref.WeakSet()
+
+
+class LRUCache:
+    """
+    Least-recently-used cache bounded by the sum of the entry sizes.
+
+    Example:
+    ```
+    cache = LRUCache(max_size=2**20, sizeof=len)
+    cache.put("a", b"...")
+    cache.get("a")   # -> b"..."
+    cache.stats      # -> {"hits": 1, "misses": 0, ...}
+    ```
+    """
+
+    max_size: int
+    """Memory budget, in the unit returned by `sizeof`. 0 disables the cache."""
+
+    def __init__(self, max_size: int, sizeof: Callable[[Any], int] = lambda _: 1):
+        self.max_size = max_size
+        self.sizeof = sizeof
+
+        self._entries: OrderedDict[Hashable, Tuple[Any, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        _caches.add(self)
+
+    def _reset_lock(self):
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Optional[Any]:
+        """Get cached value and mark it as recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None):
+        """Insert value, evicting least recently used entries to respect the budget."""
+        if size is None:
+            size = self.sizeof(value)
+
+        with self._lock:
+            self._pop(key)
+
+            if size > self.max_size:  # would evict everything for nothing.
+                return
+
+            self._entries[key] = (value, size)
+            self._size += size
+
+            while self._size > self.max_size:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._size -= old_size
+                self.evictions += 1
+
+    def _pop(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+            return entry[0]
+        return None
+
+    def invalidate(self, key: Hashable):
+        """Remove entry from cache."""
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        """Remove all entries and reset counters."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """Estimated size of the cached entries."""
+        return self._size
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Cache counters."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "size": self._size,
+                "max_size": self.max_size,
+            }
+
+
+def _after_fork():
+    for cache in list(_caches):
+        cache._reset_lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,147 @@
+"""## Compression codecs
+
+Artifacts (PDF XML, features) are stored compressed using a configurable codec.
+A file is stored as `<base path><codec extension>`, for example `article.xml.bz2`.
+When reading, the codec is detected from the extension, or from the magic bytes if the extension is unknown,
+so that files written with another codec can still be read.
+
+Available codecs: `none`, `gzip` (zlib), `lzma`, `bz2`, and `zstd`/`lz4` when the `zstandard`/`lz4` modules are installed.
+
+Example:
+```
+with codec.write("/tmp/layer.json", "zstd") as f:  # writes /tmp/layer.json.zst
+    f.write(b"...")
+with codec.open_read(codec.find("/tmp/layer.json")) as f:
+    f.read()
+```
+"""
+from __future__ import annotations
+
+import os, bz2, gzip, lzma
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import IO, Callable, Dict, Iterator, List, Optional
+
+
+@dataclass
+class Codec:
+    """A compression format."""
+
+    name: str
+    extension: str
+    magic: bytes
+    open: Callable[[str, str], IO[bytes]]
+
+
+CODECS: Dict[str, Codec] = {
+    "none": Codec("none", "", b"", lambda path, mode: open(path, mode)),
+    "gzip": Codec("gzip", ".gz", b"\x1f\x8b", lambda path, mode: gzip.open(path, mode)),
+    "lzma": Codec("lzma", ".xz", b"\xfd7zXZ\x00", lambda path, mode: lzma.open(path, mode)),
+    "bz2": Codec("bz2", ".bz2", b"BZh", lambda path, mode: bz2.open(path, mode)),
+}
+"""Available codecs, by name."""
+
+try:
+    import zstandard
+
+    CODECS["zstd"] = Codec(
+        "zstd", ".zst", b"\x28\xb5\x2f\xfd", lambda path, mode: zstandard.open(path, mode)
+    )
+except ImportError:
+    pass
+
+try:
+    import lz4.frame
+
+    CODECS["lz4"] = Codec(
+        "lz4", ".lz4", b"\x04\x22\x4d\x18", lambda path, mode: lz4.frame.open(path, mode)
+    )
+except ImportError:
+    pass
+
+ALIASES = {"zlib": "gzip", "xz": "lzma", "bzip2": "bz2", "zstandard": "zstd"}
+
+
+def get_codec(name: str) -> Codec:
+    """Get codec by name."""
+    name = ALIASES.get(name, name)
+    if name not in CODECS:
+        raise Exception(
+            f"Unknown or unavailable codec {name} (available: {', '.join(CODECS)})"
+        )
+    return CODECS[name]
+
+
+def variants(base_path: str) -> List[str]:
+    """Existing files for given base path, whatever their codec."""
+    return [
+        base_path + c.extension
+        for c in CODECS.values()
+        if os.path.exists(base_path + c.extension)
+    ]
+
+
+def find(base_path: str, preferred: Optional[str] = None) -> Optional[str]:
+    """Get location of the file stored at given base path, trying the `preferred` codec first."""
+    order = list(CODECS.values())
+    if preferred is not None:
+        order.insert(0, get_codec(preferred))
+
+    for c in order:
+        if os.path.exists(base_path + c.extension):
+            return base_path + c.extension
+    return None
+
+
+def detect(path: str) -> Codec:
+    """Detect the codec of a file from its extension, or its magic bytes."""
+    for c in CODECS.values():
+        if c.extension != "" and path.endswith(c.extension):
+            return c
+
+    with open(path, "rb") as f:
+        header = f.read(8)
+    for c in CODECS.values():
+        if c.magic != b"" and header.startswith(c.magic):
+            return c
+    return CODECS["none"]
+
+
+def open_read(path: str) -> IO[bytes]:
+    """Open a file for reading, decompressing it on the fly."""
+    return detect(path).open(path, "rb")
+
+
+def read(path: str) -> bytes:
+    """Read and decompress a file."""
+    with open_read(path) as f:
+        return f.read()
+
+
+@contextmanager
+def write(base_path: str, codec: str) -> Iterator[IO[bytes]]:
+    """Write a file at given base path using the requested codec.
+
+    The file is written atomically and replaces the versions stored with other codecs.
+    """
+    c = get_codec(codec)
+    path = base_path + c.extension
+    tmp_path = path + ".tmp"
+
+    try:
+        with c.open(tmp_path, "wb") as f:
+            yield f
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+    for other in variants(base_path):
+        if other != path:
+            os.remove(other)
+
+
+def remove(base_path: str):
+    """Remove the file stored at given base path, whatever its codec."""
+    for path in variants(base_path):
+        os.remove(path)
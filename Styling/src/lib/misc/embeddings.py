@@ -1,7 +1,6 @@
 from typing import List
 
 from ..paper import Paper
-from .bounding_box import BBX
 from .namespaces import ALTO
 from . import get_pattern
 
@@ -10,9 +9,8 @@ def build_vocabulary(size: int, documents: List[Paper]) -> dict:
     # count items and select most common.
     vocab = {}
     for paper, _ in documents:
-        for token in paper.get_xml().getroot().findall(f".//{ALTO}String"):
-            bbx = BBX.from_element(token)
-            text = get_pattern(token.get("CONTENT"))
+        for content in paper.get_tokens(f"{ALTO}String").contents():
+            text = get_pattern(content)
             vocab[text] = vocab.get(text, 0) + 1
 
     sorted_vocab = sorted(vocab.items(), key=lambda x: x[1], reverse=True)
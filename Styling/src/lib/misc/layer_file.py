@@ -0,0 +1,189 @@
+"""## Binary annotation layer files
+
+Annotation layers are stored in a compact binary format that can be memory-mapped,
+so that loading a layer doesn't decode every box:
+
+- a header: magic bytes, format version and size of the metadata,
+- JSON metadata: number of boxes, box IDs and the label string table,
+- a structured array of `BOX_DTYPE` (page, coordinates, label index, group), one row per box,
+- the `user_data` side store: jsonpickle-encoded values indexed by an offset array, decoded on access.
+
+Example:
+```
+write_layer("/tmp/annot.json.bin", ids, boxes)
+data = read_layer("/tmp/annot.json.bin")
+data.rows["page_num"]   # memory-mapped columns
+data.box(0)             # `lib.misc.bounding_box.LabelledBBX`, with its user_data
+```
+"""
+from __future__ import annotations
+
+import os, json, struct, jsonpickle
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+from .bounding_box import LabelledBBX
+
+MAGIC = b"TKBLAYER"
+LAYER_VERSION = 1
+"""Bump when the on-disk layout changes."""
+
+_HEADER = struct.Struct("<8sIIQ")  # magic, version, reserved, metadata size
+
+BOX_DTYPE = np.dtype(
+    [
+        ("page_num", "<i4"),
+        ("min_h", "<f8"),
+        ("min_v", "<f8"),
+        ("max_h", "<f8"),
+        ("max_v", "<f8"),
+        ("label", "<i4"),
+        ("group", "<i8"),
+    ]
+)
+"""Row layout: page, box, index in the label table and group."""
+
+
+class LayerFormatException(Exception):
+    """Raised when a file is not a readable binary layer."""
+
+
+class LayerData:
+    """Content of a binary layer file. Rows are memory-mapped and boxes are only built when requested."""
+
+    ids: List[str]
+    """Box IDs, in layer order."""
+    rows: np.ndarray
+    """Structured array of `BOX_DTYPE`."""
+    labels: List[str]
+    """Label string table, referenced by the `label` column."""
+
+    def __init__(
+        self,
+        ids: List[str],
+        rows: np.ndarray,
+        labels: List[str],
+        user_data_offsets: np.ndarray,
+        user_data: np.ndarray,
+    ):
+        self.ids = ids
+        self.rows = rows
+        self.labels = labels
+        self._user_data_offsets = user_data_offsets
+        self._user_data = user_data
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def coordinates(self) -> np.ndarray:
+        """Bounding boxes as a (n, 4) array of min_h, min_v, max_h, max_v."""
+        return np.stack(
+            [self.rows["min_h"], self.rows["min_v"], self.rows["max_h"], self.rows["max_v"]],
+            axis=1,
+        ).reshape(-1, 4)
+
+    def label_array(self) -> np.ndarray:
+        """Label of each box."""
+        return np.array(self.labels, dtype=object)[self.rows["label"]]
+
+    def user_data(self, i: int) -> Optional[Any]:
+        """Decode user data of the i-th box."""
+        start, end = self._user_data_offsets[i], self._user_data_offsets[i + 1]
+        if start == end:
+            return None
+        return jsonpickle.decode(self._user_data[start:end].tobytes().decode())
+
+    def box(self, i: int) -> LabelledBBX:
+        """Build the i-th box."""
+        page_num, min_h, min_v, max_h, max_v, label, group = self.rows[i].item()
+        return LabelledBBX(
+            self.labels[label], group, page_num, min_h, min_v, max_h, max_v, self.user_data(i)
+        )
+
+
+def is_layer_file(path: str) -> bool:
+    """If the file is a binary layer."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def read_layer(path: str) -> LayerData:
+    """Open a binary layer, memory-mapping its arrays."""
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise LayerFormatException(f"{path}: truncated file")
+        magic, version, _, meta_size = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise LayerFormatException(f"{path}: not a binary layer")
+        if version != LAYER_VERSION:
+            raise LayerFormatException(f"{path}: unsupported version {version}")
+        meta = json.loads(f.read(meta_size).decode())
+
+    n = meta["n_boxes"]
+    offset = _align(_HEADER.size + meta_size)
+
+    def map_array(dtype, count):
+        nonlocal offset
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        array = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+        offset += array.nbytes
+        return array
+
+    rows = map_array(BOX_DTYPE, n)
+    user_data_offsets = map_array(np.dtype("<i8"), n + 1)
+    user_data = map_array(np.uint8, meta["user_data_size"])
+    return LayerData(meta["ids"], rows, meta["labels"], user_data_offsets, user_data)
+
+
+def write_layer(path: str, ids: List[str], boxes: List[LabelledBBX]):
+    """Write a binary layer, atomically."""
+    label_index: Dict[str, int] = {}
+    rows = np.array(
+        [
+            (
+                box.page_num,
+                box.min_h,
+                box.min_v,
+                box.max_h,
+                box.max_v,
+                label_index.setdefault(box.label, len(label_index)),
+                box.group,
+            )
+            for box in boxes
+        ],
+        dtype=BOX_DTYPE,
+    )
+
+    user_data = [
+        b"" if getattr(box, "user_data", None) is None else jsonpickle.encode(box.user_data).encode()
+        for box in boxes
+    ]
+    user_data_offsets = np.zeros(len(boxes) + 1, dtype="<i8")
+    np.cumsum([len(x) for x in user_data], out=user_data_offsets[1:])
+
+    meta = json.dumps(
+        {
+            "n_boxes": len(boxes),
+            "ids": ids,
+            "labels": list(label_index),
+            "user_data_size": int(user_data_offsets[-1]),
+        }
+    ).encode()
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(_HEADER.pack(MAGIC, LAYER_VERSION, 0, len(meta)))
+        f.write(meta)
+        f.write(b"\0" * (_align(_HEADER.size + len(meta)) - _HEADER.size - len(meta)))
+        f.write(rows.tobytes())
+        f.write(user_data_offsets.tobytes())
+        f.write(b"".join(user_data))
+    os.replace(path + ".tmp", path)
+
+
+def _align(offset: int, alignment: int = 8) -> int:
+    return (offset + alignment - 1) // alignment * alignment
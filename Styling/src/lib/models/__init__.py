@@ -2,3 +2,4 @@
 
 from ..config import config
 from .crf import CRFTagger
+from .corpus import SequenceCorpus, cached_sequence
@@ -0,0 +1,167 @@
+"""## Training corpus
+
+Labelled sequences (crfsuite items, see `lib.models.crf.CRFTagger.to_items`, and their labels) stored on disk
+in shards, so that a training set doesn't have to fit in memory: sequences are written one at a time as they
+are produced, and read back one at a time by each pass of the trainer.
+
+A corpus records the key it was built with (documents, target, label filter, ..), so that it is reused when
+training again with the same data.
+
+The sequence of each paper can also be cached on its own (`cached_sequence`), so that a corpus of another set of
+papers (another split, ..) is built without featurizing them again.
+
+Example:
+```
+corpus = SequenceCorpus(directory)
+if not corpus.is_complete(key):
+    with corpus.writer(key) as write:
+        write(items, labels, paper_id)
+tagger.train(corpus.items(), corpus.labels(), args)
+```
+"""
+import os, json, pickle, shutil
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Set, Tuple, Union
+
+CORPUS_VERSION = 1
+
+SHARD_SIZE = 64
+"""Number of sequences per shard."""
+
+
+class _CorpusView:
+    """One field of the sequences of a corpus (of given ids only, when given), which can be iterated several times."""
+
+    def __init__(self, corpus: "SequenceCorpus", field: int, ids: Optional[Set[str]] = None):
+        self.corpus = corpus
+        self.field = field
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return self.corpus.count(self.ids)
+
+    def __iter__(self):
+        for sequence in self.corpus.sequences(self.ids):
+            yield sequence[self.field]
+
+
+class SequenceCorpus:
+    """Labelled sequences stored in a directory, as a list of shards of pickled `(items, labels, id)` tuples."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _index(self) -> Optional[dict]:
+        try:
+            with open(f"{self.directory}/index.json", "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return index if index.get("version") == CORPUS_VERSION else None
+
+    def is_complete(self, key: str) -> bool:
+        """Whether the corpus has been completely written with given key."""
+        index = self._index()
+        return index is not None and index["key"] == key
+
+    @contextmanager
+    def writer(
+        self, key: Union[str, Callable[[], str]], shard_size: int = SHARD_SIZE
+    ) -> Iterator[Callable[[List[dict], List[str], str], None]]:
+        """Replace the content of the corpus. Yields a function writing a sequence `(items, labels, id)`.
+
+        The corpus is complete once the context is left without error. `key` can be a function, called then:
+        for keys depending on files created while writing the sequences.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+
+        shards: List[List[str]] = []  # ids of the sequences of each shard.
+        shard = None
+
+        def write(items: List[dict], labels: List[str], sequence_id: str):
+            nonlocal shard
+            if len(shards) == 0 or len(shards[-1]) == shard_size:
+                if shard is not None:
+                    shard.close()
+                shard = open(f"{self.directory}/{len(shards):05d}.pkl", "wb")
+                shards.append([])
+            pickle.dump((items, labels, sequence_id), shard, protocol=pickle.HIGHEST_PROTOCOL)
+            shards[-1].append(sequence_id)
+
+        try:
+            yield write
+        finally:
+            if shard is not None:
+                shard.close()
+
+        # written last: marks the corpus as complete.
+        with open(f"{self.directory}/index.json", "w") as f:
+            json.dump(
+                {"version": CORPUS_VERSION, "key": key() if callable(key) else key, "shards": shards}, f
+            )
+
+    def count(self, ids: Optional[Set[str]] = None) -> int:
+        """Number of sequences (of given ids only, when given)."""
+        index = self._index()
+        if index is None:
+            return 0
+        return sum(
+            len(shard) if ids is None else sum(1 for i in shard if i in ids) for shard in index["shards"]
+        )
+
+    def sequences(self, ids: Optional[Set[str]] = None) -> Iterator[Tuple[List[dict], List[str], str]]:
+        """Stream the sequences (of given ids only, when given), skipping the shards that hold none of them."""
+        index = self._index()
+        if index is None:
+            raise Exception(f"Incomplete corpus: {self.directory}")
+        for n, shard in enumerate(index["shards"]):
+            if ids is not None and ids.isdisjoint(shard):
+                continue
+            with open(f"{self.directory}/{n:05d}.pkl", "rb") as f:
+                while True:
+                    try:
+                        sequence = pickle.load(f)
+                    except EOFError:
+                        break
+                    if ids is None or sequence[2] in ids:
+                        yield sequence
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __iter__(self) -> Iterator[Tuple[List[dict], List[str], str]]:
+        return self.sequences()
+
+    def items(self, ids: Optional[Set[str]] = None) -> _CorpusView:
+        """Items of each sequence (of given ids only, when given)."""
+        return _CorpusView(self, 0, ids)
+
+    def labels(self, ids: Optional[Set[str]] = None) -> _CorpusView:
+        """Labels of each sequence (of given ids only, when given)."""
+        return _CorpusView(self, 1, ids)
+
+    def ids(self) -> _CorpusView:
+        """Identifier of each sequence."""
+        return _CorpusView(self, 2)
+
+
+def cached_sequence(
+    path: str, key: str, compute: Callable[[], Optional[Tuple[List[dict], List[str], str]]]
+) -> Optional[Tuple[List[dict], List[str], str]]:
+    """Sequence stored in file `path` if it was computed with given key, otherwise the result of `compute`,
+    which is stored along with the key (None results included)."""
+    try:
+        with open(path, "rb") as f:
+            stored_key, sequence = pickle.load(f)
+        if stored_key == key:
+            return sequence
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    sequence = compute()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "wb") as f:
+        pickle.dump((key, sequence), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.tmp", path)  # concurrent readers never see a partial file.
+    return sequence
@@ -1,10 +1,15 @@
 """Conditional random field sequence tagger"""
 import pickle
-import os, time
+import os, time, math
+import numpy as np
+import pandas as pd
+import pycrfsuite
 from sklearn_crfsuite import CRF
 from collections import Counter
 from termcolor import colored
-from typing import Dict, Any, List, Iterator
+from typing import Dict, Any, List, Iterator, Optional, Tuple, Union
+
+from ..misc import filter_nan
 
 
 def print_transitions(trans_features):
@@ -17,14 +22,58 @@ def print_state_features(state_features):
         print("%0.6f %-8s %s" % (weight, label, attr))
 
 
+def _attribute(column: bytes, value) -> Optional[Tuple[bytes, Any]]:
+    """crfsuite attribute of a feature value (see `pycrfsuite.ItemSequence`), None for NaN."""
+    if isinstance(value, np.generic):  # as boxed by `DataFrame.to_dict`.
+        value = value.item()
+    if isinstance(value, str):
+        return column + b":" + value.encode("utf8"), 1.0
+    elif isinstance(value, bytes):
+        return column + b":" + value, 1.0
+    elif type(value) == float and math.isnan(value):
+        return None
+    elif type(value) == dict:
+        return column, filter_nan(value)
+    else:
+        return column, value
+
+
+def _column_attributes(
+    column: bytes, values: pd.Series
+) -> Tuple[Optional[List[int]], Union[bytes, List[bytes]], List[Any]]:
+    """Attributes of a feature column: rows having one (None for all rows), their names and values."""
+    dtype = values.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in "biuf":
+        array = values.to_numpy()
+        if dtype.kind == "f":
+            rows = np.flatnonzero(~np.isnan(array))
+            return rows.tolist(), column, array[rows].tolist()
+        return None, column, array.tolist()
+
+    # categorical and object columns: attributes are formatted once per distinct value.
+    try:
+        codes, uniques = pd.factorize(values)
+    except TypeError:  # unhashable values, such as aggregated counts.
+        attributes = [_attribute(column, value) for value in values.tolist()]
+    else:
+        unique_attributes = [_attribute(column, value) for value in uniques]
+        attributes = [unique_attributes[code] for code in codes.tolist()]
+        for i in np.flatnonzero(codes < 0).tolist():  # missing values.
+            attributes[i] = _attribute(column, values.iat[i])
+
+    rows = [i for i, attribute in enumerate(attributes) if attribute is not None]
+    return rows, [attributes[i][0] for i in rows], [attributes[i][1] for i in rows]
+
+
 class CRFTagger:
     model: CRF
-    model_filename: str
+    model_filename: Optional[str]
+    """Where the model is saved, None for a model that isn't saved."""
 
-    def __init__(self, model_filename):
+    def __init__(self, model_filename: Optional[str]):
         self.model_filename = model_filename
 
-        if os.path.exists(model_filename):
+        if model_filename is not None and os.path.exists(model_filename):
             with open(self.model_filename, "rb") as f:
                 self.model = pickle.load(f)
         else:
@@ -39,7 +88,36 @@ class CRFTagger:
             min_freq=args.min_freq,
         )
 
-    def __call__(self, tokens: Iterator[List[dict]]):
+    @staticmethod
+    def to_items(features: pd.DataFrame) -> List[dict]:
+        """crfsuite items of the rows of a feature frame, built column by column.
+
+        Items are the same as the NaN-filtered records of the frame (`filter_nan`), with attribute names
+        already formatted: string values are turned into `column:value` attributes.
+        """
+        items: List[dict] = [{} for _ in range(len(features))]
+
+        # with repeated column names, records hold the last value at the position of the first column.
+        last_position = {column: j for j, column in enumerate(features.columns)}
+        for column in dict.fromkeys(features.columns):
+            rows, keys, values = _column_attributes(
+                str(column).encode("utf8"), features.iloc[:, last_position[column]]
+            )
+            targets = items if rows is None else [items[i] for i in rows]
+            if isinstance(keys, bytes):
+                for item, value in zip(targets, values):
+                    item[keys] = value
+            else:
+                for item, key, value in zip(targets, keys, values):
+                    item[key] = value
+        return items
+
+    @staticmethod
+    def to_item_sequence(features: pd.DataFrame) -> pycrfsuite.ItemSequence:
+        """crfsuite sequence of the rows of a feature frame, which can be given to the tagger, see `to_items`."""
+        return pycrfsuite.ItemSequence(CRFTagger.to_items(features))
+
+    def __call__(self, tokens: Iterator[Union[List[dict], pycrfsuite.ItemSequence]]):
         if self.model is None:
             raise Exception("Model not trained")
         return self.model.predict(tokens)
@@ -63,6 +141,9 @@ class CRFTagger:
 
         if args.verbose:
             print(f"Took {time.time() - t0}s to train.")
+        if self.model_filename is None:
+            return
+        if args.verbose:
             print("Saved CRF.")
         with open(self.model_filename, "wb") as f:
             pickle.dump(self.model, f)
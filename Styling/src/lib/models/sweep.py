@@ -0,0 +1,85 @@
+"""## Hyperparameter sweep
+
+Evaluation of CRF hyperparameters (`c1`, `c2`, `min_freq`, `max_iter`) on the sequences of a training corpus
+(see `lib.models.corpus`), featurized once and shared by all configurations. Each configuration is trained on
+the training papers of each fold and scored on its validation papers; evaluations are independent, so that they
+can be spread over a process pool (crfsuite trains on a single core).
+
+Example:
+```
+configurations = parameter_space({"c1": [0.01, 0.1], "c2": [0.01, 0.1]}, n_iter=None)
+tasks = [(corpus.directory, c, 0, train_ids, val_ids, labels) for c in configurations]
+results = summarize(pd.DataFrame(pool.map(evaluate, tasks)))
+```
+"""
+import time, argparse
+import pandas as pd
+from typing import Dict, List, Optional, Set, Tuple
+from sklearn import metrics
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+
+from .crf import CRFTagger
+from .corpus import SequenceCorpus
+
+PARAMETERS = ["c1", "c2", "min_freq", "max_iter"]
+"""Hyperparameters of a configuration."""
+
+
+def parameter_space(grid: Dict[str, List], n_iter: Optional[int] = None, seed: int = 0) -> List[dict]:
+    """All configurations of the grid, or `n_iter` configurations sampled from it without replacement."""
+    if n_iter is None:
+        return list(ParameterGrid(grid))
+    n_iter = min(n_iter, len(ParameterGrid(grid)))
+    return list(ParameterSampler(grid, n_iter=n_iter, random_state=seed))
+
+
+def _label(tag: str) -> str:
+    """Label of a B-/I-/E- tag."""
+    return tag.split("-", 1)[1] if tag != "O" else tag
+
+
+def evaluate(task: Tuple[str, dict, int, Set[str], Set[str], List[str]]) -> dict:
+    """Train a CRF with given parameters on the training sequences of a fold and score it on its validation
+    sequences (token-level macro scores over `labels`).
+
+    Tasks are `(corpus directory, parameters, fold, training ids, validation ids, labels)`.
+    """
+    (directory, parameters, fold, train_ids, val_ids, labels) = task
+    corpus = SequenceCorpus(directory)
+
+    tagger = CRFTagger(None)
+    t0 = time.time()
+    tagger.train(
+        corpus.items(train_ids),
+        corpus.labels(train_ids),
+        argparse.Namespace(**parameters, verbose=False),
+    )
+    train_time = time.time() - t0
+
+    t0 = time.time()
+    y_pred = tagger(corpus.items(val_ids))
+    predict_time = time.time() - t0
+
+    y = [_label(tag) for tags in corpus.labels(val_ids) for tag in tags]
+    y_pred = [_label(tag) for tags in y_pred for tag in tags]
+    precision, recall, f1, _ = metrics.precision_recall_fscore_support(
+        y, y_pred, labels=labels, average="macro", zero_division=0
+    )
+    return {
+        "fold": fold,
+        **{name: parameters[name] for name in PARAMETERS},
+        "n_train": len(train_ids),
+        "n_val": len(val_ids),
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "train_time": train_time,
+        "predict_time": predict_time,
+    }
+
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """Mean scores and times of each configuration over folds, best configurations first."""
+    summary = results.drop(columns="fold").groupby(PARAMETERS).mean()
+    summary["folds"] = results.groupby(PARAMETERS).size()
+    return summary.sort_values("f1", ascending=False).reset_index()
@@ -6,9 +6,9 @@ These are managed by SQLAlchemy.
 """
 from __future__ import annotations
 
-import os, bz2, shutil, subprocess, pickle, json, time, datetime
+import os, io, copy, shutil, subprocess, pickle, json, time, datetime
 import fitz, shortuuid, pandas as pd, numpy as np
-from typing import Dict, Optional, List, Tuple
+from typing import IO, Dict, Iterator, Optional, List, Tuple
 from lxml import etree as ET
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, String, Boolean
@@ -17,16 +17,40 @@ from sqlalchemy import String, Column, ForeignKey, DateTime, Text, Table
 
 from ..classes import AnnotationClass, AnnotationClassFilter
 from ..config import config
-from ..annotations import AnnotationLayer
+from ..annotations import (
+    AnnotationLayer,
+    load_token_labels,
+    remove_token_labels,
+    remove_layer_files,
+)
 from ..misc.bounding_box import BBX, LabelledBBX
+from ..misc.alto import AltoReader
+from ..misc.cache import LRUCache
+from ..misc import codec
 from ..misc.namespaces import *
-from . import features
+from . import features, tokens, shards
+from .tokens import TokenTable
+from .layer_cache import LayerCache
+
+
+XML_SIZE_FACTOR = 20
+"""Estimated memory footprint of a parsed lxml tree relative to the size of the XML source."""
+
+xml_cache = LRUCache(config.XML_CACHE_SIZE * 2 ** 20)
+"""Process-wide cache of parsed XML documents, keyed by XML file and modification time."""
+
+layer_cache = LayerCache(config.LAYER_CACHE_SIZE * 2 ** 20)
+"""Process-wide cache of annotation layers, used by the web server."""
 
 
 class ParentModelNotFoundException(Exception):
     kind: str
 
 
+class PDFConversionException(Exception):
+    """Raised when pdfalto fails to convert a PDF."""
+
+
 Base = declarative_base()
 
 association_table = Table(
@@ -192,7 +216,7 @@ class Paper(Base):
         """Remove annotation layer from paper."""
         location = f"{self.meta_path}/annot_{layer_id}.json"
         try:
-            os.remove(location + ".bz2")
+            remove_layer_files(location)
         except Exception:
             print("exception when deleted: ", location)
 
@@ -227,37 +251,234 @@ class Paper(Base):
                 return layer
         raise Exception("Layer not found")
 
-    def __pdfalto(self, xml_path):
-        """Extract XML from PDF using PDFalto."""
-        result = subprocess.run(
-            [
-                "pdfalto",
-                "-readingOrder",
-                "-annotation",
-                self.pdf_path,
-                xml_path,
-            ]
-        )
-        if result.returncode != 0:
-            raise Exception("Failed to convert to xml.")
-        else:
-            subprocess.run(["bzip2", "-z", xml_path])
+    @property
+    def is_converted(self) -> bool:
+        """If the PDF has already been converted to XML."""
+        return self.is_sharded or codec.find(f"{self.meta_path}/article.xml") is not None
+
+    @property
+    def is_sharded(self) -> bool:
+        """If the XML is stored as one file per page (see `lib.paper.shards`)."""
+        return shards.is_sharded(self._shards_path)
+
+    @property
+    def _shards_path(self) -> str:
+        return f"{self.meta_path}/pages"
+
+    def convert(self, timeout: Optional[float] = None, memory_limit: Optional[int] = None):
+        """Extract XML from PDF using PDFalto, then compress it, sharded by page if `xml_sharding` is enabled.
+
+        ## Args:
+
+        * **timeout**: maximum running time of pdfalto, in seconds.
+        * **memory_limit**: maximum address space of pdfalto, in MB.
+
+        Raises `PDFConversionException` on failure.
+        """
+        xml_path = f"{self.meta_path}/article.xml"
+        # pdfalto writes to a scratch directory: a partial output never looks converted.
+        work_path = f"{self.meta_path}/pdfalto.tmp"
+        raw_path = f"{work_path}/article.xml"
+
+        def limit_memory():
+            import resource
+
+            limit = memory_limit * 2 ** 20
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+        shutil.rmtree(work_path, ignore_errors=True)
+        os.makedirs(work_path)
+        try:
+            try:
+                result = subprocess.run(
+                    [
+                        "pdfalto",
+                        "-readingOrder",
+                        "-annotation",
+                        self.pdf_path,
+                        raw_path,
+                    ],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                    timeout=timeout,
+                    preexec_fn=limit_memory if memory_limit is not None else None,
+                )
+            except subprocess.TimeoutExpired:
+                raise PDFConversionException(f"pdfalto timed out after {timeout}s.")
+
+            if result.returncode != 0 or not os.path.exists(raw_path):
+                raise PDFConversionException(
+                    f"Failed to convert to xml (code {result.returncode}): "
+                    + result.stderr.decode(errors="replace").strip()[-500:]
+                )
+
+            # other outputs of pdfalto (`article_annot.xml`, ..).
+            for name in os.listdir(work_path):
+                if name != "article.xml":
+                    target = f"{self.meta_path}/{name}"
+                    if os.path.isdir(target):
+                        shutil.rmtree(target)
+                    os.replace(f"{work_path}/{name}", target)
+
+            # compress in-process, the final file only appears once complete.
+            if config.XML_SHARDING:
+                with open(raw_path, "rb") as f_in:
+                    shards.write_shards(f_in, self._shards_path, config.COMPRESSION)
+                codec.remove(xml_path)
+            else:
+                with open(raw_path, "rb") as f_in, codec.write(xml_path, config.COMPRESSION) as f_out:
+                    shutil.copyfileobj(f_in, f_out, 2 ** 20)
+                if os.path.exists(self._shards_path):
+                    shutil.rmtree(self._shards_path)
+        finally:
+            shutil.rmtree(work_path, ignore_errors=True)
+
+    def _xml_file(self) -> str:
+        """Get location of the compressed XML (or of the shard index), converting the PDF if needed."""
+        if self.is_sharded:
+            return shards.index_file(self._shards_path)
 
-    def get_xml(self) -> ET.ElementTree:
-        """Get XML parsed representation of the PDF."""
         xml_path = f"{self.meta_path}/article.xml"
-        if not os.path.exists(xml_path + ".bz2"):
-            self.__pdfalto(xml_path)
+        xml_file = codec.find(xml_path, config.COMPRESSION)
+        if xml_file is None:
+            self.convert()
+            return self._xml_file()
+        return xml_file
 
-        with bz2.BZ2File(xml_path + ".bz2", "r") as f:
-            return ET.parse(f)
+    def _xml_cache_key(self) -> Tuple[str, int]:
+        xml_file = self._xml_file()
+        return (xml_file, os.stat(xml_file).st_mtime_ns)
+
+    def open_xml(self) -> IO[bytes]:
+        """Open the XML representation of the PDF as a decompressed stream.
+
+        Use it with `lib.misc.alto.AltoReader` to process the document one page at a time.
+        Sharded documents are stitched on the fly.
+        """
+        xml_file = self._xml_file()
+        if self.is_sharded:
+            return shards.open_document(self._shards_path)
+        return codec.open_read(xml_file)
+
+    def get_xml(self) -> ET.ElementTree:
+        """Get XML parsed representation of the PDF.
+
+        Parsed documents are kept in `xml_cache` and shared between callers: they must not be modified.
+        """
+        key = self._xml_cache_key()
+        xml_file = key[0]
+        tree = xml_cache.get(key)
+        if tree is not None:
+            return tree
+
+        if self.is_sharded:
+            with self.open_xml() as f:
+                tree = ET.parse(f)
+            size = shards.document_size(self._shards_path)
+        else:
+            data = codec.read(xml_file)
+            tree = ET.parse(io.BytesIO(data))
+            size = len(data)
+
+        xml_cache.put(key, tree, size=XML_SIZE_FACTOR * size)
+        return tree
+
+    def get_page_xml(self, page_num: int) -> ET._Element:
+        """Get the `Page` element of given physical page number (starting at 1).
+
+        Only this page is parsed when the XML is sharded or not cached.
+        """
+        self._xml_file()  # converts the PDF if needed.
+        if self.is_sharded:
+            return shards.load_page(self._shards_path, page_num)
+
+        for page in self.iter_pages():
+            if int(page.get("PHYSICAL_IMG_NR")) == page_num:
+                return copy.deepcopy(page)
+        raise Exception(f"Page {page_num} not found")
+
+    def iter_pages(self, page_nums: Optional[List[int]] = None) -> Iterator[ET._Element]:
+        """Iterate over `Page` elements, optionally restricted to given physical page numbers.
+
+        Pages may be released once the next one is requested: copy them to keep them around.
+        """
+        if self._xml_cache_key() in xml_cache:
+            pages = self.get_xml().getroot().iter(f"{ALTO}Page")
+            yield from self._filter_pages(pages, page_nums)
+        elif self.is_sharded:
+            yield from shards.iter_pages(self._shards_path, page_nums)
+        else:
+            with self.open_xml() as f:
+                yield from self._filter_pages(AltoReader(f).pages(), page_nums)
+
+    @staticmethod
+    def _filter_pages(pages: Iterator[ET._Element], page_nums: Optional[List[int]]):
+        for page in pages:
+            if page_nums is None or int(page.get("PHYSICAL_IMG_NR")) in page_nums:
+                yield page
+
+    def get_xml_styles(self) -> List[ET._Element]:
+        """Get the `TextStyle` elements of the XML."""
+        if self.is_sharded:
+            return shards.load_styles(self._shards_path)
+        if self._xml_cache_key() in xml_cache:
+            return list(self.get_xml().getroot().iter(f"{ALTO}TextStyle"))
+
+        with self.open_xml() as f:
+            reader = AltoReader(f)
+            next(reader.pages(), None)  # styles precede the pages.
+            return reader.styles
+
+    def get_tokens(self, level: str) -> TokenTable:
+        """Get the columnar table of PDF tokens for the requested level (f"{ALTO}String", f"{ALTO}TextLine", ..).
+
+        Tables are built from the XML on first use and memory-mapped afterwards.
+        """
+        if level not in tokens.LEVELS:
+            raise Exception(f"Unknown token level {level}")
+
+        xml_file = self._xml_file()
+        tokens_path = f"{self.meta_path}/tokens"
+        index_file = f"{tokens_path}/index.json"
+
+        if (
+            os.path.exists(index_file)
+            and os.path.getmtime(index_file) >= os.path.getmtime(xml_file)
+        ):
+            table = tokens.load_token_table(tokens_path, level)
+            if table is not None:
+                return table
+
+        if self._xml_cache_key() in xml_cache:
+            tables = tokens.build_token_tables_from_xml(self.get_xml().getroot())
+        else:  # avoid loading the whole document in memory.
+            with self.open_xml() as f:
+                reader = AltoReader(f)
+                tables = tokens.build_token_tables(reader.styles, reader.pages())
+        tokens.save_token_tables(tokens_path, tables)
+        for layer in self.layers:  # label vectors are aligned with the previous tables.
+            remove_token_labels(f"{self.meta_path}/annot_{layer.id}.json")
+        return tables[level]
+
+    def get_token_labels(
+        self, layer_id: str, level: str = f"{ALTO}String", mode: str = "full"
+    ) -> np.ndarray:
+        """Get the labels of the tokens of the requested level according to an annotation layer, in token order.
+
+        Label vectors are persisted next to the layer (see `AnnotationLayer.get_token_labels`),
+        so that the layer itself is only loaded when they have to be computed.
+        """
+        table = self.get_tokens(level)
+        labels = load_token_labels(f"{self.meta_path}/annot_{layer_id}.json", table, mode)
+        if labels is None:
+            labels = self.get_annotation_layer(layer_id).get_token_labels(table, mode)
+        return labels
 
     def get_pdf_annotations(self) -> AnnotationLayer:
         """Get PDF annotations as an annotation layer."""
-        xml_path = f"{self.meta_path}/article.xml"
         xml_annot_path = f"{self.meta_path}/article_annot.xml"
         if not os.path.exists(xml_annot_path):
-            self.__pdfalto(xml_path)
+            self.convert()
 
         with open(xml_annot_path, "r") as f:
             xml_annot = ET.parse(f)
@@ -281,38 +502,33 @@ class Paper(Base):
             k: self.get_annotation_layer(v.id) for k, v in req_layers_info.items()
         }
 
-        for child in self.get_xml().findall(f".//{target}"):
-            bbx = BBX.from_element(child)
-
-            ok = False
-            if only_for == []:
-                ok = True
-            else:
-                for p in only_for:
-                    if req_layers[p.name].get_label(bbx) in p.labels:
-                        ok = True
-                        break
-
-            if ok:
-                box = annotations.get(bbx, mode="full")
-                if box:
-                    layer.add_box(
-                        LabelledBBX.from_bbx(bbx, box.label, box.group, box.user_data)
-                    )
+        table = self.get_tokens(target)
+        ok = np.full(len(table), only_for == [])
+        for p in only_for:
+            ok |= np.isin(req_layers[p.name].get_labels(table), p.labels)
+
+        bbxs = table.bbxs()
+        boxes = annotations.get_many(table, mode="full")
+        for i in np.flatnonzero(ok):
+            box = boxes[i]
+            if box:
+                layer.add_box(
+                    LabelledBBX.from_bbx(bbxs[i], box.label, box.group, box.user_data)
+                )
 
         return layer
 
     def extract_raw_text(self, annotations: AnnotationLayer, target: str) -> str:
         """Get textual content of annotation layer."""
         result = []
+        table = self.get_tokens(target)
 
-        for child in self.get_xml().findall(f".//{target}"):
-            bbx = BBX.from_element(child)
-            if annotations.get_label(bbx, mode="full") != "O":
-                result.append(child.get("CONTENT"))
-
-            if bbx.page_num > max(annotations._dbs.keys(), default=0):
-                break
+        # stop at the first token after the last annotated page.
+        after = table["page_num"] > max(annotations._dbs.keys(), default=0)
+        n = np.argmax(after) + 1 if after.any() else len(table)
+        labels = annotations.get_labels(table.rows[:n], mode="full")
+        for i in np.flatnonzero(labels != "O"):
+            result.append(table.content(i))
 
         return " ".join(result)
 
@@ -344,18 +560,65 @@ class Paper(Base):
             "title": self.title or "",
         }
 
+    def _features_path(self) -> str:
+        return f"{self.meta_path}/features"
+
+    def _load_features_index(self) -> Optional[dict]:
+        """Index of the persisted raw features, migrating them from the previous format if needed."""
+        index = features.load_features_index(self._features_path())
+        if index is None and features.migrate_features(self.meta_path):
+            index = features.load_features_index(self._features_path())
+        return index
+
+    def _compute_features(self, levels: List[str]) -> Dict[str, pd.DataFrame]:
+        features_dict = None
+        if config.FEATURE_BACKEND == "vectorized":  # None if the document structure is not supported.
+            features_dict = features.build_features_dict_from_tables(
+                self.get_xml_styles(), {l: self.get_tokens(l) for l in tokens.LEVELS}, levels
+            )
+
+        if features_dict is None:
+            if self._xml_cache_key() in xml_cache:
+                features_dict = features.build_features_dict(self.get_xml().getroot(), levels)
+            else:  # avoid loading the whole document in memory.
+                features_dict = features.build_features_dict_streaming(self.open_xml, levels)
+        return features_dict
+
+    def features_stamp(self) -> Optional[Tuple[int, int]]:
+        """Modification time and size of the index of the persisted raw features, which change whenever
+        they are updated, or None if they are missing. Features are not computed."""
+        try:
+            stat = os.stat(f"{self._features_path()}/index.json")
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def stale_feature_levels(self) -> List[str]:
+        """Levels whose persisted raw features are missing or were computed by another version of their extractor."""
+        return features.stale_levels(self._load_features_index())
+
+    def _update_features(self, force=False) -> dict:
+        """Compute the raw features of the stale levels (all levels with `force`) and persist them
+        in the feature store (see `lib.paper.feature_store`). Returns the store index.
+        """
+        index = None if force or config.REBUILD_FEATURES else self._load_features_index()
+        levels = features.stale_levels(index)
+        if len(levels) == 0:
+            return index
+        return features.save_features_dict(self._features_path(), self._compute_features(levels), index)
+
     def _build_features(self, force=False) -> Dict[str, pd.DataFrame]:
-        """Generate hierarchical features for PDF."""
-        df_path = f"{self.meta_path}/features.pkl"
+        """Generate hierarchical features for PDF. Only stale levels are recomputed, see `_update_features`."""
+        return features.load_features_dict(self._features_path(), self._update_features(force))
 
-        if not force and os.path.exists(df_path) and not config.REBUILD_FEATURES:
-            with open(df_path, "rb") as f:
-                return pickle.load(f)
-        else:
-            features_dict = features.build_features_dict(self.get_xml().getroot())
-            with open(df_path, "wb") as f:
-                pickle.dump(features_dict, f)
-            return features_dict
+    def migrate_features(self) -> bool:
+        """Move raw features stored in the previous format (`features.pkl`) to the feature store."""
+        return features.migrate_features(self.meta_path)
+
+    def get_raw_features(self, level: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Get the raw features of a level (f"{ALTO}String", ..). Only `columns` are read from disk when given."""
+        self._update_features()
+        return features.load_raw_features(self._features_path(), level, columns)
 
     def render(self, max_height: int = None, max_width: int = None):
         """Render document as a list of numpy arrays.
@@ -394,13 +657,33 @@ class Paper(Base):
         leaf_node: str,
         standardize: bool = True,
         add_context: bool = True,
+        columns: Optional[List[str]] = None,
     ) -> pd.DataFrame:
         """Get a stream of features for the requested tokenization. Tokenization is usually 
         f"{ALTO}TextLine" or f"{ALTO}String" with ALTO imported from misc.namespaces 
+
+        The result is cached for each set of parameters, until raw features are rebuilt.
+        Only `columns` are read from the cache when given.
         """
-        return features.get_features(
-            self._build_features(), leaf_node, standardize, add_context
+        index = self._update_features()
+        if not config.REBUILD_FEATURES:
+            result = features.load_features_frame(
+                self._features_path(), index, leaf_node, standardize, add_context, columns
+            )
+            if result is not None:
+                return result
+
+        result = features.get_features(
+            features.load_features_dict(self._features_path(), index),
+            leaf_node,
+            standardize,
+            add_context,
         )
+        if not config.REBUILD_FEATURES:
+            features.save_features_frame(
+                self._features_path(), index, leaf_node, standardize, add_context, result
+            )
+        return result if columns is None else result[columns]
 
     def get_box_validator(self, class_: AnnotationClass):
         """Returns a predicate function that tells if a box is in the chosen annotation class. """
@@ -0,0 +1,207 @@
+"""## Feature aggregation
+
+Aggregation of the features of child nodes by parent node (words of each line, lines of each block, ..),
+used by `lib.paper.features.get_features` when the requested tokens are coarser than words.
+
+For each parent, the result holds:
+- `<column>_min`, `_max`, `_std` and `_mean` of the numeric and boolean columns (0 when undefined),
+- the count of each value of the other columns, as a dictionary,
+- the columns of the first, second and last child, with suffixes `.first`, `.second` and `.last`.
+
+Children are sorted by parent once, and all statistics are computed over the resulting segments with array
+operations. Values are counted through a sparse (parent, value) count matrix. The result is the same as
+`groupby(key)` aggregations with pandas (`agg(["min", "max", "std", "mean"])`, `Counter`, `nth`), including
+the summation order of means and standard deviations; columns whose values can't be counted (such as the
+dictionaries of a previous aggregation) are dropped, as pandas does.
+"""
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+
+
+class _Segments:
+    """Rows of a frame grouped by key: rows sorted by key (stable), start and size of each group."""
+
+    def __init__(self, keys: pd.Series):
+        valid = np.flatnonzero(keys.notna().to_numpy())  # rows without a key are not aggregated.
+        values = keys.to_numpy()[valid]
+        order = np.argsort(values, kind="stable")
+        self.rows = valid[order]
+
+        sorted_values = values[order]
+        n = len(sorted_values)
+        boundaries = np.ones(n, dtype=bool)
+        boundaries[1:] = sorted_values[1:] != sorted_values[:-1]
+        self.starts = np.flatnonzero(boundaries)
+        self.sizes = np.diff(np.append(self.starts, n))
+        self.keys = sorted_values[self.starts]
+
+        # groups by decreasing size, so that the groups with more than k rows are a prefix.
+        self._by_size = np.argsort(-self.sizes, kind="stable")
+        self._sorted_sizes = self.sizes[self._by_size]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def positions(self):
+        """For each k, the groups having a k-th row and the (sorted) position of that row."""
+        for k in range(int(self.sizes.max()) if len(self) > 0 else 0):
+            groups = self._by_size[: np.searchsorted(-self._sorted_sizes, -k, side="left")]
+            yield groups, self.starts[groups] + k
+
+    def reduce(self, ufunc: np.ufunc, values: np.ndarray) -> np.ndarray:
+        if len(self) == 0:
+            return values[:0]
+        return ufunc.reduceat(values, self.starts, axis=0)
+
+
+def _frame(names: List[str], columns: List[np.ndarray], index: pd.Index) -> pd.DataFrame:
+    """Frame from a list of columns, whose names may be repeated."""
+    frame = pd.DataFrame(dict(enumerate(columns)), index=index)
+    frame.columns = pd.Index(names, dtype=object)
+    return frame
+
+
+def _mean_std(segments: _Segments, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Means (compensated summation) and standard deviations (Welford's algorithm) skipping NaNs,
+    computed row by row within each group, like pandas' `group_mean` and `group_var`."""
+    shape = (len(segments), values.shape[1])
+    nobs = np.zeros(shape)
+    sumx, compensation = np.zeros(shape), np.zeros(shape)
+    mean, m2 = np.zeros(shape), np.zeros(shape)
+
+    for groups, positions in segments.positions():
+        val = values[positions]
+        valid = ~np.isnan(val)
+        val = np.where(valid, val, 0)
+
+        count = nobs[groups] + valid
+        nobs[groups] = count
+        safe_count = np.where(valid, count, 1)
+
+        y = val - compensation[groups]
+        t = sumx[groups] + y
+        compensation[groups] = np.where(valid, t - sumx[groups] - y, compensation[groups])
+        sumx[groups] = np.where(valid, t, sumx[groups])
+
+        old_mean = mean[groups]
+        new_mean = old_mean + (val - old_mean) / safe_count
+        mean[groups] = np.where(valid, new_mean, old_mean)
+        m2[groups] = np.where(valid, m2[groups] + (val - new_mean) * (val - old_mean), m2[groups])
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(nobs > 0, sumx / nobs, np.nan)
+        stds = np.sqrt(np.where(nobs > 1, m2 / (nobs - 1), np.nan))
+    return means, stds
+
+
+def _numeric_statistics(frame: pd.DataFrame, segments: _Segments, index: pd.Index) -> pd.DataFrame:
+    columns = list(frame.columns)
+    if len(columns) == 0:
+        return pd.DataFrame(index=index)
+
+    sorted_frame = frame.iloc[segments.rows]
+    means, stds = _mean_std(segments, sorted_frame.to_numpy(dtype=np.float64))
+
+    names, result = [], []
+    for j, column in enumerate(columns):
+        values = sorted_frame.iloc[:, j].to_numpy()
+        if values.dtype.kind == "f":  # NaNs are skipped.
+            minimum, maximum = segments.reduce(np.fmin, values), segments.reduce(np.fmax, values)
+        else:
+            minimum, maximum = segments.reduce(np.minimum, values), segments.reduce(np.maximum, values)
+        names += [f"{column}_min", f"{column}_max", f"{column}_std", f"{column}_mean"]
+        result += [minimum, maximum, stds[:, j], means[:, j]]
+    return _frame(names, result, index).fillna(0)
+
+
+def _count_matrix(segments: _Segments, values: pd.Series) -> Tuple[np.ndarray, np.ndarray, np.ndarray, list]:
+    """Sparse (group, value) count matrix, as coordinates sorted by group then first occurrence of the value.
+
+    Raises `TypeError` when values can't be counted.
+    """
+    sorted_values = values.iloc[segments.rows]
+    codes, uniques = pd.factorize(sorted_values)
+    uniques = list(uniques)
+
+    missing = np.flatnonzero(codes < 0)
+    if len(missing) > 0:  # missing values (None, NaN) are told apart like dictionary keys.
+        missing_codes: Dict[object, int] = {}
+        for position, value in zip(missing.tolist(), sorted_values.iloc[missing].to_numpy(dtype=object)):
+            codes[position] = len(uniques) + missing_codes.setdefault(value, len(missing_codes))
+        uniques += list(missing_codes)
+
+    groups = np.repeat(np.arange(len(segments)), segments.sizes)
+    cells, first, counts = np.unique(
+        groups * len(uniques) + codes, return_index=True, return_counts=True
+    )
+    cell_groups, cell_values = cells // len(uniques), cells % len(uniques)
+    order = np.lexsort((first, cell_groups))
+    return cell_groups[order], cell_values[order], counts[order], uniques
+
+
+def _value_counts(frame: pd.DataFrame, segments: _Segments, index: pd.Index) -> pd.DataFrame:
+    names, result = [], []
+    for j, column in enumerate(frame.columns):
+        try:
+            cell_groups, cell_values, counts, uniques = _count_matrix(segments, frame.iloc[:, j])
+        except TypeError:  # unhashable values.
+            continue
+
+        bounds = np.searchsorted(cell_groups, np.arange(len(segments) + 1))
+        keys = [uniques[v] for v in cell_values.tolist()]
+        counts = counts.tolist()
+        dicts = np.empty(len(segments), dtype=object)
+        dicts[:] = [
+            dict(zip(keys[start:end], counts[start:end]))
+            for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())
+        ]
+        names.append(column)
+        result.append(dicts)
+    return _frame(names, result, index)
+
+
+def _nth(frame: pd.DataFrame, segments: _Segments, index: pd.Index, n: int) -> pd.DataFrame:
+    """Row `n` of each group (counted from the end when negative), missing values for smaller groups."""
+    has_row = segments.sizes > (n if n >= 0 else -n - 1)
+    offsets = n if n >= 0 else segments.sizes + n
+    rows = segments.rows[(segments.starts + offsets)[has_row]]
+
+    result = frame.iloc[rows]
+    if not frame.columns.is_unique:  # pandas groups columns having the same name.
+        first_position = {}
+        for j, column in enumerate(frame.columns):
+            first_position.setdefault(column, j)
+        result = result.iloc[
+            :, sorted(range(len(frame.columns)), key=lambda j: (first_position[frame.columns[j]], j))
+        ]
+    result.index = index[has_row]
+    if not np.all(has_row):
+        result = result.reindex(index)
+    return result
+
+
+def aggregate(frame: pd.DataFrame, key: str) -> pd.DataFrame:
+    """Aggregate rows of `frame` by the value of the `key` column (see module documentation).
+
+    The result is indexed by key, in increasing order.
+    """
+    segments = _Segments(frame[key])
+    index = pd.Index(segments.keys, name=key)
+    values = frame.drop(columns=key)
+
+    numerics = _numeric_statistics(
+        values.select_dtypes(include=["bool", "number"]), segments, index
+    )
+    counts = _value_counts(values.select_dtypes(exclude=["bool", "number"]), segments, index)
+
+    return pd.concat(
+        [
+            numerics,
+            counts,
+            _nth(values, segments, index, 0).add_suffix(".first"),
+            _nth(values, segments, index, 1).add_suffix(".second"),
+            _nth(values, segments, index, -1).add_suffix(".last"),
+        ],
+        axis=1,
+    )
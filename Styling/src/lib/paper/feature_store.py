@@ -0,0 +1,197 @@
+"""## Feature store
+
+Columnar storage of feature frames, one directory per frame (see `lib.paper.features.save_features_dict`).
+Frames are written as a Feather file when `pyarrow` is installed, otherwise as one NumPy `.npy` file per
+column. Both are read through memory maps and support column projection: reading a few columns of a
+frame doesn't read the others from disk.
+
+Columns that neither format stores natively (dictionaries of aggregated features, extension dtypes, ..)
+are pickled, in which case the frame is stored with NumPy.
+
+Example:
+```
+feature_store.write_frame(directory, frame, meta={"built": 0})
+feature_store.read_frame(directory, columns=["word", "italic"])
+feature_store.read_meta(directory)   # -> {"built": 0}, or None if there is no complete frame
+```
+"""
+import os, json, pickle, shutil
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+STORE_VERSION = 1
+
+FORMAT_FEATHER = "feather"
+FORMAT_NUMPY = "numpy"
+
+
+def _column_kind(series: pd.Series) -> str:
+    """How a column is stored: `array` (NumPy dtype), `category`, `str` or `pickle`."""
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        if all(isinstance(category, str) for category in dtype.categories):
+            return "category"
+    elif isinstance(dtype, np.dtype) and dtype.kind in "biufcmM":
+        return "array"
+    elif dtype == object:
+        # trailing null characters are dropped by NumPy strings.
+        if all(type(value) is str and not value.endswith("\0") for value in series.tolist()):
+            return "str"
+    return "pickle"
+
+
+def _has_default_index(frame: pd.DataFrame) -> bool:
+    index = frame.index
+    return isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1
+
+
+def _write_numpy(directory: str, frame: pd.DataFrame, kinds: List[str]) -> List[dict]:
+    columns = []
+    for i, (name, kind) in enumerate(zip(frame.columns, kinds)):
+        series = frame[name]
+        column = {"name": name, "kind": kind, "file": f"{i}.npy"}
+        if kind == "array":
+            np.save(f"{directory}/{i}.npy", series.to_numpy())
+        elif kind == "category":
+            np.save(f"{directory}/{i}.npy", series.cat.codes.to_numpy())
+            column["categories"] = list(series.cat.categories)
+            column["ordered"] = bool(series.cat.ordered)
+        elif kind == "str":
+            np.save(f"{directory}/{i}.npy", np.array(series.tolist(), dtype=str))
+        else:
+            column["file"] = f"{i}.pkl"
+            with open(f"{directory}/{i}.pkl", "wb") as f:
+                pickle.dump(series.array, f)
+        columns.append(column)
+
+    if not _has_default_index(frame):
+        with open(f"{directory}/index.pkl", "wb") as f:
+            pickle.dump(frame.index, f)
+    return columns
+
+
+def _read_numpy_column(directory: str, column: dict):
+    path = f"{directory}/{column['file']}"
+    kind = column["kind"]
+    if kind == "pickle":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    values = np.load(path, mmap_mode="r")
+    if kind == "category":
+        return pd.Categorical.from_codes(
+            values, categories=column["categories"], ordered=column["ordered"]
+        )
+    elif kind == "str":
+        return values.astype(object)
+    else:
+        return values
+
+
+def write_frame(directory: str, frame: pd.DataFrame, meta: Dict = {}):
+    """Store frame in given directory, replacing its content. `meta` is saved along with it (see `read_meta`)."""
+    if not all(isinstance(name, str) for name in frame.columns) or not frame.columns.is_unique:
+        raise Exception("Stored frames must have unique string column names.")
+
+    kinds = [_column_kind(frame[name]) for name in frame.columns]
+    use_feather = (
+        feather is not None
+        and _has_default_index(frame)
+        and all(kind != "pickle" for kind in kinds)
+        and not any(frame[name].dtype.kind == "c" for name in frame.columns)
+    )
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    if use_feather:
+        # uncompressed, so that the file can be memory-mapped.
+        feather.write_feather(frame, f"{directory}/frame.feather", compression="uncompressed")
+        columns = [{"name": name, "kind": kind} for name, kind in zip(frame.columns, kinds)]
+    else:
+        columns = _write_numpy(directory, frame, kinds)
+
+    # written last: marks the frame as complete.
+    with open(f"{directory}/meta.json", "w") as f:
+        json.dump(
+            {
+                "version": STORE_VERSION,
+                "format": FORMAT_FEATHER if use_feather else FORMAT_NUMPY,
+                "n_rows": len(frame),
+                "columns": columns,
+                "meta": meta,
+            },
+            f,
+        )
+
+
+def _read_store_meta(directory: str) -> Optional[dict]:
+    try:
+        with open(f"{directory}/meta.json", "r") as f:
+            store_meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if store_meta.get("version") != STORE_VERSION:
+        return None
+    if store_meta["format"] == FORMAT_FEATHER and feather is None:
+        return None  # written by an environment with pyarrow.
+    return store_meta
+
+
+def read_meta(directory: str) -> Optional[Dict]:
+    """Metadata given to `write_frame`, or None if there is no complete frame in given directory."""
+    store_meta = _read_store_meta(directory)
+    return store_meta["meta"] if store_meta is not None else None
+
+
+def read_columns(directory: str) -> Optional[List[str]]:
+    """Columns of the frame stored in given directory, or None if there is no complete frame."""
+    store_meta = _read_store_meta(directory)
+    return [c["name"] for c in store_meta["columns"]] if store_meta is not None else None
+
+
+def read_frame(directory: str, columns: Optional[Sequence[str]] = None) -> Optional[pd.DataFrame]:
+    """Read the frame stored in given directory, or None if there is no complete frame.
+
+    Only `columns` are read, in this order, when given.
+    """
+    store_meta = _read_store_meta(directory)
+    if store_meta is None:
+        return None
+
+    by_name = {column["name"]: column for column in store_meta["columns"]}
+    names = list(by_name) if columns is None else list(columns)
+    for name in names:
+        if name not in by_name:
+            raise KeyError(name)
+
+    if store_meta["format"] == FORMAT_FEATHER:
+        table = feather.read_table(f"{directory}/frame.feather", columns=names, memory_map=True)
+        result = table.to_pandas()
+        if len(names) == 0:
+            result = pd.DataFrame(index=pd.RangeIndex(store_meta["n_rows"]))
+        result.columns = pd.Index(names, dtype=object)
+        return result
+
+    if os.path.exists(f"{directory}/index.pkl"):
+        with open(f"{directory}/index.pkl", "rb") as f:
+            index = pickle.load(f)
+    else:
+        index = pd.RangeIndex(store_meta["n_rows"])
+
+    if len(names) == 0:
+        return pd.DataFrame(index=index, columns=pd.Index([], dtype=object))
+    return pd.DataFrame(
+        {name: _read_numpy_column(directory, by_name[name]) for name in names}, index=index
+    )
+
+
+def remove(directory: str):
+    """Remove the frame stored in given directory."""
+    shutil.rmtree(directory, ignore_errors=True)
@@ -1,15 +1,34 @@
 from __future__ import annotations
 
+import os, json, pickle, time
 import pandas as pd
 from lxml import etree as ET
-from typing import Dict, Optional
-from collections import Counter
+from typing import IO, Callable, Dict, Iterable, List, Optional, Sequence
 from sklearn import preprocessing
 
-from ..features import get_feature_extractors
+from ..features import (
+    FEATURE_EXTRACTORS,
+    FeatureExtractor,
+    get_feature_extractors,
+    get_fingerprints,
+    vectorized,
+    _source_digest,
+)
 from ..misc.namespaces import *
-from ..misc import remove_prefix
-from . import features
+from ..misc import remove_prefix, codec
+from ..misc.alto import AltoReader
+from . import feature_store, aggregation
+from .tokens import TokenTable
+
+FEATURES_VERSION = 1
+"""Version of `get_features`. Bump when its output changes without a change of its source code."""
+
+
+def features_fingerprint() -> str:
+    """Identifies the computation of feature frames from raw features: `FEATURES_VERSION` and a hash of the
+    source code of this module (standardization, context) and of `lib.paper.aggregation`."""
+    return f"{FEATURES_VERSION}-{_source_digest(__name__)}-{_source_digest(aggregation.__name__)}"
+
 
 ALTO_HIERARCHY = [
     f"{ALTO}Page",
@@ -40,44 +59,94 @@ def _standardize(features: pd.DataFrame) -> pd.DataFrame:
     return pd.concat([boolean_df, normalized_df, other_df], axis=1)
 
 
-def build_features_dict(xml: ET.ElementTree) -> Dict[str, pd.DataFrame]:
-    feature_extractors = get_feature_extractors(xml)
+def build_features_dict(
+    xml: ET.ElementTree, levels: Optional[Sequence[str]] = None
+) -> Dict[str, pd.DataFrame]:
+    """Compute raw features of each node of a parsed document, for all levels or the given `levels`."""
+    return _collect_features(get_feature_extractors(xml, levels), [xml])
+
+
+def build_features_dict_streaming(
+    open_xml: Callable[[], IO[bytes]], levels: Optional[Sequence[str]] = None
+) -> Dict[str, pd.DataFrame]:
+    """Compute raw features of each node, reading the document one page at a time.
+
+    The document is read twice: a first pass collects document-wide information
+    (fonts, repeated patterns, ..), the second one computes features.
+    """
+    feature_extractors = get_feature_extractors(levels=levels)
+
+    with open_xml() as f:
+        reader = AltoReader(f)
+        for i, page in enumerate(reader.pages()):
+            for extractor in feature_extractors.values():
+                if i == 0:
+                    extractor.add_styles(reader.styles)
+                extractor.add_page(page)
+
+    with open_xml() as f:
+        return _collect_features(feature_extractors, AltoReader(f).pages())
+
+
+def build_features_dict_from_tables(
+    styles: Sequence[ET.Element],
+    tables: Dict[str, TokenTable],
+    levels: Optional[Sequence[str]] = None,
+) -> Optional[Dict[str, pd.DataFrame]]:
+    """Compute raw features of each node from the token tables (see `lib.features.vectorized`).
 
+    The result is the same as `build_features_dict`, or None if the document structure is not supported.
+    """
+    features_dict = vectorized.build_features_dict(styles, tables, levels)
+    if features_dict is not None:
+        _categorize(features_dict)
+    return features_dict
+
+
+def _collect_features(
+    feature_extractors: Dict[str, FeatureExtractor], nodes: Iterable[ET.Element]
+) -> Dict[str, pd.DataFrame]:
     features_by_node = {k: [] for k in feature_extractors.keys()}
-    indices = {k: 0 for k in feature_extractors.keys()}
+    # all levels are tracked, so that parent indices are the same when only some levels are computed.
+    indices = {k: 0 for k in FEATURE_EXTRACTORS.keys()}
 
     ancestors = []
 
     def dfs(node: ET.Element):
         nonlocal ancestors, indices
-        if node.tag in features_by_node:
+        if node.tag in indices:
             ancestors.append(node.tag)
             indices[node.tag] += 1
 
-            features_by_node[node.tag].append(feature_extractors[node.tag].get(node))
-            if len(ancestors) > 1:
-                features_by_node[node.tag][-1][ancestors[-2]] = (
-                    indices[ancestors[-2]] - 1
-                )
+            if node.tag in features_by_node:
+                features_by_node[node.tag].append(feature_extractors[node.tag].get(node))
+                if len(ancestors) > 1:
+                    features_by_node[node.tag][-1][ancestors[-2]] = (
+                        indices[ancestors[-2]] - 1
+                    )
 
         for children in node:
             dfs(children)
 
-        if node.tag in features_by_node:
+        if node.tag in indices:
             ancestors.pop()
 
-    dfs(xml)
+    for node in nodes:
+        dfs(node)
 
     features_dict = {k: pd.DataFrame.from_dict(v) for k, v in features_by_node.items()}
+    _categorize(features_dict)
+    return features_dict
 
+
+def _categorize(features_dict: Dict[str, pd.DataFrame]):
+    """Turn positional features (`#` prefix) into categorical columns."""
     for features in features_dict.values():
         for column in features.columns:
             if column.startswith("#"):
                 features[column[1:]] = features[column].astype("category")
                 features.drop(column, axis=1, inplace=True)
 
-    return features_dict
-
 
 def get_features(
     features_dict: Dict[str, pd.DataFrame],
@@ -107,47 +176,7 @@ def get_features(
                 result_df = features_dict[node].add_prefix(prefix)
             else:
                 if index >= leaf_index:
-
-                    result_df_numerics = (
-                        result_df.select_dtypes(include=["bool", "number"])
-                        .groupby(by=old_prefix + node)
-                        .agg(["min", "max", "std", "mean"])
-                        .fillna(0)
-                    )
-                    result_df_numerics.columns = result_df_numerics.columns.map(
-                        "_".join
-                    )
-
-                    df_non_numeric = pd.concat(
-                        [
-                            result_df.select_dtypes(exclude=["bool", "number"]),
-                            result_df[old_prefix + node],
-                        ],
-                        axis=1,
-                    ).groupby(by=old_prefix + node)
-                    result_df_words = df_non_numeric.agg(lambda x: dict(Counter(x)))
-
-                    df_groupby = result_df.groupby(by=old_prefix + node)
-
-                    result_df_first_word = df_groupby.nth(0)
-                    result_df_first_word = result_df_first_word.add_suffix(".first")
-
-                    result_df_second_word = df_groupby.nth(1)
-                    result_df_second_word = result_df_second_word.add_suffix(".second")
-
-                    result_df_last_word = df_groupby.nth(-1)
-                    result_df_last_word = result_df_last_word.add_suffix(".last")
-
-                    result_df = pd.concat(
-                        [
-                            result_df_numerics,
-                            result_df_words,
-                            result_df_first_word,
-                            result_df_second_word,
-                            result_df_last_word,
-                        ],
-                        axis=1,
-                    )
+                    result_df = aggregation.aggregate(result_df, old_prefix + node)
 
                 prefix = remove_prefix(node) + "."
                 target = features_dict[node].add_prefix(prefix)
@@ -176,3 +205,131 @@ def get_features(
         return std
     else:
         return result_df
+
+
+def save_features_dict(
+    directory: str,
+    features_dict: Dict[str, pd.DataFrame],
+    index: Optional[dict] = None,
+) -> dict:
+    """Persist raw features in the feature store (see `lib.paper.feature_store`), with the fingerprints of their extractors.
+
+    Levels of the previous store `index` that are not in `features_dict` are kept. Returns the new index.
+    """
+    os.makedirs(directory, exist_ok=True)
+    index_file = f"{directory}/index.json"
+    if os.path.exists(index_file):
+        os.remove(index_file)
+
+    fingerprints = get_fingerprints()
+    for level, frame in features_dict.items():
+        feature_store.write_frame(
+            f"{directory}/raw.{remove_prefix(level)}", frame, meta={"fingerprint": fingerprints[level]}
+        )
+
+    previous = index if index is not None else {"levels": [], "fingerprints": {}}
+    # written last: marks the raw features as complete. Feature frames computed from previous
+    # raw features are recognized by their build time.
+    index = {
+        "levels": previous["levels"] + [l for l in features_dict if l not in previous["levels"]],
+        "fingerprints": {
+            **previous["fingerprints"],
+            **{level: fingerprints[level] for level in features_dict},
+        },
+        "built": time.time_ns(),
+    }
+    with open(index_file, "w") as f:
+        json.dump(index, f)
+    return index
+
+
+def stale_levels(index: Optional[dict]) -> List[str]:
+    """Levels whose raw features are missing from the store `index` or were computed by another version of their extractor."""
+    fingerprints = get_fingerprints()
+    if index is None:
+        return list(fingerprints)
+    return [level for level in fingerprints if index["fingerprints"].get(level) != fingerprints[level]]
+
+
+def load_features_index(directory: str) -> Optional[dict]:
+    """Index of the raw features persisted with `save_features_dict`, or None if they are missing or incomplete."""
+    try:
+        with open(f"{directory}/index.json", "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return index if "fingerprints" in index else None
+
+
+def load_raw_features(
+    directory: str, level: str, columns: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    """Raw features of given level, reading only `columns` when given."""
+    frame = feature_store.read_frame(f"{directory}/raw.{remove_prefix(level)}", columns)
+    if frame is None:
+        raise Exception(f"Missing raw features for {level}.")
+    return frame
+
+
+def load_features_dict(directory: str, index: dict) -> Dict[str, pd.DataFrame]:
+    """Raw features of each level, as returned by `build_features_dict`."""
+    return {level: load_raw_features(directory, level) for level in index["levels"]}
+
+
+def _frame_directory(directory: str, leaf_node: str, standardize: bool, add_context: bool) -> str:
+    return f"{directory}/{remove_prefix(leaf_node)}.{int(standardize)}{int(add_context)}"
+
+
+def load_features_frame(
+    directory: str,
+    index: dict,
+    leaf_node: str,
+    standardize: bool,
+    add_context: bool,
+    columns: Optional[Sequence[str]] = None,
+) -> Optional[pd.DataFrame]:
+    """Get cached output of `get_features`, or None if missing, computed from other raw features or by another version."""
+    frame_directory = _frame_directory(directory, leaf_node, standardize, add_context)
+    meta = feature_store.read_meta(frame_directory)
+    if (
+        meta is None
+        or meta.get("fingerprint") != features_fingerprint()
+        or meta.get("built") != index["built"]
+    ):
+        return None
+    return feature_store.read_frame(frame_directory, columns)
+
+
+def save_features_frame(
+    directory: str,
+    index: dict,
+    leaf_node: str,
+    standardize: bool,
+    add_context: bool,
+    features: pd.DataFrame,
+):
+    """Cache the output of `get_features`, computed from the raw features of given store index."""
+    feature_store.write_frame(
+        _frame_directory(directory, leaf_node, standardize, add_context),
+        features,
+        meta={"fingerprint": features_fingerprint(), "built": index["built"]},
+    )
+
+
+def migrate_features(meta_path: str) -> bool:
+    """Move the raw features of a paper from the previous format (`features.pkl`) to the feature store.
+    Their extractors are unknown: migrating asserts that they are the current ones, so that the features are
+    not computed again. `cli.py features` recomputes them otherwise.
+
+    Returns whether there was something to migrate.
+    """
+    legacy_path = f"{meta_path}/features.pkl"
+    legacy_file = codec.find(legacy_path)
+    if legacy_file is None:
+        return False
+
+    with codec.open_read(legacy_file) as f:
+        features_dict = pickle.load(f)
+    save_features_dict(f"{meta_path}/features", features_dict)
+    codec.remove(legacy_path)
+    return True
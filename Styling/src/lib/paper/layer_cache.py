@@ -0,0 +1,97 @@
+"""## Annotation layer cache
+
+Process-wide cache of loaded annotation layers, used by the REST server so that repeated requests on
+the same layer don't load it and rebuild its spatial index each time.
+
+Layers are accessed through `LayerCache.open`, which holds a per-layer lock: concurrent requests on the
+same layer are serialized, and modifications are saved (`AnnotationLayer.save_edits`) before the lock is
+released. Cached layers are checked against the modification time of their files, so that layers written
+by other processes (CLI, training workers, ..) are reloaded.
+
+Example:
+```
+with layer_cache.open(paper, layer_id, write=True) as layer:
+    layer.add_box(box)
+layer_cache.stats   # -> {"hits": .., "misses": .., ...}
+```
+"""
+from __future__ import annotations
+
+import threading, weakref
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, Optional, Tuple
+
+from ..annotations import AnnotationLayer, layer_stamp
+from ..misc.cache import LRUCache
+
+if TYPE_CHECKING:
+    from . import Paper
+
+LAYER_BOX_SIZE = 1000
+"""Estimated memory footprint of a loaded box (object, IDs and spatial index entry), in bytes."""
+
+
+def layer_size(layer: AnnotationLayer) -> int:
+    """Estimated memory footprint of a loaded layer, in bytes."""
+    return LAYER_BOX_SIZE * (len(layer.bbxs) + 1)
+
+
+class LayerCache:
+    """LRU cache of annotation layers by layer ID, bounded by their estimated memory footprint."""
+
+    def __init__(self, max_size: int):
+        self._cache = LRUCache(max_size, sizeof=lambda entry: layer_size(entry[0]))
+        # locks are dropped once no thread holds or waits for them.
+        self._locks: weakref.WeakValueDictionary[str, threading.RLock] = weakref.WeakValueDictionary()
+        self._locks_lock = threading.Lock()
+
+    def lock(self, layer_id: str) -> threading.RLock:
+        """Lock of given layer."""
+        with self._locks_lock:
+            lock = self._locks.get(layer_id)
+            if lock is None:
+                lock = self._locks[layer_id] = threading.RLock()
+            return lock
+
+    def _get(self, paper: Paper, layer_id: str) -> AnnotationLayer:
+        entry: Optional[Tuple[AnnotationLayer, Tuple]] = self._cache.get(layer_id)
+        if entry is not None and layer_stamp(entry[0].location) == entry[1]:
+            return entry[0]
+
+        layer = paper.get_annotation_layer(layer_id)
+        self._cache.put(layer_id, (layer, layer_stamp(layer.location)))
+        return layer
+
+    @contextmanager
+    def open(self, paper: Paper, layer_id: str, write: bool = False) -> Iterator[AnnotationLayer]:
+        """
+        Get layer, holding its lock. With `write`, modifications are saved when leaving the context;
+        if that fails the layer is dropped from the cache.
+        """
+        with self.lock(layer_id):
+            layer = self._get(paper, layer_id)
+            try:
+                yield layer
+                if write:
+                    layer.save_edits()
+            except BaseException:
+                if write:
+                    self._cache.invalidate(layer_id)
+                raise
+
+            if write:  # update stamp and size.
+                self._cache.put(layer_id, (layer, layer_stamp(layer.location)))
+
+    def invalidate(self, layer_id: str):
+        """Drop layer from the cache, for example when it is deleted."""
+        with self.lock(layer_id):
+            self._cache.invalidate(layer_id)
+
+    def clear(self):
+        """Drop all layers and reset counters."""
+        self._cache.clear()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Cache counters, see `lib.misc.cache.LRUCache.stats`."""
+        return self._cache.stats
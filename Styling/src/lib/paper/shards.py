@@ -0,0 +1,181 @@
+"""## Page-sharded XML storage
+
+pdfalto's output can be stored as one file per page instead of a single document, so that
+consumers that only need a few pages do not have to decompress and parse the whole document.
+
+A sharded document is a directory containing:
+- `document.xml`: the document without its pages (description, style table and a `Layout` placeholder),
+- `page_<n>.xml`: the `Page` element of physical page `n`,
+- `index.json`: page numbers in document order and the uncompressed size of each shard, written last.
+
+Each file is compressed with the configured codec (see `lib.misc.codec`).
+The full document is stitched back lazily: `open_document` returns a stream that decompresses
+shards one at a time when read, which can be consumed by `lib.misc.alto.AltoReader` or `lxml`.
+
+Example:
+```
+write_shards(open("article.xml", "rb"), f"{paper.meta_path}/pages", "bz2")
+load_page(f"{paper.meta_path}/pages", 2)          # Page element of the second page.
+ET.parse(open_document(f"{paper.meta_path}/pages"))  # full document.
+```
+"""
+from __future__ import annotations
+
+import os, io, json, shutil, copy
+from lxml import etree as ET
+from typing import IO, Iterator, List, Optional
+
+from ..misc import codec
+from ..misc.alto import AltoReader
+from ..misc.namespaces import *
+
+SHARDS_VERSION = 1
+"""Bump when the on-disk layout changes."""
+
+PAGES_MARKER = "pages"
+"""Comment standing for the pages in the serialized skeleton."""
+
+
+def index_file(directory: str) -> str:
+    """Location of the shard index, which marks the shards as complete."""
+    return f"{directory}/index.json"
+
+
+def is_sharded(directory: str) -> bool:
+    """If the directory contains a complete sharded document."""
+    return load_index(directory) is not None
+
+
+def load_index(directory: str) -> Optional[dict]:
+    """Get shard index, or None if there is no valid sharded document."""
+    try:
+        with open(index_file(directory), "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if index.get("version") != SHARDS_VERSION:
+        return None
+    return index
+
+
+def _skeleton(root: ET._Element) -> bytes:
+    """Serialize the document without its pages, keeping an empty `Layout`."""
+    skeleton = ET.Element(root.tag, root.attrib, nsmap=root.nsmap)
+    for child in root:
+        if child.tag == f"{ALTO}Layout":
+            layout = ET.SubElement(skeleton, child.tag, child.attrib)
+            layout.append(ET.Comment(PAGES_MARKER))
+        else:
+            skeleton.append(copy.deepcopy(child))
+    return ET.tostring(skeleton)
+
+
+def _split_skeleton(data: bytes):
+    """Split the serialized skeleton at the location of the pages."""
+    head, tail = data.split(f"<!--{PAGES_MARKER}-->".encode())
+    return head, tail
+
+
+def write_shards(source: IO[bytes], directory: str, compression: str):
+    """Split an ALTO document into page shards, reading it one page at a time."""
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+
+    pages: List[int] = []
+    sizes: List[int] = []
+    skeleton = None
+
+    reader = AltoReader(source)
+    for page in reader.pages():
+        if skeleton is None:
+            skeleton = _skeleton(page.getroottree().getroot())
+
+        n = int(page.get("PHYSICAL_IMG_NR"))
+        data = ET.tostring(page, with_tail=False)
+        with codec.write(f"{directory}/page_{n}.xml", compression) as f:
+            f.write(data)
+        pages.append(n)
+        sizes.append(len(data))
+
+    if skeleton is None:  # document without pages.
+        source.seek(0)
+        skeleton = _skeleton(ET.parse(source).getroot())
+
+    with codec.write(f"{directory}/document.xml", compression) as f:
+        f.write(skeleton)
+
+    # written last: marks the shards as complete.
+    with open(index_file(directory), "w") as f:
+        json.dump({"version": SHARDS_VERSION, "pages": pages, "sizes": sizes}, f)
+
+
+def _read_shard(directory: str, name: str) -> bytes:
+    path = codec.find(f"{directory}/{name}")
+    if path is None:
+        raise FileNotFoundError(f"{directory}/{name}")
+    return codec.read(path)
+
+
+def load_page(directory: str, page_num: int) -> ET._Element:
+    """Parse the `Page` element of given physical page number."""
+    parser = ET.XMLParser(huge_tree=True)
+    return ET.fromstring(_read_shard(directory, f"page_{page_num}.xml"), parser)
+
+
+def load_styles(directory: str) -> List[ET._Element]:
+    """Parse the `TextStyle` elements of the document."""
+    skeleton = ET.fromstring(_read_shard(directory, "document.xml"))
+    return list(skeleton.iter(f"{ALTO}TextStyle"))
+
+
+def iter_pages(directory: str, page_nums: Optional[List[int]] = None) -> Iterator[ET._Element]:
+    """Iterate over `Page` elements in document order, optionally restricted to given page numbers."""
+    index = load_index(directory)
+    for n in index["pages"]:
+        if page_nums is None or n in page_nums:
+            yield load_page(directory, n)
+
+
+def _document_chunks(directory: str) -> Iterator[bytes]:
+    head, tail = _split_skeleton(_read_shard(directory, "document.xml"))
+    yield head
+    for n in load_index(directory)["pages"]:
+        yield _read_shard(directory, f"page_{n}.xml")
+    yield tail
+
+
+class _ChunkStream(io.RawIOBase):
+    """Read-only stream over a sequence of byte chunks, produced on demand."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._current = b""
+        self._offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self._offset >= len(self._current):
+            self._current = next(self._chunks, None)
+            self._offset = 0
+            if self._current is None:
+                self._current = b""
+                return 0
+
+        n = min(len(buffer), len(self._current) - self._offset)
+        buffer[:n] = self._current[self._offset : self._offset + n]
+        self._offset += n
+        return n
+
+
+def open_document(directory: str) -> IO[bytes]:
+    """Open the full document as a stream, stitching shards as they are read."""
+    return io.BufferedReader(_ChunkStream(_document_chunks(directory)), 2 ** 20)
+
+
+def document_size(directory: str) -> int:
+    """Uncompressed size of the full document, approximately."""
+    return sum(load_index(directory)["sizes"])
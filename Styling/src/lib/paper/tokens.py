@@ -0,0 +1,270 @@
+"""## Token tables
+
+A columnar view of the ALTO hierarchy (`Page` > `TextBlock` > `TextLine` > `String`).
+For each level, nodes are stored in document order (the order of `root.findall(".//String")`)
+in a structured NumPy array holding their bounding box, style and parent indices.
+Textual content is stored in a single text buffer, indexed by offsets.
+
+Tables are built once from the XML and persisted in the paper metadata directory,
+then memory-mapped when loaded (see `lib.paper.Paper.get_tokens`).
+
+Example:
+```
+tokens = paper.get_tokens(f"{ALTO}String")
+tokens.coordinates()    # (n, 4) array of min_h, min_v, max_h, max_v
+tokens.content(0)       # text of the first word
+tokens.bbx(0)           # `lib.misc.bounding_box.BBX` of the first word
+```
+"""
+from __future__ import annotations
+
+import os, json
+import numpy as np
+from lxml import etree as ET
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from ..misc.bounding_box import BBX
+from ..misc.namespaces import *
+from ..misc import get_text
+
+LEVELS = [
+    f"{ALTO}Page",
+    f"{ALTO}TextBlock",
+    f"{ALTO}TextLine",
+    f"{ALTO}String",
+]
+"""Tokenization levels, from coarsest to finest."""
+
+TOKEN_DTYPE = np.dtype(
+    [
+        ("page_num", np.int32),
+        ("min_h", np.float64),
+        ("min_v", np.float64),
+        ("max_h", np.float64),
+        ("max_v", np.float64),
+        ("style", np.int32),
+        ("page", np.int32),
+        ("block", np.int32),
+        ("line", np.int32),
+        ("text_start", np.int64),
+        ("text_end", np.int64),
+    ]
+)
+"""Row layout: physical page number, box, style index, parent indices (-1 if none) and text offsets."""
+
+TOKENS_VERSION = 1
+"""Bump when the on-disk layout changes."""
+
+
+class TokenTable:
+    """Nodes of one level of the ALTO hierarchy, in document order."""
+
+    level: str
+    """Node tag."""
+    rows: np.ndarray
+    """Structured array of `TOKEN_DTYPE`."""
+    text: str
+    """Text buffer."""
+    styles: List[str]
+    """Style IDs, referenced by the `style` column."""
+
+    def __init__(self, level: str, rows: np.ndarray, text: str, styles: List[str]):
+        self.level = level
+        self.rows = rows
+        self.text = text
+        self.styles = styles
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.rows[column]
+
+    def content(self, i: int) -> str:
+        """Textual content of the i-th node."""
+        row = self.rows[i]
+        return self.text[row["text_start"] : row["text_end"]]
+
+    def contents(self) -> List[str]:
+        """Textual content of all nodes."""
+        starts, ends = self.rows["text_start"], self.rows["text_end"]
+        return [self.text[s:e] for s, e in zip(starts.tolist(), ends.tolist())]
+
+    def style(self, i: int) -> Optional[str]:
+        """Style ID of the i-th node."""
+        style = self.rows["style"][i]
+        return self.styles[style] if style >= 0 else None
+
+    def coordinates(self) -> np.ndarray:
+        """Bounding boxes as a (n, 4) array of min_h, min_v, max_h, max_v."""
+        return np.stack(
+            [self.rows["min_h"], self.rows["min_v"], self.rows["max_h"], self.rows["max_v"]],
+            axis=1,
+        )
+
+    def bbx(self, i: int) -> BBX:
+        """Bounding box of the i-th node."""
+        row = self.rows[i]
+        return BBX(
+            int(row["page_num"]),
+            float(row["min_h"]),
+            float(row["min_v"]),
+            float(row["max_h"]),
+            float(row["max_v"]),
+        )
+
+    def bbxs(self) -> List[BBX]:
+        """Bounding boxes of all nodes."""
+        columns = [
+            self.rows[c].tolist()
+            for c in ["page_num", "min_h", "min_v", "max_h", "max_v"]
+        ]
+        return [BBX(*x) for x in zip(*columns)]
+
+    def save(self, directory: str):
+        """Persist table in given directory.
+
+        Files are replaced rather than overwritten, so that tables memory-mapped by other readers stay valid.
+        """
+        name = _file_name(self.level)
+        with open(f"{directory}/{name}.npy.tmp", "wb") as f:
+            np.save(f, np.asarray(self.rows))
+        os.replace(f"{directory}/{name}.npy.tmp", f"{directory}/{name}.npy")
+        with open(f"{directory}/{name}.txt.tmp", "w", encoding="utf-8", newline="") as f:
+            f.write(self.text)
+        os.replace(f"{directory}/{name}.txt.tmp", f"{directory}/{name}.txt")
+
+    @staticmethod
+    def load(directory: str, level: str, styles: List[str]) -> TokenTable:
+        """Load table from given directory, memory-mapping the rows."""
+        name = _file_name(level)
+        rows = np.load(f"{directory}/{name}.npy", mmap_mode="r")
+        with open(f"{directory}/{name}.txt", "r", encoding="utf-8", newline="") as f:
+            text = f.read()
+        return TokenTable(level, rows, text, styles)
+
+
+def _file_name(level: str) -> str:
+    return level.split("}")[-1]
+
+
+def _node_text(node: ET._Element) -> str:
+    if node.tag == f"{ALTO}String":
+        return node.get("CONTENT")
+    else:
+        return get_text(node)
+
+
+def build_token_tables(
+    styles: Sequence[ET._Element], pages: Iterable[ET._Element]
+) -> Dict[str, TokenTable]:
+    """Build a table for each level from the `TextStyle` nodes and `Page` nodes of a document.
+
+    Pages are visited one at a time, so that they can be obtained from a streaming parser
+    (see `lib.misc.alto.AltoReader`). Styles are only read once the first page is obtained.
+    """
+    style_ids: Optional[List[str]] = None
+    style_index: Dict[str, int] = {}
+
+    rows: Dict[str, list] = {l: [] for l in LEVELS}
+    texts: Dict[str, list] = {l: [] for l in LEVELS}
+    offsets = {l: 0 for l in LEVELS}
+
+    page_idx = -1
+    for page in pages:
+        if style_ids is None:
+            style_ids = [s.get("ID") for s in styles]
+            style_index = {s: i for i, s in enumerate(style_ids)}
+
+        page_idx += 1
+        page_num = int(page.get("PHYSICAL_IMG_NR"))
+        block_idx, line_idx = -1, -1
+        block, line = None, None
+
+        for node in page.iter(*LEVELS):
+            tag = node.tag
+            if tag == f"{ALTO}Page":
+                min_h, min_v = 0.0, 0.0
+                max_h, max_v = float(node.get("WIDTH")), float(node.get("HEIGHT"))
+            else:
+                min_h, min_v = float(node.get("HPOS")), float(node.get("VPOS"))
+                max_h = min_h + float(node.get("WIDTH", default=0))
+                max_v = min_v + float(node.get("HEIGHT", default=0))
+
+            if tag == f"{ALTO}TextBlock":
+                block_idx, block = len(rows[tag]), node
+                line_idx = -1
+            elif tag == f"{ALTO}TextLine":
+                line_idx, line = len(rows[tag]), node
+
+            # nodes following a block (or line) without being part of it.
+            if tag in (f"{ALTO}TextLine", f"{ALTO}String") and block_idx >= 0:
+                if next(node.iterancestors(f"{ALTO}TextBlock"), None) is not block:
+                    block_idx = -1
+            if tag == f"{ALTO}String" and line_idx >= 0:
+                if next(node.iterancestors(f"{ALTO}TextLine"), None) is not line:
+                    line_idx = -1
+
+            text = _node_text(node)
+            start = offsets[tag]
+            offsets[tag] += len(text)
+            texts[tag].append(text)
+
+            rows[tag].append(
+                (
+                    page_num,
+                    min_h,
+                    min_v,
+                    max(min_h, max_h),
+                    max(min_v, max_v),
+                    style_index.get(node.get("STYLEREFS"), -1),
+                    page_idx,
+                    block_idx if tag != f"{ALTO}TextBlock" else -1,
+                    line_idx if tag == f"{ALTO}String" else -1,
+                    start,
+                    start + len(text),
+                )
+            )
+
+    if style_ids is None:
+        style_ids = [s.get("ID") for s in styles]
+
+    return {
+        l: TokenTable(l, np.array(rows[l], dtype=TOKEN_DTYPE), "".join(texts[l]), style_ids)
+        for l in LEVELS
+    }
+
+
+def build_token_tables_from_xml(root: ET._Element) -> Dict[str, TokenTable]:
+    """Build a table for each level from a parsed document."""
+    return build_token_tables(
+        list(root.iter(f"{ALTO}TextStyle")), root.iter(f"{ALTO}Page")
+    )
+
+
+def save_token_tables(directory: str, tables: Dict[str, TokenTable]):
+    """Persist tables in given directory."""
+    os.makedirs(directory, exist_ok=True)
+    # removed first: the previous tables are incomplete while they are replaced.
+    if os.path.exists(f"{directory}/index.json"):
+        os.remove(f"{directory}/index.json")
+
+    styles = next(iter(tables.values())).styles
+    for table in tables.values():
+        table.save(directory)
+    # written last: marks the tables as complete.
+    with open(f"{directory}/index.json", "w") as f:
+        json.dump({"version": TOKENS_VERSION, "styles": styles}, f)
+
+
+def load_token_table(directory: str, level: str) -> Optional[TokenTable]:
+    """Load table for given level, or None if there is no valid persisted table."""
+    try:
+        with open(f"{directory}/index.json", "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if index.get("version") != TOKENS_VERSION:
+        return None
+    return TokenTable.load(directory, level, index["styles"])
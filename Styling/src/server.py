@@ -8,7 +8,7 @@ from falcon import Request, Response
 from sqlalchemy.orm import Session
 
 from lib.extractors import Extractor, TrainableExtractor
-from lib.paper import AnnotationLayerTag, ParentModelNotFoundException
+from lib.paper import AnnotationLayerTag, ParentModelNotFoundException, layer_cache, xml_cache
 from lib.tkb import AnnotationClass, TheoremKB
 from lib.misc.bounding_box import LabelledBBX
 from lib.config import config
@@ -287,6 +287,7 @@ class PaperAnnotationLayerResource(object):
             paper.title = "__undef__"
 
         paper.remove_annotation_layer(session, layer_id)
+        layer_cache.invalidate(layer_id)
 
         resp.media = {"message": "success"}
 
@@ -304,19 +305,17 @@ class BoundingBoxResource(object):
         session = Session(bind=SQL_ENGINE)
         paper = self.tkb.get_paper(session, paper_id)
         session.close()
-        annot = paper.get_annotation_layer(layer_id)
-        boxes = annot.get_boxes()
-        if bbx_id == "":
-            resp.media = [box.to_web(id, paper_id, layer_id) for id, box in boxes.items()]
-        else:
-            resp.media = boxes[bbx_id].to_web(bbx_id, paper_id, layer_id)
+        with layer_cache.open(paper, layer_id) as annot:
+            boxes = annot.get_boxes()
+            if bbx_id == "":
+                resp.media = [box.to_web(id, paper_id, layer_id) for id, box in boxes.items()]
+            else:
+                resp.media = boxes[bbx_id].to_web(bbx_id, paper_id, layer_id)
 
     def on_post(self, req: Request, resp: Response, *, paper_id: str, layer_id: str, bbx_id: str):
         session = Session(bind=SQL_ENGINE)
         paper = self.tkb.get_paper(session, paper_id)
-        annot = paper.get_annotation_layer(layer_id)
 
-        print("loaded layer")
         if bbx_id != "":
             resp.status = "405 Method Not Allowed"
             return
@@ -332,10 +331,9 @@ class BoundingBoxResource(object):
             resp.status = "400 Bad Request"
             return
 
-        print("parsed params.")
         box = LabelledBBX(label, 0, page, min_h, min_v, max_h, max_v)
-        id = annot.add_box(box)
-        annot.save()
+        with layer_cache.open(paper, layer_id, write=True) as annot:
+            id = annot.add_box(box)
         resp.media = box.to_web(id, paper_id, layer_id)
 
         # refresh title.
@@ -351,10 +349,9 @@ class BoundingBoxResource(object):
 
         session = Session(bind=SQL_ENGINE)
         paper = self.tkb.get_paper(session, paper_id)
-        annot = paper.get_annotation_layer(layer_id)
 
-        annot.delete_box(bbx_id)
-        annot.save()
+        with layer_cache.open(paper, layer_id, write=True) as annot:
+            annot.delete_box(bbx_id)
 
         resp.media = {"message": "success"}
 
@@ -370,7 +367,6 @@ class BoundingBoxResource(object):
         assert bbx_id != ""
         session = Session(bind=SQL_ENGINE)
         paper = self.tkb.get_paper(session, paper_id)
-        annot = paper.get_annotation_layer(layer_id)
 
         params = json.load(req.stream)
 
@@ -382,8 +378,8 @@ class BoundingBoxResource(object):
         label = params["label"]
 
         box = LabelledBBX(label, 0, page, min_h, min_v, max_h, max_v)
-        annot.move_box(bbx_id, box)
-        annot.save()
+        with layer_cache.open(paper, layer_id, write=True) as annot:
+            annot.move_box(bbx_id, box)
 
         resp.media = box.to_web(bbx_id, paper_id, layer_id)
 
@@ -396,6 +392,11 @@ class BoundingBoxResource(object):
         session.close()
 
 
+class CacheStatsResource(object):
+    def on_get(self, _req: Request, resp: Response):
+        resp.media = {"layers": layer_cache.stats, "xml": xml_cache.stats}
+
+
 api = falcon.API()
 api.req_options.auto_parse_form_urlencoded = True
 tkb = TheoremKB()
@@ -410,3 +411,4 @@ api.add_route("/papers/{paper_id}", PaperResource(tkb))
 api.add_route("/papers/{paper_id}/pdf", PaperPDFResource(tkb))
 api.add_route("/papers/{paper_id}/layers/{layer_id}", PaperAnnotationLayerResource(tkb))
 api.add_route("/papers/{paper_id}/layers/{layer_id}/bbx/{bbx_id}", BoundingBoxResource(tkb))
+api.add_route("/cache", CacheStatsResource())
@@ -0,0 +1,72 @@
+"""Synthetic ALTO documents, used to test XML processing without running pdfalto."""
+import bz2, random, shutil
+
+ALTO_NS = "http://www.loc.gov/standards/alto/ns-v3#"
+
+FONTS = [
+    ("font0", "CMR10", 9.963),
+    ("font1", "CMBX10", 9.963),
+    ("font2", "CMTI10", 9.963),
+    ("font3", "CMMI10", 11.955),
+]
+
+WORDS = ["Theorem", "1.", "Let", "x", "be", "a", "number.", "Proof.", "Page", "12/34", "(a)", "Lemma"]
+
+
+def make_alto(n_pages: int = 3, seed: int = 0) -> bytes:
+    """Generate a random document with the same structure as pdfalto's output."""
+    rand = random.Random(seed)
+
+    out = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<alto xmlns="{ALTO_NS}">',
+        "<Description/>",
+        "<Styles>",
+    ]
+    for id, family, size in FONTS:
+        out.append(f'<TextStyle ID="{id}" FONTFAMILY="{family}" FONTSIZE="{size}"/>')
+    out.append("</Styles>")
+    out.append("<Layout>")
+
+    for p in range(1, n_pages + 1):
+        out.append(
+            f'<Page ID="Page{p}" PHYSICAL_IMG_NR="{p}" WIDTH="595.0" HEIGHT="842.0"><PrintSpace>'
+        )
+        v = 50.0
+        for b in range(rand.randint(1, 4)):
+            n_lines = rand.randint(1, 5)
+            out.append(
+                f'<TextBlock ID="p{p}_b{b}" HPOS="{rand.uniform(40, 80):.2f}" VPOS="{v:.2f}" '
+                f'WIDTH="{rand.uniform(300, 450):.2f}" HEIGHT="{n_lines * 12:.2f}">'
+            )
+            for l in range(n_lines):
+                h = rand.uniform(40, 90)
+                out.append(
+                    f'<TextLine ID="p{p}_b{b}_l{l}" HPOS="{h:.2f}" VPOS="{v:.2f}" '
+                    f'WIDTH="{rand.uniform(100, 400):.2f}" HEIGHT="10.00">'
+                )
+                for w in range(rand.randint(1, 6)):
+                    width = rand.uniform(5, 40)
+                    if w > 0:
+                        out.append(f'<SP WIDTH="3.00" HPOS="{h - 3:.2f}" VPOS="{v:.2f}"/>')
+                    out.append(
+                        f'<String ID="p{p}_w{b}_{l}_{w}" STYLEREFS="{rand.choice(FONTS)[0]}" '
+                        f'HPOS="{h:.2f}" VPOS="{v:.2f}" WIDTH="{width:.2f}" HEIGHT="10.00" '
+                        f'CONTENT="{rand.choice(WORDS)}"/>'
+                    )
+                    h += width + rand.uniform(3, 6)
+                out.append("</TextLine>")
+                v += 12
+            out.append("</TextBlock>")
+            v += 20
+        out.append("</PrintSpace></Page>")
+
+    out.append("</Layout></alto>")
+    return "\n".join(out).encode()
+
+
+def install_alto(paper, data: bytes):
+    """Replace the XML of a paper."""
+    shutil.rmtree(f"{paper.meta_path}/pages", ignore_errors=True)
+    with bz2.BZ2File(f"{paper.meta_path}/article.xml.bz2", "w") as f:
+        f.write(data)
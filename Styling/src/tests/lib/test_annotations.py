@@ -0,0 +1,264 @@
+import os, random, jsonpickle
+import numpy as np
+from copy import copy
+from typing import Dict, List, Tuple
+import pytest
+
+import lib.glob as glob
+glob.TEST_INSTANCE = True
+
+from lib.annotations import AnnotationLayer, layer_file, journal_file
+from lib.misc import codec
+from lib.misc.bounding_box import LabelledBBX, BBX
+from lib.config import config
+
+
+def random_layer(rand: random.Random, n_boxes: int, n_pages: int = 3) -> AnnotationLayer:
+    layer = AnnotationLayer()
+    for i in range(n_boxes):
+        page, h, v = rand.randint(1, n_pages), rand.uniform(0, 500), rand.uniform(0, 800)
+        w, height = rand.uniform(0, 200), rand.uniform(0, 100)
+        layer.add_box(LabelledBBX(rand.choice("abc"), i, page, h, v, h + w, v + height))
+    return layer
+
+
+def random_tokens(rand: random.Random, n_tokens: int, n_pages: int = 4):
+    tokens = []
+    for _ in range(n_tokens):
+        page, h, v = rand.randint(1, n_pages), rand.uniform(0, 600), rand.uniform(0, 900)
+        tokens.append(BBX(page, h, v, h + rand.uniform(0, 30), v + rand.uniform(0, 10)))
+    return tokens
+
+
+@pytest.mark.parametrize("mode", ["full", "intersect"])
+def test_get_labels(mode, tmp_path):
+    rand = random.Random(0)
+    for _ in range(20):
+        layer = random_layer(rand, rand.randint(0, 40))
+        tokens = random_tokens(rand, 300)
+
+        expected = [layer.get_label(bbx, mode) for bbx in tokens]
+        assert list(layer.get_labels(tokens, mode)) == expected
+
+        array = np.array([[bbx.page_num] + bbx.to_coor() for bbx in tokens])
+        assert list(layer.get_labels(array, mode)) == expected
+
+        assert layer.get_many(tokens, mode) == [layer.get(bbx, mode) for bbx in tokens]
+
+    # dense overlapping boxes: the spatial index has several levels, and many boxes match each token.
+    layer = AnnotationLayer()
+    for i in range(300):
+        h, v = rand.uniform(0, 400), rand.uniform(0, 700)
+        layer.add_box(
+            LabelledBBX(str(i), i, 1, h, v, h + rand.uniform(50, 200), v + rand.uniform(50, 200))
+        )
+    layer.save(f"{tmp_path}/annot.json")
+    loaded = AnnotationLayer(f"{tmp_path}/annot.json")  # bulk-loaded or persisted index.
+    tokens = random_tokens(rand, 2000, n_pages=1)
+
+    for layer in [layer, loaded]:
+        expected = [layer.get(bbx, mode) for bbx in tokens]
+        assert layer.get_many(tokens, mode) == expected
+        assert list(layer.get_labels(tokens, mode)) == [
+            box.label if box is not None else "O" for box in expected
+        ]
+
+        # the last matching box wins (labels are box numbers).
+        for bbx, box in zip(tokens[:200], expected):
+            labels = [int(b.label) for b in layer.bbxs.values() if _matches(b, bbx, mode)]
+            assert box is None if len(labels) == 0 else int(box.label) == max(labels)
+
+
+def _matches(box: LabelledBBX, token: BBX, mode: str) -> bool:
+    return box.intersects(token) and (mode == "intersect" or box.extend(10).contains(token))
+
+
+def legacy_reduce(layer: AnnotationLayer) -> List[LabelledBBX]:
+    """Reference implementation: the rtree-based reduce used before the sorted-interval one."""
+    by_group: Dict[Tuple[str, int], List[int]] = {}
+    for box_id, box in layer.bbxs.items():
+        by_group.setdefault((box.label, box.group), []).append(layer._map_id[box_id])
+
+    result = []
+    for ids in by_group.values():
+        current_box = copy(layer.bbxs[layer._id_map[ids[0]]])
+        for id in ids[1:]:
+            test_box = layer.bbxs[layer._id_map[id]]
+            if current_box.page_num != test_box.page_num:
+                result.append(current_box)
+                current_box = copy(test_box)
+                continue
+
+            result_box, extensions_box = current_box.group_with(
+                test_box, inplace=False, extension=True
+            )
+            intersection = set()
+            for extension_box in extensions_box:
+                intersection |= set(
+                    layer._dbs[result_box.page_num].intersection(extension_box.to_coor())
+                )
+
+            if intersection.issubset(ids):
+                current_box = result_box
+            else:
+                result.append(current_box)
+                current_box = copy(test_box)
+        result.append(current_box)
+    return result
+
+
+def token_layer(rand: random.Random, n_pages: int = 3) -> AnnotationLayer:
+    """Token-wise layer, as produced by extractors: lines of words labelled by runs."""
+    layer = AnnotationLayer()
+    group, label = 0, "O"
+    for page in range(1, n_pages + 1):
+        for line in range(rand.randint(10, 40)):
+            h, v = rand.uniform(40, 60), 50 + 14 * line + rand.uniform(-2, 2)
+            for _ in range(rand.randint(1, 12)):
+                if rand.random() < 0.1:
+                    group, label = group + 1, rand.choice(["O", "O", "theorem", "proof"])
+                w = rand.uniform(5, 40)
+                layer.add_box(LabelledBBX(label, group, page, h, v, h + w, v + 10))
+                h += w + rand.uniform(2, 6)
+        if rand.random() < 0.5:  # a figure spanning several lines.
+            layer.add_box(LabelledBBX("figure", -1, page, 300, 100, 500, 400))
+    return layer
+
+
+def as_tuples(boxes):
+    return [(b.label, b.group, b.page_num, *b.to_coor()) for b in boxes]
+
+
+def test_reduce():
+    rand = random.Random(0)
+    layers = [token_layer(rand) for _ in range(10)]
+    layers += [random_layer(rand, rand.randint(1, 60)) for _ in range(10)]
+
+    for layer in layers:
+        expected = legacy_reduce(layer)
+        assert as_tuples(layer.reduce().bbxs.values()) == as_tuples(expected)
+
+        reduced = layer.reduce(ignore=["O"])
+        assert as_tuples(reduced.bbxs.values()) == as_tuples(b for b in expected if b.label != "O")
+        assert all(reduced.get(box) is not None for box in reduced.bbxs.values())  # bulk-loaded index.
+
+
+def test_filter_rebuilds_index():
+    rand = random.Random(1)
+    layer = random_layer(rand, 200)
+    boxes = list(layer.bbxs.values())
+    tokens = random_tokens(rand, 300)
+
+    layer.filter(lambda box: box.label != "a")
+    layer.filter_map(lambda label, group: None if label == "b" else ("d", group))
+    remaining = [box for box in boxes if box.label == "d"]
+    assert len(layer.bbxs) == len(remaining)
+
+    reference = AnnotationLayer.from_boxes(remaining)
+    assert [layer.get_label(bbx, "intersect") for bbx in tokens] == [
+        reference.get_label(bbx, "intersect") for bbx in tokens
+    ]
+
+
+def test_persisted_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PERSIST_LAYER_INDEX", True)
+    rand = random.Random(2)
+    location = str(tmp_path / "annot.json")
+    random_layer(rand, 100).save(location)
+    tokens = random_tokens(rand, 300)
+
+    layer = AnnotationLayer(location)
+    assert layer._persisted_index
+    expected = AnnotationLayer.from_boxes(list(layer.bbxs.values()))
+    assert [layer.get(bbx) for bbx in tokens] == [expected.get(bbx) for bbx in tokens]
+
+    # modifications don't touch the persisted index.
+    box_id = layer.add_box(LabelledBBX("a", 0, 1, 0, 0, 1000, 1000))
+    assert not layer._persisted_index
+    assert layer.get(BBX(1, 10, 10, 20, 20)) is layer.bbxs[box_id]
+    reloaded = AnnotationLayer(location)
+    assert reloaded._persisted_index
+    assert [reloaded.get_label(bbx) for bbx in tokens] == [expected.get_label(bbx) for bbx in tokens]
+
+
+def test_binary_layer(tmp_path):
+    rand = random.Random(3)
+    location = str(tmp_path / "annot.json")
+    layer = random_layer(rand, 100)
+    first_id = next(iter(layer.bbxs))
+    layer.bbxs[first_id].user_data = {"source": "web", "score": [0.5, 1]}
+    layer.save(location)
+    assert layer_file(location) == location + ".bin"
+
+    loaded = AnnotationLayer(location)
+    assert list(loaded.bbxs) == list(layer.bbxs)
+    assert loaded.bbxs.is_lazy and len(loaded.bbxs._built) == 0  # nothing decoded yet.
+    tokens = random_tokens(rand, 300)
+    assert list(loaded.get_labels(tokens)) == list(layer.get_labels(tokens))
+    assert len(loaded.bbxs._built) == 0
+
+    assert as_tuples(loaded.bbxs.values()) == as_tuples(layer.bbxs.values())
+    assert loaded.bbxs[first_id].user_data == {"source": "web", "score": [0.5, 1]}
+    assert loaded.bbxs[first_id] is loaded.bbxs[first_id]
+
+    # modifications are applied on top of the decoded boxes.
+    loaded.delete_box(first_id)
+    new_id = loaded.add_box(LabelledBBX("z", 0, 1, 0, 0, 10, 10))
+    assert not loaded.bbxs.is_lazy
+    assert loaded.get_label(BBX(1, 2, 2, 3, 3)) == "z"
+    loaded.save()
+    reloaded = AnnotationLayer(location)
+    assert first_id not in reloaded.bbxs and reloaded.bbxs[new_id].label == "z"
+
+
+def test_legacy_layer(tmp_path):
+    rand = random.Random(4)
+    location = str(tmp_path / "annot.json")
+    layer = random_layer(rand, 50)
+    with codec.write(location, "bz2") as f:
+        f.write(jsonpickle.encode(layer.bbxs).encode())
+
+    loaded = AnnotationLayer(location)
+    assert as_tuples(loaded.bbxs.values()) == as_tuples(layer.bbxs.values())
+
+    loaded.save()  # migrated.
+    assert layer_file(location) == location + ".bin"
+    assert codec.find(location) is None
+    assert as_tuples(AnnotationLayer(location).bbxs.values()) == as_tuples(layer.bbxs.values())
+
+
+def test_edit_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "LAYER_JOURNAL_SIZE", 5)
+    rand = random.Random(5)
+    location = str(tmp_path / "annot.json")
+    random_layer(rand, 20).save(location)
+    layer_mtime = os.path.getmtime(layer_file(location))
+
+    layer = AnnotationLayer(location)
+    first_id, second_id = list(layer.bbxs)[:2]
+    new_id = layer.add_box(LabelledBBX("z", 0, 1, 0, 0, 10, 10))
+    layer.move_box(first_id, LabelledBBX("y", 0, layer.bbxs[first_id].page_num, 0, 0, 5, 5))
+    layer.delete_box(second_id)
+    layer.save_edits()
+    assert os.path.getmtime(layer_file(location)) == layer_mtime  # only the journal is written.
+
+    reloaded = AnnotationLayer(location)
+    assert as_tuples(reloaded.bbxs.values()) == as_tuples(layer.bbxs.values())
+    assert list(reloaded.bbxs) == list(layer.bbxs)
+    tokens = random_tokens(rand, 200)
+    assert list(reloaded.get_labels(tokens)) == list(layer.get_labels(tokens))
+
+    # the journal is folded into the layer once it's full.
+    reloaded.add_box(LabelledBBX("x", 0, 2, 0, 0, 10, 10))
+    reloaded.save_edits()
+    assert os.path.exists(journal_file(location))
+    reloaded.add_box(LabelledBBX("x", 1, 2, 20, 20, 30, 30))
+    reloaded.save_edits()
+    assert not os.path.exists(journal_file(location))
+    assert as_tuples(AnnotationLayer(location).bbxs.values()) == as_tuples(reloaded.bbxs.values())
+
+    # bulk changes are not journaled.
+    reloaded.filter(lambda box: box.label != "x")
+    reloaded.save_edits()
+    assert not os.path.exists(journal_file(location))
+    assert len(AnnotationLayer(location).bbxs) == len(reloaded.bbxs)
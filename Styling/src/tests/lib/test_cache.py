@@ -0,0 +1,33 @@
+from lib.misc.cache import LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(max_size=10, sizeof=len)
+    cache.put("a", "xxxx")
+    cache.put("b", "xxxx")
+    assert cache.get("a") == "xxxx"  # "a" is now the most recently used.
+
+    cache.put("c", "xxxx")
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.size == 8
+
+    cache.put("d", "x" * 11)  # larger than the budget: not cached.
+    assert "d" not in cache
+
+    assert cache.get("b") is None
+    assert cache.stats == {
+        "hits": 1,
+        "misses": 1,
+        "evictions": 1,
+        "entries": 2,
+        "size": 8,
+        "max_size": 10,
+    }
+
+
+def test_lru_invalidate():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.invalidate("a")
+    assert len(cache) == 0 and cache.size == 0
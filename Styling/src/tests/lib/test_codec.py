@@ -0,0 +1,51 @@
+import os, pytest, jsonpickle
+
+import lib.glob as glob
+glob.TEST_INSTANCE = True
+
+from lib.misc import codec
+from lib.annotations import AnnotationLayer
+from lib.misc.bounding_box import LabelledBBX
+from lib.config import config
+
+
+@pytest.mark.parametrize("name", list(codec.CODECS))
+def test_codec_roundtrip(tmp_path, name):
+    base_path = str(tmp_path / "data.json")
+    with codec.write(base_path, name) as f:
+        f.write(b"hello" * 100)
+
+    path = codec.find(base_path)
+    assert path == base_path + codec.CODECS[name].extension
+    assert codec.read(path) == b"hello" * 100
+
+    # detection from magic bytes when the extension is unknown.
+    os.rename(path, base_path + ".bin")
+    assert codec.detect(base_path + ".bin").name == name
+    assert codec.read(base_path + ".bin") == b"hello" * 100
+
+
+def test_codec_replaces_variants(tmp_path):
+    base_path = str(tmp_path / "data.json")
+    with codec.write(base_path, "bz2") as f:
+        f.write(b"old")
+    with codec.write(base_path, "zlib") as f:
+        f.write(b"new")
+
+    assert codec.variants(base_path) == [base_path + ".gz"]
+    assert codec.read(codec.find(base_path, "bz2")) == b"new"
+
+    codec.remove(base_path)
+    assert codec.find(base_path) is None
+
+
+def test_layer_codec(tmp_path, monkeypatch):
+    location = str(tmp_path / "annot.json")
+    layer = AnnotationLayer()
+    layer.add_box(LabelledBBX("header", 0, 1, 10, 100, 400, 120))
+
+    # layers stored in the previous format with another codec are still readable.
+    with codec.write(location, "lzma") as f:
+        f.write(jsonpickle.encode(layer.bbxs).encode())
+    monkeypatch.setattr(config, "COMPRESSION", "bz2")
+    assert len(AnnotationLayer(location).bbxs) == 1
@@ -0,0 +1,95 @@
+import argparse
+import pytest
+from lxml import etree as ET
+
+import lib.glob as glob
+glob.TEST_INSTANCE = True
+
+from lib.misc.namespaces import ALTO
+from lib.models import CRFTagger, SequenceCorpus, cached_sequence
+from lib.paper import features
+from alto import make_alto
+
+
+def make_sequences(n):
+    return [
+        ([{"x": float(i), "y": str(j)} for j in range(i % 4 + 1)], ["O"] * (i % 4 + 1), f"paper{i}")
+        for i in range(n)
+    ]
+
+
+def test_corpus_roundtrip(tmp_path):
+    corpus = SequenceCorpus(str(tmp_path / "corpus"))
+    assert not corpus.is_complete("key")
+    assert len(corpus) == 0
+
+    sequences = make_sequences(10)
+    with corpus.writer("key", shard_size=3) as write:
+        for sequence in sequences:
+            write(*sequence)
+
+    assert corpus.is_complete("key")
+    assert not corpus.is_complete("other")
+    assert len(list((tmp_path / "corpus").glob("*.pkl"))) == 4
+    assert list(corpus) == sequences
+    # views can be iterated several times.
+    items = corpus.items()
+    assert len(items) == 10
+    assert list(items) == list(items) == [s[0] for s in sequences]
+    assert list(corpus.labels()) == [s[1] for s in sequences]
+    assert list(corpus.ids()) == [s[2] for s in sequences]
+    # subsets.
+    ids = {"paper1", "paper2", "paper7"}
+    assert len(corpus.labels(ids)) == 3
+    assert list(corpus.labels(ids)) == [s[1] for s in sequences if s[2] in ids]
+
+    # an interrupted write leaves an incomplete corpus.
+    with pytest.raises(KeyboardInterrupt):
+        with corpus.writer("new") as write:
+            write(*sequences[0])
+            raise KeyboardInterrupt()
+    assert not corpus.is_complete("key") and not corpus.is_complete("new")
+    with pytest.raises(Exception):
+        list(corpus)
+
+
+def test_corpus_training(tmp_path):
+    documents = [
+        features.get_features(
+            features.build_features_dict(ET.fromstring(make_alto(n_pages=2, seed=seed))), f"{ALTO}String"
+        )
+        for seed in range(3)
+    ]
+    labels = [
+        ["B-x" if position == 2 else "O" for position in frame["String.word_position"].cat.codes]
+        for frame in documents
+    ]
+    corpus = SequenceCorpus(str(tmp_path / "corpus"))
+    with corpus.writer("key", shard_size=2) as write:
+        for i, (frame, target) in enumerate(zip(documents, labels)):
+            write(CRFTagger.to_items(frame), target, str(i))
+
+    args = argparse.Namespace(c1=0.1, c2=0.1, max_iter=20, verbose=False, min_freq=1)
+    streamed = CRFTagger(str(tmp_path / "streamed.crf"))
+    streamed.train(corpus.items(), corpus.labels(), args)
+    in_memory = CRFTagger(str(tmp_path / "in_memory.crf"))
+    in_memory.train([CRFTagger.to_items(frame) for frame in documents], labels, args)
+
+    sequences = [CRFTagger.to_item_sequence(frame) for frame in documents]
+    assert list(streamed(sequences)) == list(in_memory(sequences))
+
+
+def test_cached_sequence(tmp_path):
+    path = str(tmp_path / "sequences" / "paper.pkl")
+    calls = []
+
+    def compute(result):
+        calls.append(result)
+        return result
+
+    sequence = make_sequences(1)[0]
+    assert cached_sequence(path, "key", lambda: compute(sequence)) == sequence
+    assert cached_sequence(path, "key", lambda: compute(None)) == sequence
+    assert cached_sequence(path, "other", lambda: compute(None)) is None
+    assert cached_sequence(path, "other", lambda: compute(sequence)) is None  # None results are cached.
+    assert calls == [sequence, None]
@@ -0,0 +1,136 @@
+from typing import Tuple
+import argparse, time
+import pycrfsuite
+from lxml import etree as ET
+from sqlalchemy.orm.session import Session
+
+import lib.glob as glob
+glob.TEST_INSTANCE = True
+
+from lib.misc import filter_nan
+from lib.misc.namespaces import ALTO
+from lib.models import CRFTagger
+from lib.paper import features
+from lib.misc.bounding_box import LabelledBBX
+from lib.annotations import AnnotationLayer
+from lib.tkb import TheoremKB
+from lib.extractors import Extractor
+from test_tkb import tkb
+from alto import make_alto, install_alto
+
+
+def legacy_items(frame):
+    """Reference implementation: NaN-filtered records."""
+    return [filter_nan(x) for x in frame.to_dict("records")]
+
+
+def test_crf_items():
+    features_dict = features.build_features_dict(ET.fromstring(make_alto(n_pages=2)))
+    for leaf in ["String", "TextLine"]:
+        for standardize in [False, True]:
+            frame = features.get_features(features_dict, ALTO + leaf, standardize)
+            assert (
+                pycrfsuite.ItemSequence(CRFTagger.to_items(frame)).items()
+                == pycrfsuite.ItemSequence(legacy_items(frame)).items()
+            )
+
+
+def test_crf_tags(tmp_path):
+    documents = [
+        features.get_features(
+            features.build_features_dict(ET.fromstring(make_alto(n_pages=2, seed=seed))), f"{ALTO}String"
+        )
+        for seed in range(3)
+    ]
+    labels = [
+        ["B-x" if position == 2 else "O" for position in frame["String.word_position"].cat.codes]
+        for frame in documents
+    ]
+
+    tagger = CRFTagger(str(tmp_path / "model.crf"))
+    args = argparse.Namespace(c1=0.1, c2=0.1, max_iter=20, verbose=False, min_freq=1)
+    tagger.train((CRFTagger.to_items(frame) for frame in documents), labels, args)
+
+    assert list(tagger([CRFTagger.to_item_sequence(frame) for frame in documents])) == list(
+        tagger([legacy_items(frame) for frame in documents])
+    )
+
+
+def test_featurize_cache(tkb: Tuple[TheoremKB, Session], monkeypatch):
+    tkb, session = tkb
+    paper = tkb.get_paper(session, "1")
+    install_alto(paper, make_alto(n_pages=3))
+    layer = AnnotationLayer()
+    layer.add_box(LabelledBBX("title", 0, 1, 0, 0, 600, 100))
+    layer_info = paper.add_annotation_layer("header", layer)
+    extractor = tkb.extractors["header.str.crf"]
+
+    expected = extractor._featurize(paper, layer_info, None, False)
+    assert extractor.featurize(paper, layer_info) == expected
+    assert any(tag.endswith("-title") for tag in expected[1])
+
+    # cached: the paper isn't featurized again.
+    monkeypatch.setattr(type(extractor), "_featurize", lambda *args: None)
+    assert extractor.featurize(paper, layer_info) == expected
+    # other settings, or a modified layer, are featurized again.
+    assert extractor.featurize(paper, layer_info, only={"title"}) is None
+    layer.filter_map(lambda label, group: ("title", group + 1))
+    layer.save()
+    assert extractor.featurize(paper, layer_info) is None
+
+
+def test_corpus_key(tkb: Tuple[TheoremKB, Session]):
+    tkb, session = tkb
+    paper = tkb.get_paper(session, "1")
+    install_alto(paper, make_alto(n_pages=2))
+    layer = AnnotationLayer()
+    layer.add_box(LabelledBBX("title", 0, 1, 0, 0, 600, 100))
+    documents = [(paper, paper.add_annotation_layer("header", layer))]
+    extractor = tkb.extractors["header.str.crf"]
+
+    key = extractor._corpus_key(documents, None, False)
+    assert extractor._corpus_key(documents, None, False) == key
+    assert extractor._corpus_key(documents, None, True) != key
+    # features are left to the workers.
+    assert paper.features_stamp() is None
+
+    # the corpus is keyed by the features computed while building it, so that it can be reused.
+    extractor.build_corpus(documents, single_core=True)
+    computed_key = extractor._corpus_key(documents, None, False)
+    assert computed_key != key
+    assert extractor.build_corpus(documents, single_core=True).is_complete(computed_key)
+
+    # rebuilt features give another corpus.
+    time.sleep(0.01)
+    paper._update_features(force=True)
+    assert extractor._corpus_key(documents, None, False) != computed_key
+
+
+def test_apply_many(tkb: Tuple[TheoremKB, Session]):
+    tkb, session = tkb
+    papers, documents = [], []
+    for seed in range(3):
+        paper = tkb.add_paper(session, f"p{seed}", "/dev/null")
+        install_alto(paper, make_alto(n_pages=2, seed=seed))
+        layer = AnnotationLayer()
+        layer.add_box(LabelledBBX("front", 0, 1, 0, 0, 600, 150 + 50 * seed))
+        papers.append(paper)
+        documents.append((paper, paper.add_annotation_layer("segmentation", layer)))
+
+    extractor = tkb.extractors["segmentation.str.crf"]
+    args = argparse.Namespace(
+        only=None, balance=False, c1=0.1, c2=0.1, max_iter=20, verbose=False, min_freq=1, single_core=True
+    )
+    extractor.train(documents, args)
+
+    tokens = [paper.get_tokens(f"{ALTO}String") for paper in papers]
+    expected = [list(extractor.apply(paper, [], args).get_labels(t)) for paper, t in zip(papers, tokens)]
+    actual = extractor.apply_many(papers, [[], [], []], args)
+    assert [list(layer.get_labels(t)) for layer, t in zip(actual, tokens)] == expected
+    assert any("front" in labels for labels in expected)
+
+    # default implementation: one paper at a time.
+    assert [
+        list(layer.get_labels(t))
+        for layer, t in zip(Extractor.apply_many(extractor, papers, [[], [], []], args), tokens)
+    ] == expected
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import lib.glob as glob
+glob.TEST_INSTANCE = True
+
+from lib.paper import feature_store
+
+
+def make_frame(n: int = 50) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "prev_delta_h": rng.normal(size=n),
+            "length": rng.integers(0, 10, size=n),
+            "italic": rng.random(n) < 0.5,
+            "word": [f"w{i}" for i in range(n)],
+            "word_position": pd.Categorical(rng.choice(["start", "in", "end"], size=n)),
+            "{http://www.loc.gov/standards/alto/ns-v3#}TextLine": np.arange(n),
+        }
+    )
+
+
+@pytest.mark.parametrize("use_feather", [False, True])
+def test_frame_roundtrip(tmp_path, monkeypatch, use_feather):
+    if use_feather and feature_store.feather is None:
+        pytest.skip("pyarrow is not installed")
+    if not use_feather:
+        monkeypatch.setattr(feature_store, "feather", None)
+
+    directory = str(tmp_path / "frame")
+    frame = make_frame()
+    feature_store.write_frame(directory, frame, meta={"built": 1})
+
+    assert feature_store.read_meta(directory) == {"built": 1}
+    assert feature_store.read_columns(directory) == list(frame.columns)
+    pd.testing.assert_frame_equal(feature_store.read_frame(directory), frame)
+
+    columns = ["word_position", "italic"]
+    pd.testing.assert_frame_equal(feature_store.read_frame(directory, columns), frame[columns])
+    with pytest.raises(KeyError):
+        feature_store.read_frame(directory, ["missing"])
+
+
+def test_frame_fallbacks(tmp_path):
+    # mixed columns, aggregated features and custom index are pickled.
+    frame = pd.DataFrame(
+        {
+            "repetitive": [True, np.nan, False],
+            "words": [{"a": 1}, {"b": 2}, {}],
+            "word": ["a", "b", "c\0"],
+        },
+        index=[3, 4, 5],
+    )
+    directory = str(tmp_path / "frame")
+    feature_store.write_frame(directory, frame)
+    pd.testing.assert_frame_equal(feature_store.read_frame(directory), frame)
+
+    empty = pd.DataFrame.from_dict([])
+    feature_store.write_frame(directory, empty)
+    pd.testing.assert_frame_equal(feature_store.read_frame(directory), empty)
+
+    # incomplete frames are not read.
+    feature_store.remove(directory)
+    assert feature_store.read_frame(directory) is None
+    assert feature_store.read_meta(directory) is None
@@ -0,0 +1,199 @@
+import io
+from collections import Counter
+import numpy as np
+import pandas as pd
+from lxml import etree as ET
+
+import lib.glob as glob
+glob.TEST_INSTANCE = True
+
+from lib.misc.alto import AltoReader
+from lib.misc.namespaces import ALTO, ALTO_NS
+from lib.features import StringFeaturesExtractor
+from lib.features.status import PositionIndex
+from lib.paper import features, tokens, aggregation
+from alto import make_alto
+
+
+def test_alto_reader():
+    data = make_alto(n_pages=4)
+    reader = AltoReader(io.BytesIO(data))
+
+    numbers = []
+    for page in reader.pages():
+        numbers.append(page.get("PHYSICAL_IMG_NR"))
+        assert len(page.findall(f".//{ALTO}String")) > 0
+        # previous pages have been released.
+        previous = page.getprevious()
+        assert previous is None or (len(previous) == 0 and previous.getprevious() is None)
+        assert len(reader.styles) == 4
+    assert numbers == ["1", "2", "3", "4"]
+
+    blocks = list(AltoReader(io.BytesIO(data)).blocks())
+    assert len(blocks) == len(ET.fromstring(data).findall(f".//{ALTO}TextBlock"))
+
+
+def test_streaming_token_tables():
+    data = make_alto(n_pages=4)
+    expected = tokens.build_token_tables_from_xml(ET.fromstring(data))
+
+    reader = AltoReader(io.BytesIO(data))
+    actual = tokens.build_token_tables(reader.styles, reader.pages())
+
+    for level in tokens.LEVELS:
+        assert np.array_equal(expected[level].rows, actual[level].rows)
+        assert expected[level].text == actual[level].text
+        assert expected[level].styles == actual[level].styles
+
+
+def test_streaming_features():
+    data = make_alto(n_pages=4)
+    expected = features.build_features_dict(ET.fromstring(data))
+    actual = features.build_features_dict_streaming(lambda: io.BytesIO(data))
+
+    assert expected.keys() == actual.keys()
+    for level in expected.keys():
+        pd.testing.assert_frame_equal(expected[level], actual[level])
+
+
+def legacy_word_geometry(word: ET.Element) -> dict:
+    """Reference implementation: position of a word found by searching its line."""
+    line = word.xpath("./ancestor::alto:TextLine", namespaces=ALTO_NS)[0]
+    line_words = line.findall(f".//{ALTO}String")
+    word_index = line_words.index(word)
+
+    word_h, word_w = float(word.get("HPOS")), float(word.get("WIDTH"))
+    if word_index > 0:
+        previous_word = line_words[word_index - 1]
+        previous_word_h = float(previous_word.get("HPOS")) + float(previous_word.get("WIDTH"))
+    else:
+        previous_word_h = word_h
+    if word_index < len(line_words) - 1:
+        next_word_h = float(line_words[word_index + 1].get("HPOS"))
+    else:
+        next_word_h = word_h + word_w
+
+    position = "start" if word_index == 0 else "end" if word_index == len(line_words) - 1 else "in"
+    return {
+        "#word_position": position,
+        "prev_delta_h": word_h - previous_word_h,
+        "next_delta_h": next_word_h - (word_h + word_w),
+    }
+
+
+def test_string_features():
+    for seed in range(5):
+        root = ET.fromstring(make_alto(n_pages=3, seed=seed))
+        extractor = StringFeaturesExtractor(root)
+        for word in root.iter(f"{ALTO}String"):
+            f = extractor.get(word)
+            assert {k: f[k] for k in ["#word_position", "prev_delta_h", "next_delta_h"]} == (
+                legacy_word_geometry(word)
+            )
+
+
+def test_position_index():
+    root = ET.fromstring(make_alto(n_pages=3))
+    positions = PositionIndex()
+    for tag, ancestor in [("String", "TextLine"), ("TextLine", "TextBlock"), ("TextBlock", "Page")]:
+        for node in root.iter(ALTO + tag):
+            siblings = node.xpath(f"./ancestor::alto:{ancestor}", namespaces=ALTO_NS)[0].findall(
+                f".//{ALTO}{tag}"
+            )
+            position = positions.get(node, ALTO + ancestor)
+            assert (position.index, position.count) == (siblings.index(node), len(siblings))
+            assert position.previous() is (siblings[position.index - 1] if position.index > 0 else None)
+
+    assert positions.get(root.find(f".//{ALTO}Page"), f"{ALTO}TextLine") is None
+
+
+def test_vectorized_features():
+    for seed in range(5):
+        root = ET.fromstring(make_alto(n_pages=4, seed=seed))
+        expected = features.build_features_dict(root)
+        actual = features.build_features_dict_from_tables(
+            list(root.iter(f"{ALTO}TextStyle")), tokens.build_token_tables_from_xml(root)
+        )
+
+        assert expected.keys() == actual.keys()
+        for level in expected.keys():
+            pd.testing.assert_frame_equal(expected[level], actual[level])
+
+    # unsupported structure: a line outside of a block.
+    root = ET.fromstring(make_alto(n_pages=2))
+    block = root.find(f".//{ALTO}TextBlock")
+    block.getparent().append(block[0])
+    assert (
+        features.build_features_dict_from_tables(
+            list(root.iter(f"{ALTO}TextStyle")), tokens.build_token_tables_from_xml(root)
+        )
+        is None
+    )
+
+
+def test_partial_features():
+    root = ET.fromstring(make_alto(n_pages=3))
+    expected = features.build_features_dict(root)
+    levels = [f"{ALTO}TextBlock", f"{ALTO}String"]
+
+    for actual in [
+        features.build_features_dict(root, levels),
+        features.build_features_dict_from_tables(
+            list(root.iter(f"{ALTO}TextStyle")), tokens.build_token_tables_from_xml(root), levels
+        ),
+    ]:
+        assert list(actual.keys()) == levels
+        for level in levels:
+            pd.testing.assert_frame_equal(actual[level], expected[level])
+
+
+def legacy_aggregate(frame: pd.DataFrame, key: str) -> pd.DataFrame:
+    """Reference implementation: aggregation with pandas groupby."""
+    numerics = (
+        frame.select_dtypes(include=["bool", "number"])
+        .groupby(by=key)
+        .agg(["min", "max", "std", "mean"])
+        .fillna(0)
+    )
+    numerics.columns = numerics.columns.map("_".join)
+    words = (
+        pd.concat([frame.select_dtypes(exclude=["bool", "number"]), frame[key]], axis=1)
+        .groupby(by=key)
+        .agg(lambda x: dict(Counter(x)))
+    )
+    groups = frame.groupby(by=key)
+    return pd.concat(
+        [
+            numerics,
+            words,
+            groups.nth(0).add_suffix(".first"),
+            groups.nth(1).add_suffix(".second"),
+            groups.nth(-1).add_suffix(".last"),
+        ],
+        axis=1,
+    )
+
+
+def test_aggregation(monkeypatch):
+    frame = pd.DataFrame(
+        {
+            "length": [3, 1, 4, 1, 5, 9],
+            "delta": [0.1, np.nan, 0.3, 0.7, np.nan, 0.2],
+            "bold": [True, False, True, True, False, False],
+            "word": ["a", "b", "a", None, "c", "a"],
+            "position": pd.Categorical(["start", "in", "end", "start", "end", "start"]),
+            "parent": [0, 0, 0, 2, 2, np.nan],
+        }
+    )
+    pd.testing.assert_frame_equal(
+        aggregation.aggregate(frame, "parent"), legacy_aggregate(frame, "parent"), check_exact=True
+    )
+
+    for seed in range(3):
+        features_dict = features.build_features_dict(ET.fromstring(make_alto(n_pages=3, seed=seed)))
+        for leaf in ["TextLine", "TextBlock", "Page"]:
+            actual = features.get_features(features_dict, ALTO + leaf)
+            with monkeypatch.context() as m:
+                m.setattr(aggregation, "aggregate", legacy_aggregate)
+                expected = features.get_features(features_dict, ALTO + leaf)
+            pd.testing.assert_frame_equal(actual, expected, check_exact=True)
@@ -0,0 +1,67 @@
+import threading
+
+import lib.glob as glob
+glob.TEST_INSTANCE = True
+
+from lib.annotations import AnnotationLayer
+from lib.misc.bounding_box import LabelledBBX
+from lib.paper.layer_cache import LayerCache, layer_size
+
+
+class DummyPaper:
+    def __init__(self, meta_path: str):
+        self.meta_path = meta_path
+        self.loads = 0
+
+    def get_annotation_layer(self, layer_id: str) -> AnnotationLayer:
+        self.loads += 1
+        return AnnotationLayer(f"{self.meta_path}/annot_{layer_id}.json")
+
+
+def test_layer_cache(tmp_path):
+    paper = DummyPaper(str(tmp_path))
+    cache = LayerCache(2 ** 20)
+
+    with cache.open(paper, "a", write=True) as layer:
+        layer.add_box(LabelledBBX("header", 0, 1, 0, 0, 10, 10))
+    with cache.open(paper, "a") as layer:
+        assert len(layer.bbxs) == 1
+    assert paper.loads == 1 and cache.stats["hits"] == 1
+    assert len(AnnotationLayer(f"{tmp_path}/annot_a.json").bbxs) == 1  # written through.
+
+    # layers modified by another process are reloaded.
+    other = AnnotationLayer(f"{tmp_path}/annot_a.json")
+    other.add_box(LabelledBBX("title", 0, 1, 0, 0, 5, 5))
+    other.save()
+    with cache.open(paper, "a") as layer:
+        assert len(layer.bbxs) == 2
+    assert paper.loads == 2
+
+    # failed edits are not kept.
+    try:
+        with cache.open(paper, "a", write=True) as layer:
+            layer.delete_box("unknown")
+    except KeyError:
+        pass
+    assert "a" not in cache._cache
+
+
+def test_layer_cache_concurrent_edits(tmp_path):
+    paper = DummyPaper(str(tmp_path))
+    cache = LayerCache(2 ** 20)
+
+    def add_boxes(n):
+        for i in range(n):
+            with cache.open(paper, "a", write=True) as layer:
+                layer.add_box(LabelledBBX("x", i, 1, i, i, i + 1, i + 1))
+
+    threads = [threading.Thread(target=add_boxes, args=(20,)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(AnnotationLayer(f"{tmp_path}/annot_a.json").bbxs) == 80
+    assert cache.stats["size"] == layer_size(AnnotationLayer(f"{tmp_path}/annot_a.json"))
+    # locks are not kept once released.
+    assert len(cache._locks) == 0
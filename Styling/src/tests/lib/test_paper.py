@@ -1,5 +1,9 @@
 from typing import Tuple
+import os, shutil, pickle, subprocess
 import pytest
+import numpy as np
+import pandas as pd
+from lxml import etree as ET
 
 
 import lib.glob as glob 
@@ -9,9 +13,13 @@ from lib.annotations import AnnotationLayer
 from lib.classes import HeaderAnnotationClass, SegmentationAnnotationClass
 from lib.misc.bounding_box import LabelledBBX, BBX
 
-from lib.paper import Paper
+from lib.paper import Paper, PDFConversionException, xml_cache, shards, features, aggregation, tokens
 from lib.misc.namespaces import ALTO
+from lib.misc import codec
+from lib.config import config
+from lib.features import FEATURE_EXTRACTORS, _source_digests
 from test_tkb import tkb
+from alto import make_alto, install_alto
 
 from sqlalchemy.orm.session import Session
 from lib.tkb import TheoremKB
@@ -22,6 +30,13 @@ def paper(tkb: Tuple[TheoremKB, Session]):
     tkb, session = tkb
     return tkb.get_paper(session, "0")
 
+@pytest.fixture
+def synthetic_paper(tkb: Tuple[TheoremKB, Session]):
+    tkb, session = tkb
+    paper = tkb.get_paper(session, "1")
+    install_alto(paper, make_alto(n_pages=3))
+    return paper
+
 @pytest.fixture
 def paper_session(tkb: Tuple[TheoremKB, Session]):
     tkb, session = tkb
@@ -39,6 +54,141 @@ def test_get_xml(paper: Paper):
     assert len(xml.findall(f".//{ALTO}String")) == 3
 
 
+def test_convert(tkb: Tuple[TheoremKB, Session]):
+    tkb, session = tkb
+    paper = tkb.get_paper(session, "0")
+
+    assert not paper.is_converted
+    paper.convert()
+    assert paper.is_converted
+    assert not os.path.exists(f"{paper.meta_path}/article.xml")  # only the compressed file is kept.
+
+    broken = tkb.add_paper(session, "broken", "/does/not/exist.pdf")
+    with pytest.raises(PDFConversionException):
+        broken.convert()
+    assert not broken.is_converted
+
+
+def test_failed_convert(tkb: Tuple[TheoremKB, Session], monkeypatch):
+    tkb, session = tkb
+    paper = tkb.get_paper(session, "0")
+    monkeypatch.setattr(config, "COMPRESSION", "none")  # the final file is `article.xml`.
+    monkeypatch.setattr(config, "XML_SHARDING", False)
+
+    def pdfalto(data: bytes, returncode: int = 0, timeout: bool = False):
+        def run(command, timeout=None, **kwargs):
+            with open(command[-1], "wb") as f:
+                f.write(data)
+            with open(f"{os.path.dirname(command[-1])}/article_annot.xml", "wb") as f:
+                f.write(b"<annotations/>")
+            if timeout:
+                raise subprocess.TimeoutExpired(command, timeout)
+            return subprocess.CompletedProcess(command, returncode, b"", b"error")
+
+        return run
+
+    truncated = make_alto(n_pages=2)[:500]
+    for run in [pdfalto(truncated, returncode=1), pdfalto(truncated, timeout=True)]:
+        monkeypatch.setattr(subprocess, "run", run)
+        with pytest.raises(PDFConversionException):
+            paper.convert(timeout=1)
+        assert not paper.is_converted
+        assert not any(
+            name.startswith("article") or name == "pdfalto.tmp" for name in os.listdir(paper.meta_path)
+        )
+
+    # failure while storing the XML.
+    monkeypatch.setattr(subprocess, "run", pdfalto(make_alto(n_pages=2)))
+    with monkeypatch.context() as m:
+        m.setattr(shutil, "copyfileobj", lambda *args: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            paper.convert()
+    assert not paper.is_converted
+    assert not os.path.exists(f"{paper.meta_path}/article.xml.tmp")
+    assert not os.path.exists(f"{paper.meta_path}/pdfalto.tmp")
+
+    paper.convert()
+    assert paper.is_converted and os.path.exists(f"{paper.meta_path}/article_annot.xml")
+    assert len(paper.get_xml().getroot().findall(f".//{ALTO}Page")) == 2
+
+
+def test_xml_cache(paper: Paper):
+    xml = paper.get_xml()
+    hits = xml_cache.stats["hits"]
+
+    assert paper.get_xml() is xml
+    assert xml_cache.stats["hits"] == hits + 1
+
+    # rewriting the file invalidates the entry.
+    xml_path = f"{paper.meta_path}/article.xml.bz2"
+    stat = os.stat(xml_path)
+    os.utime(xml_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert paper.get_xml() is not xml
+
+
+def test_get_tokens(synthetic_paper: Paper):
+    root = synthetic_paper.get_xml().getroot()
+
+    for level in ["TextBlock", "TextLine", "String"]:
+        table = synthetic_paper.get_tokens(f"{ALTO}{level}")
+        nodes = root.findall(f".//{ALTO}{level}")
+        assert len(table) == len(nodes)
+
+        for bbx, node in zip(table.bbxs(), nodes):
+            ref = BBX.from_element(node)
+            assert (bbx.page_num, bbx.to_coor()) == (ref.page_num, ref.to_coor())
+
+    # tables are persisted and memory-mapped.
+    table = synthetic_paper.get_tokens(f"{ALTO}String")
+    assert isinstance(table.rows, np.memmap)
+    assert table.contents() == [n.get("CONTENT") for n in root.findall(f".//{ALTO}String")]
+    assert [table.style(i) for i in range(len(table))] == [
+        n.get("STYLEREFS") for n in root.findall(f".//{ALTO}String")
+    ]
+
+    lines = synthetic_paper.get_tokens(f"{ALTO}TextLine")
+    all_lines = root.findall(f".//{ALTO}TextLine")
+    line_of_word = [all_lines.index(n.getparent()) for n in root.findall(f".//{ALTO}String")]
+    assert table["line"].tolist() == line_of_word
+    assert (lines["block"] >= 0).all()
+
+    # saving tables again leaves the memory-mapped ones untouched, and the text is kept as is.
+    directory = f"{synthetic_paper.meta_path}/tokens"
+    rows = np.array(table.rows)
+    words = ["a\r\nb" if i == 0 else word for i, word in enumerate(table.contents())]
+    text = "".join(words)
+    starts = np.cumsum([0] + [len(word) for word in words])
+    tables = {level: synthetic_paper.get_tokens(level) for level in tokens.LEVELS}
+    new_rows = np.array(rows)
+    new_rows["text_start"], new_rows["text_end"] = starts[:-1], starts[1:]
+    tables[f"{ALTO}String"] = tokens.TokenTable(f"{ALTO}String", new_rows, text, table.styles)
+    tokens.save_token_tables(directory, tables)
+
+    assert (np.array(table.rows) == rows).all()
+    assert tokens.load_token_table(directory, f"{ALTO}String").contents() == words
+
+
+def test_sharded_xml(synthetic_paper: Paper):
+    paper = synthetic_paper
+    reference = paper.get_xml().getroot()
+    strings = paper.get_tokens(f"{ALTO}String").contents()
+
+    with paper.open_xml() as f:
+        shards.write_shards(f, f"{paper.meta_path}/pages", "gzip")
+    os.remove(f"{paper.meta_path}/article.xml.bz2")
+    xml_cache.clear()
+    assert paper.is_sharded and paper.is_converted
+
+    page = paper.get_page_xml(2)
+    assert ET.tostring(page) == ET.tostring(reference.findall(f".//{ALTO}Page")[1], with_tail=False)
+    assert [p.get("PHYSICAL_IMG_NR") for p in paper.iter_pages([1, 3])] == ["1", "3"]
+    assert [s.get("ID") for s in paper.get_xml_styles()] == ["font0", "font1", "font2", "font3"]
+
+    stitched = paper.get_xml().getroot()
+    assert len(stitched.findall(f".//{ALTO}String")) == len(strings)
+    assert paper.get_tokens(f"{ALTO}String").contents() == strings
+
+
 def test_get_features(paper: Paper):
 
     assert len(paper.get_features(f"{ALTO}TextLine", standardize=False, add_context=False)) == 1
@@ -51,6 +201,95 @@ def test_get_features(paper: Paper):
         pass
 
 
+def test_features_cache(synthetic_paper: Paper, monkeypatch):
+    paper = synthetic_paper
+    expected = paper.get_features(f"{ALTO}String")
+
+    calls = []
+    get_features = features.get_features
+    monkeypatch.setattr(features, "get_features", lambda *args: calls.append(1) or get_features(*args))
+
+    pd.testing.assert_frame_equal(paper.get_features(f"{ALTO}String"), expected)
+    assert len(calls) == 0
+
+    # column projection.
+    columns = ["String.word_position", "String.italic", "TextLine.line_position"]
+    pd.testing.assert_frame_equal(paper.get_features(f"{ALTO}String", columns=columns), expected[columns])
+    assert len(calls) == 0
+
+    # rebuilding raw features invalidates the cache.
+    paper._build_features(force=True)
+    pd.testing.assert_frame_equal(paper.get_features(f"{ALTO}String"), expected)
+    assert len(calls) == 1
+
+    # so does a new version of the feature computation.
+    monkeypatch.setattr(features, "FEATURES_VERSION", features.FEATURES_VERSION + 1)
+    pd.testing.assert_frame_equal(paper.get_features(f"{ALTO}String"), expected)
+    assert len(calls) == 2
+    paper.get_features(f"{ALTO}String")
+    assert len(calls) == 2
+
+    # or a change of its source code.
+    monkeypatch.setitem(_source_digests, aggregation.__name__, "modified")
+    pd.testing.assert_frame_equal(paper.get_features(f"{ALTO}String"), expected)
+    assert len(calls) == 3
+
+
+def test_features_migration(synthetic_paper: Paper, monkeypatch):
+    paper = synthetic_paper
+    expected = paper._build_features()
+    expected_frame = paper.get_features(f"{ALTO}TextLine")
+
+    # raw features stored in the previous format.
+    shutil.rmtree(f"{paper.meta_path}/features")
+    with codec.write(f"{paper.meta_path}/features.pkl", "none") as f:
+        pickle.dump(expected, f)
+
+    assert paper.migrate_features()
+    assert codec.find(f"{paper.meta_path}/features.pkl") is None
+    # migrated features are assumed to be computed by the current extractors: they are not computed again.
+    assert paper.stale_feature_levels() == []
+    monkeypatch.setattr(Paper, "_compute_features", None)
+
+    raw = paper.get_raw_features(f"{ALTO}String", columns=["word", "italic"])
+    pd.testing.assert_frame_equal(raw, expected[f"{ALTO}String"][["word", "italic"]])
+
+    for level, frame in paper._build_features().items():
+        pd.testing.assert_frame_equal(frame, expected[level])
+    pd.testing.assert_frame_equal(paper.get_features(f"{ALTO}TextLine"), expected_frame)
+
+
+def test_stale_features(synthetic_paper: Paper, monkeypatch):
+    paper = synthetic_paper
+    expected = paper._build_features()
+    expected_frame = paper.get_features(f"{ALTO}String")
+    assert paper.stale_feature_levels() == []
+
+    monkeypatch.setattr(config, "FEATURE_BACKEND", "vectorized")
+    computed = []
+    build = features.build_features_dict_from_tables
+    monkeypatch.setattr(
+        features,
+        "build_features_dict_from_tables",
+        lambda styles, tables, levels=None: computed.append(levels) or build(styles, tables, levels),
+    )
+
+    # a new version of an extractor only invalidates its level.
+    monkeypatch.setattr(FEATURE_EXTRACTORS[f"{ALTO}TextLine"], "version", 2)
+    assert paper.stale_feature_levels() == [f"{ALTO}TextLine"]
+    for level, frame in paper._build_features().items():
+        pd.testing.assert_frame_equal(frame, expected[level])
+    assert computed == [[f"{ALTO}TextLine"]]
+    assert paper.stale_feature_levels() == []
+
+    # feature frames built from the previous raw features are recomputed.
+    get_features = features.get_features
+    calls = []
+    monkeypatch.setattr(features, "get_features", lambda *args: calls.append(1) or get_features(*args))
+    pd.testing.assert_frame_equal(paper.get_features(f"{ALTO}String"), expected_frame)
+    assert len(calls) == 1 and len(computed) == 1
+
+
 def test_apply_layer_and_get_title(paper: Paper):
 
     test_ann = AnnotationLayer()
@@ -107,4 +346,24 @@ def test_json_serializer(paper: Paper):
             }
         },
         "title": "Dummy"
-    }
\ No newline at end of file
+    }
+
+def test_token_labels(synthetic_paper: Paper):
+    paper = synthetic_paper
+    layer = AnnotationLayer()
+    layer.add_box(LabelledBBX("header", 0, 1, 0, 0, 600, 100))
+    layer_id = paper.add_annotation_layer("header", layer).id
+    location = f"{paper.meta_path}/annot_{layer_id}.json"
+
+    tokens = paper.get_tokens(f"{ALTO}String")
+    labels = paper.get_token_labels(layer_id)
+    assert list(labels) == list(layer.get_labels(tokens))
+    assert "header" in labels and os.path.exists(location + ".labels.full.String.npz")
+    assert list(paper.get_token_labels(layer_id)) == list(labels)  # persisted vector.
+
+    # saving the layer invalidates the vector.
+    layer.filter_map(lambda label, group: ("title", group))
+    assert set(layer.get_token_labels(tokens)[labels == "header"]) == {"title"}
+    layer.save()
+    assert not os.path.exists(location + ".labels.full.String.npz")
+    assert "title" in paper.get_token_labels(layer_id)
@@ -0,0 +1,51 @@
+import pandas as pd
+from lxml import etree as ET
+
+import lib.glob as glob
+glob.TEST_INSTANCE = True
+
+from lib.misc.namespaces import ALTO
+from lib.models import CRFTagger, SequenceCorpus
+from lib.models.sweep import parameter_space, evaluate, summarize
+from lib.paper import features
+from alto import make_alto
+
+
+def test_parameter_space():
+    grid = {"c1": [0.01, 0.1, 1.0], "c2": [0.1, 1.0], "min_freq": [1], "max_iter": [10]}
+    assert len(parameter_space(grid)) == 6
+    sampled = parameter_space(grid, n_iter=4, seed=1)
+    assert len(sampled) == 4 and all(c in parameter_space(grid) for c in sampled)
+    assert sampled == parameter_space(grid, n_iter=4, seed=1)
+    assert len(parameter_space(grid, n_iter=10)) == 6
+
+
+def test_sweep(tmp_path):
+    corpus = SequenceCorpus(str(tmp_path / "corpus"))
+    with corpus.writer("key", shard_size=2) as write:
+        for seed in range(4):
+            frame = features.get_features(
+                features.build_features_dict(ET.fromstring(make_alto(n_pages=2, seed=seed))), f"{ALTO}String"
+            )
+            positions = frame["String.word_position"].cat.codes
+            tags = ["B-x" if p == 0 else "I-x" if p == 1 else "O" for p in positions]
+            write(CRFTagger.to_items(frame), tags, str(seed))
+
+    ids = {"0", "1", "2", "3"}
+    folds = [{"0", "1"}, {"2", "3"}]
+    configurations = parameter_space({"c1": [0.01, 0.1], "c2": [0.1], "min_freq": [1], "max_iter": [10]})
+    results = pd.DataFrame(
+        [
+            evaluate((corpus.directory, parameters, i, ids - fold, fold, ["x"]))
+            for parameters in configurations
+            for i, fold in enumerate(folds)
+        ]
+    )
+    assert len(results) == 4
+    assert results["f1"].between(0, 1).all() and (results["train_time"] > 0).all()
+
+    summary = summarize(results)
+    assert summary["f1"].is_monotonic_decreasing
+    for _, row in summary.iterrows():
+        assert row["f1"] == results[results["c1"] == row["c1"]]["f1"].mean()
+    assert (summary["folds"] == 2).all()
@@ -14,9 +14,12 @@ from ..theoremdb.links import RefsBBX
 ALTO = "{http://www.loc.gov/standards/alto/ns-v3#}"
 
 
+Font = namedtuple("Font", ["is_italic", "is_math", "is_bold", "size"])
+
 def extract_fonts(xml):
-    Font = namedtuple("Font", ["is_italic", "is_math", "is_bold", "size"])
+    return fonts_from_styles(xml.findall(f".//{ALTO}TextStyle"))
 
+def fonts_from_styles(styles):
     italic_re   = re.compile(r"((TI)[0-9]+|Ital|rsfs|EUSM)", flags=re.IGNORECASE)
     bold_re     = re.compile(r"(CMBX|Bold|NimbusRomNo9L-Medi)", flags=re.IGNORECASE) #
     math_re     = re.compile(r"((CM)(SY|MI|EX)|math|Math|MSAM|MSBM|LASY|cmex|StandardSymL)", flags=re.IGNORECASE)
@@ -24,7 +27,7 @@ def extract_fonts(xml):
 
     fonts = {}
 
-    for font in xml.findall(f".//{ALTO}TextStyle"):
+    for font in styles:
         family = font.get("FONTFAMILY")
         id     = font.get("ID")
         size   = float(font.get("FONTSIZE"))
@@ -152,17 +155,53 @@ def get_line_features(line, fonts):
         "mean_fontsize": ft_mean_fontsize,
     }
 
+def iter_pages(source):
+    """
+    Stream the pages of an ALTO document, one at a time.
+    Yields (styles, page): styles are complete as soon as the first page is read.
+    Pages are released once processed, so memory depends on the page size only.
+    """
+    styles = []
+    context = ET.iterparse(source, events=("end",), tag=(f"{ALTO}TextStyle", f"{ALTO}Page"), recover=True, huge_tree=True)
+    for _, element in context:
+        if element.tag == f"{ALTO}TextStyle":
+            styles.append(element)
+            continue
+
+        yield styles, element
+
+        element.clear(keep_tail=False)
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
 def extract(xml, results: ResultsBoundingBoxes, refs: RefsBBX, mode="word",needlink=True):
     """
     Build dataset from XML, either 'line'-based or 'word'-based.
     """
+    return extract_pages([xml], extract_fonts(xml), results, refs, mode, needlink)
+
+def extract_streaming(source, results: ResultsBoundingBoxes, refs: RefsBBX, mode="word",needlink=True):
+    """
+    Build dataset from an XML file, reading it one page at a time.
+    """
+    fonts = {}
+    def pages():
+        for styles, page in iter_pages(source):
+            if not fonts:
+                fonts.update(fonts_from_styles(styles))
+            yield page
+
+    return extract_pages(pages(), fonts, results, refs, mode, needlink)
+
+def extract_pages(pages, fonts, results: ResultsBoundingBoxes, refs: RefsBBX, mode="word",needlink=True):
+    """
+    Build dataset from a sequence of XML nodes (document or pages), either 'line'-based or 'word'-based.
+    """
 
     if mode != "word" and mode != "line":
         print(f"Error: unknown extraction mode '{mode}''", file=sys.stderr)
         exit(1) 
 
-    fonts    = extract_fonts(xml)
-
     entries = []
 
     if mode == "word":
@@ -172,7 +211,7 @@ def extract(xml, results: ResultsBoundingBoxes, refs: RefsBBX, mode="word",needl
 
     begin_ok = set()
     
-    for node in xml.findall(node_query):
+    for node in (node for page in pages for node in page.findall(node_query)):
         if mode == "word":
             row = get_features(node, fonts)
             row["text"] = node.get("CONTENT")
@@ -211,10 +250,9 @@ def extract(xml, results: ResultsBoundingBoxes, refs: RefsBBX, mode="word",needl
 def process_paper(paper: Paper,mode="word",needlink=True,subdirectory=""):
     try:
         TARGET_PATH_S = "%s/%s"%(TARGET_PATH,subdirectory)
-        parser      = ET.XMLParser(recover=True)
         if paper.results is not None and len(paper.results._data) > 0:
-            xml     = ET.parse(f"{TARGET_PATH_S}/{paper.id}/{paper.id}.xml", parser=parser)
-            entries = extract(xml, paper.results, paper.refs, mode=mode,needlink=needlink)
+            xml_path = f"{TARGET_PATH_S}/{paper.id}/{paper.id}.xml"
+            entries = extract_streaming(xml_path, paper.results, paper.refs, mode=mode,needlink=needlink)
             entries["from"] = paper.id
             return entries
         else: